@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Seeded generators of random sparse chains, and writers of the text formats
+read by simple_markov.io, for the benchmarks.
+"""
+import numpy as np
+
+from simple_markov import MarkovChain
+
+def random_chain(transitions, degree=8, seed=0):
+    """
+    Creates a random chain in 'float64' mode with about the given number of
+    transitions. Every state has up to degree transitions to uniformly
+    chosen states, with random probabilities, and labels 's0', 's1', ...
+
+    :param transitions: the number of transitions
+    :param degree: the number of transitions per state
+    :param seed: the seed of the generator
+    :returns: the MarkovChain
+    """
+    from scipy.sparse import csr_matrix
+
+    rng = np.random.default_rng(seed)
+    size = max(transitions // degree, 2)
+    degree = min(degree, size)
+
+    rows = np.repeat(np.arange(size), degree)
+    indices = rng.integers(0, size, size=size * degree)
+    data = rng.random(size * degree) + 0.01
+    data /= np.bincount(rows, weights=data)[rows]
+
+    matrix = csr_matrix((data, (rows, indices)), shape=(size, size))
+    initial = np.zeros(size)
+    initial[0] = 1.0
+    return MarkovChain.from_sparse(
+        matrix, labels=['s%d' % i for i in range(size)], initial=initial
+    )
+
+def _rows(chain):
+    """
+    Iterates over the rows of a chain as labels and lists of
+    label - probability pairs.
+    """
+    compiled = chain.compile()
+    labels = compiled.labels
+    for i, key in enumerate(labels):
+        targets, probs = compiled.row(i)
+        yield key, [(labels[j], p) for j, p in zip(targets, probs.tolist())]
+
+def write_json(chain, filename):
+    """
+    Writes a chain in the format read by JSON_Reader, row by row.
+    """
+    with open(filename, 'w') as f:
+        f.write('{"Initial": {')
+        f.write(', '.join(
+            '"%s": %r' % (k, v) for k, v in chain.initial_probs.items()
+        ))
+        f.write('},\n"Table": {\n')
+        for n, (key, row) in enumerate(_rows(chain)):
+            f.write(',\n' if n else '')
+            f.write('"%s": {%s}' % (
+                key, ', '.join('"%s": %r' % (t, p) for t, p in row)
+            ))
+        f.write('\n}}\n')
+
+def write_yaml(chain, filename):
+    """
+    Writes a chain in the format read by YAML_Reader, row by row.
+    """
+    with open(filename, 'w') as f:
+        f.write('Initial:\n')
+        for key, value in chain.initial_probs.items():
+            f.write('    %s: %r\n' % (key, value))
+        f.write('Table:\n')
+        for key, row in _rows(chain):
+            f.write('    %s:\n' % key)
+            for target, prob in row:
+                f.write('        %s: %r\n' % (target, prob))
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Measures the time it takes to import simple_markov in a fresh interpreter,
+on top of the time it takes to import numpy, and checks that none of the
+optional dependencies are imported along with it.
+
+Usage: python benchmarks/import_time.py [--repeat N] [--max-overhead MS]
+"""
+import argparse, os, subprocess, sys, time
+
+# modules that must only be imported by the features that need them
+OPTIONAL = ('graphviz', 'scipy', 'matplotlib', 'networkx', 'yaml')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run(statement):
+    """
+    Runs a statement in a fresh interpreter.
+
+    :param statement: the python statement to run
+    :returns: a tuple of the wall time in seconds and the process' output
+    """
+    start = time.perf_counter()
+    output = subprocess.check_output(
+        [sys.executable, '-c', statement], cwd=ROOT,
+        universal_newlines=True
+    )
+    return time.perf_counter() - start, output
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=11)
+    parser.add_argument('--max-overhead', type=float, default=None,
+                        help='fail if importing simple_markov takes more '
+                             'than this many milliseconds on top of numpy')
+    args = parser.parse_args()
+
+    _, loaded = run(
+        'import sys, simple_markov, simple_markov.io, simple_markov.drawing; '
+        'print(" ".join(m for m in %r if m in sys.modules))' % (OPTIONAL,)
+    )
+    loaded = loaded.split()
+
+    baseline = median([run('import numpy')[0] for _ in range(args.repeat)])
+    total = median([run('import simple_markov')[0] for _ in range(args.repeat)])
+    overhead = (total - baseline) * 1000
+
+    print('import numpy:          %7.1f ms' % (baseline * 1000))
+    print('import simple_markov:  %7.1f ms' % (total * 1000))
+    print('overhead over numpy:   %7.1f ms' % overhead)
+    print('optional deps loaded:  %s' % (', '.join(loaded) or 'none'))
+
+    if loaded:
+        return 1
+    if args.max_overhead is not None and overhead > args.max_overhead:
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
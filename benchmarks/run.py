@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Times the hot paths of simple_markov on seeded random chains of increasing
+size and writes the results as JSON, so that runs on different commits can
+be compared with --compare.
+
+Usage: python benchmarks/run.py [--sizes 1e2 1e3 ...] [--only NAME ...]
+                                [--repeat N] [--output FILE]
+                                [--compare BASELINE]
+"""
+import argparse, datetime, json, os, platform, shutil, subprocess, sys
+import tempfile, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+from simple_markov import MarkovChain
+from simple_markov.compiled import CompiledChain
+from simple_markov.io import JSON_Reader, YAML_Reader, \
+    JSON_StreamReader, YAML_StreamReader
+
+from generators import random_chain, write_json, write_yaml
+
+DEFAULT_SIZES = [10 ** 2, 10 ** 3, 10 ** 4, 10 ** 5]
+
+def fresh(chain):
+    """
+    Returns a copy of a chain without any of its cached data.
+    """
+    c = chain.compile()
+    return MarkovChain.from_compiled(CompiledChain(
+        c.labels, c.indptr, c.indices, c.data, c.initial, c.index
+    ))
+
+# every benchmark prepares its input outside of the timed region and
+# returns the function to time; the limit is the largest number of
+# transitions it is run for
+
+def bench_next_state(chain, workdir):
+    states = list(chain.states.values())[:1000]
+    states = (states * (100000 // len(states) + 1))[:100000]
+    def run():
+        for state in states:
+            state.next_state()
+    return run
+
+def bench_run_for(chain, workdir):
+    chain = fresh(chain)
+    def run():
+        for _ in chain.run_for(100000):
+            pass
+    return run
+
+def bench_monte_carlo(chain, workdir):
+    chain = fresh(chain)
+    labels = chain.compile().labels
+    term = set(labels[::10])
+    def run():
+        chain.monte_carlo_estimation(1000, term, term, seed=0)
+    return run
+
+def bench_state_probabilities(chain, workdir):
+    chain = fresh(chain)
+    def run():
+        chain.state_probabilities(100)
+    return run
+
+def bench_communication_classes(chain, workdir):
+    chain = fresh(chain)
+    return chain.communication_classes
+
+def bench_class_connections(chain, workdir):
+    chain = fresh(chain)
+    return chain.get_class_connections
+
+def bench_to_dot(chain, workdir):
+    chain = fresh(chain)
+    chain.states
+    return chain.to_dot
+
+def bench_json_reader(chain, workdir):
+    filename = os.path.join(workdir, 'chain.json')
+    if not os.path.exists(filename):
+        write_json(chain, filename)
+    def run():
+        MarkovChain(*JSON_Reader(filename).parse_data(), dtype='float64')
+    return run
+
+def bench_json_stream_reader(chain, workdir):
+    filename = os.path.join(workdir, 'chain.json')
+    if not os.path.exists(filename):
+        write_json(chain, filename)
+    return JSON_StreamReader(filename).compile
+
+def bench_yaml_reader(chain, workdir):
+    filename = os.path.join(workdir, 'chain.yaml')
+    if not os.path.exists(filename):
+        write_yaml(chain, filename)
+    def run():
+        MarkovChain(*YAML_Reader(filename).parse_data(), dtype='float64')
+    return run
+
+def bench_yaml_stream_reader(chain, workdir):
+    filename = os.path.join(workdir, 'chain.yaml')
+    if not os.path.exists(filename):
+        write_yaml(chain, filename)
+    return YAML_StreamReader(filename).compile
+
+BENCHMARKS = [
+    ('State.next_state', bench_next_state, 10 ** 6),
+    ('run_for', bench_run_for, 10 ** 7),
+    ('monte_carlo_estimation', bench_monte_carlo, 10 ** 7),
+    ('state_probabilities', bench_state_probabilities, 10 ** 7),
+    ('communication_classes', bench_communication_classes, 10 ** 7),
+    ('get_class_connections', bench_class_connections, 10 ** 7),
+    ('to_dot', bench_to_dot, 10 ** 5),
+    ('JSON_Reader', bench_json_reader, 10 ** 6),
+    ('JSON_StreamReader', bench_json_stream_reader, 10 ** 6),
+    ('YAML_Reader', bench_yaml_reader, 10 ** 5),
+    ('YAML_StreamReader', bench_yaml_stream_reader, 10 ** 5)
+]
+
+def environment():
+    """
+    Describes the machine and the code the benchmarks ran on.
+    """
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT, universal_newlines=True,
+            stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'commit': commit,
+        'date': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor()
+    }
+
+def compare(results, baseline):
+    """
+    Prints the ratio of every median time to the baseline's.
+    """
+    previous = {
+        (r['name'], r['transitions']): r['median'] for r in baseline['results']
+    }
+    print('\ncompared to %s:' % (baseline['environment']['commit'],))
+    for r in results:
+        key = (r['name'], r['transitions'])
+        if key in previous:
+            print('%-24s %10d  %6.2fx' % (
+                r['name'], r['transitions'], r['median'] / previous[key]
+            ))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', type=float, nargs='+', default=DEFAULT_SIZES,
+                        help='numbers of transitions, up to 1e7')
+    parser.add_argument('--only', nargs='+', default=None,
+                        help='names of the benchmarks to run')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--compare', default=None,
+                        help='a previous results file to compare with')
+    args = parser.parse_args()
+
+    results = []
+    for transitions in (int(n) for n in args.sizes):
+        chain = random_chain(transitions, seed=args.seed)
+        workdir = tempfile.mkdtemp(prefix='simple-markov-bench-')
+        try:
+            for name, setup, limit in BENCHMARKS:
+                if args.only and name not in args.only or transitions > limit:
+                    continue
+
+                times = []
+                for _ in range(args.repeat):
+                    run = setup(chain, workdir)
+                    start = time.perf_counter()
+                    run()
+                    times.append(time.perf_counter() - start)
+
+                result = {
+                    'name': name,
+                    'transitions': transitions,
+                    'states': chain.compile().size,
+                    'times': times,
+                    'median': float(np.median(times)),
+                    'min': min(times)
+                }
+                results.append(result)
+                print('%-24s %10d  %10.4f s' % (
+                    name, transitions, result['median']
+                ))
+                sys.stdout.flush()
+        finally:
+            shutil.rmtree(workdir)
+
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment(), 'results': results}, f,
+                  indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+if __name__ == '__main__':
+    main()
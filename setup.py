@@ -1,4 +1,4 @@
-from distutils.core import setup
+from setuptools import setup
 
 setup(
     name = 'simple-markov',
@@ -20,10 +20,16 @@ setup(
     ],
 
     install_requires = [
-        'numpy',
-        'scipy',
-        'matplotlib',
-        'graphviz',
-        'networkx'
-    ]
+        'numpy'
+    ],
+
+    # dependencies imported only by the features that use them; gmres()
+    # takes rtol since scipy 1.12
+    extras_require = {
+        'sparse': ['scipy>=1.12'],
+        'graphviz': ['graphviz'],
+        'drawing': ['matplotlib', 'networkx'],
+        'yaml': ['pyyaml'],
+        'all': ['scipy>=1.12', 'graphviz', 'matplotlib', 'networkx', 'pyyaml']
+    }
 )
@@ -1,2 +1,5 @@
 # A package
 from .lib import MarkovChain, State
+from .walker import Walker
+from .ctmc import ContinuousTimeMarkovChain
+from .instrumentation import metrics
@@ -0,0 +1,1293 @@
+# -*- coding: utf-8 -*-
+import operator
+from array import array
+from collections import OrderedDict
+
+import numpy as np
+
+from simple_markov.utils import alias_table, csr_strongly_connected_components
+from simple_markov.instrumentation import metrics, timed
+
+# default number of transitions per block of streamed products, see
+# CompiledChain.vecmat_blocked()
+STREAM_BLOCK = 1 << 20
+
+def _frozen(array, dtype, kind):
+    """
+    Returns a read-only view of an array, converting it to the given dtype
+    only if its elements are not already of the expected kind.
+
+    :param array: an array-like object
+    :param dtype: the dtype to convert to, if a conversion is needed
+    :param kind: a string of acceptable numpy dtype kinds (e.g. 'iu')
+    :returns: a read-only numpy array
+    """
+    array = np.asarray(array)
+    if array.dtype.kind not in kind:
+        array = array.astype(dtype)
+    array = array.view()
+    array.flags.writeable = False
+    return array
+
+def gather(indptr, indices, rows):
+    """
+    Collects the entries of several rows of a CSR structure at once.
+
+    :param indptr: the row pointers
+    :param indices: the column indices
+    :param rows: an integer array of row indices
+    :returns: the concatenated column indices of the given rows
+    """
+    starts, lengths = indptr[rows], indptr[rows + 1] - indptr[rows]
+    offsets = np.cumsum(lengths) - lengths
+    positions = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+    return indices[positions]
+
+def validate_rows(labels, rows, data, atol):
+    """
+    Checks that every row of a transition table forms a probability
+    distribution, up to an absolute tolerance, reporting all offending
+    rows at once.
+
+    :param labels: the label of every row
+    :param rows: the row of every transition
+    :param data: the probability of every transition
+    :param atol: the absolute tolerance
+    """
+    # written so that NaN fails the checks
+    sums = np.bincount(rows, weights=data, minlength=len(labels))
+    bad = ~(np.abs(sums - 1) <= atol)
+    bad[rows[~((data >= 0) & (data <= 1))]] = True
+
+    bad = np.flatnonzero(bad)
+    if len(bad) == 1:
+        raise ValueError("Transitions from state " + str(labels[bad[0]]) +
+                " do not form a probability distribution")
+    if len(bad) > 1:
+        raise ValueError("Transitions from states " +
+                ", ".join(str(labels[i]) for i in bad) +
+                " do not form probability distributions")
+
+def initial_vector(initial_distrib, labels, index, atol):
+    """
+    Converts an initial distribution to a float64 vector over the states
+    and checks that it is a probability distribution, up to an absolute
+    tolerance.
+
+    :param initial_distrib: a map of states to initial probabilities, an
+     array-like with one probability per state, or None for the uniform
+     distribution
+    :param labels: the state labels
+    :param index: a map of labels to state indices
+    :param atol: the absolute tolerance
+    :returns: the initial probability vector
+    """
+    if initial_distrib is None:
+        return np.full(len(labels), 1.0 / len(labels))
+
+    if isinstance(initial_distrib, dict):
+        initial = np.zeros(len(labels))
+        try:
+            for key, val in initial_distrib.items():
+                if float(val) != 0:
+                    initial[index[key]] = float(val)
+        except KeyError as e:
+            raise ValueError(
+                "State " + str(e.args[0]) + " has no outgoing transitions"
+            )
+    else:
+        initial = np.asarray(initial_distrib, dtype=np.float64)
+        if initial.shape != (len(labels),):
+            raise ValueError("Initial probabilities must match the states")
+
+    if not abs(initial.sum() - 1) <= atol or not (initial >= 0).all():
+        raise ValueError(
+            "Initial probabilities don't form a proper distribution"
+        )
+    return initial
+
+class CompiledChain(object):
+    """
+    A frozen, integer-indexed representation of a markov chain. States are
+    identified by their position in the label table and the transition
+    table is kept in compressed sparse row (CSR) format, where the
+    transitions of state i are found at positions indptr[i] up to
+    indptr[i + 1] of the indices (target states) and data (probabilities)
+    arrays.
+    """
+
+    def __init__(self, labels, indptr, indices, data, initial, index=None):
+        """
+        Creates a new compiled chain from its label table and the arrays
+        of its transition table in CSR format.
+
+        :param labels: a sequence of state labels, one per row
+        :param indptr: the row pointers of the transition table
+        :param indices: the target state of every transition
+        :param data: the probability of every transition
+        :param initial: the initial probability of every state
+        :param index: a map of labels to state indices, if already known
+        """
+        self.labels = list(labels)
+        self.index = index if index is not None else \
+            {key: i for i, key in enumerate(self.labels)}
+        self.indptr = _frozen(indptr, np.int64, 'iu')
+        self.indices = _frozen(indices, np.int64, 'iu')
+        self.data = _frozen(data, np.float64, 'f')
+        self.initial = _frozen(initial, np.float64, 'f')
+
+        # lazily built alias tables, one per row
+        self._rows = [None] * len(self.labels)
+        # optional cache of the binary powers of the matrix, see PowerCache
+        self.power_cache = None
+
+    @classmethod
+    def from_states(cls, states, initial_probs):
+        """
+        Compiles a map of label-to-state pairs, as kept by MarkovChain,
+        along with a map of initial probabilities. Labels are sorted for
+        a stable representation.
+
+        :param states: a map of labels to State objects
+        :param initial_probs: a map of labels to initial probabilities
+        :returns: the compiled chain
+        """
+        labels = sorted(key for key in states)
+        index = {key: i for i, key in enumerate(labels)}
+
+        try:
+            targets = [
+                [index[t] for t in states[key].targets] for key in labels
+            ]
+            for key, val in initial_probs.items():
+                if val != 0:
+                    index[key]
+        except KeyError as e:
+            raise ValueError(
+                "State " + str(e.args[0]) + " has no outgoing transitions"
+            )
+
+        lengths = np.array([len(t) for t in targets], dtype=np.int64)
+        indptr = np.zeros(len(labels) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        indices = np.fromiter(
+            (t for row in targets for t in row), dtype=np.int64,
+            count=indptr[-1]
+        )
+        data = np.fromiter(
+            (float(v) for key in labels for v in states[key].prob.values()),
+            dtype=np.float64, count=indptr[-1]
+        )
+        initial = np.array([
+            float(initial_probs.get(key, 0)) for key in labels
+        ], dtype=np.float64)
+
+        return cls(labels, indptr, indices, data, initial)
+
+    @classmethod
+    def from_table(cls, initial_distrib, transition_table, atol=1e-12):
+        """
+        Compiles a transition table, as given to the MarkovChain constructor,
+        directly into float64 arrays, without creating State objects. Zero
+        probabilities are dropped and the rows are validated at once, up to
+        an absolute tolerance. Labels are sorted for a stable representation.
+
+        :param initial_distrib: a map of states to initial probabilities
+        :param transition_table: a map of states to iterables of
+         state - transition probability pairs
+        :param atol: the absolute tolerance of the validation
+        :returns: the compiled chain
+        """
+        labels = sorted(key for key in transition_table)
+        index = {key: i for i, key in enumerate(labels)}
+
+        try:
+            lengths = np.array(
+                [len(transition_table[key]) for key in labels], dtype=np.int64
+            )
+            indices = np.fromiter(
+                (index[d[0]] for key in labels for d in transition_table[key]),
+                dtype=np.int64, count=lengths.sum()
+            )
+        except KeyError as e:
+            raise ValueError(
+                "State " + str(e.args[0]) + " has no outgoing transitions"
+            )
+
+        data = np.fromiter(
+            (float(d[1]) for key in labels for d in transition_table[key]),
+            dtype=np.float64, count=lengths.sum()
+        )
+        rows = np.repeat(np.arange(len(labels)), lengths)
+
+        initial = initial_vector(initial_distrib, labels, index, atol)
+        validate_rows(labels, rows, data, atol)
+
+        # drop transitions with zero probability
+        keep = data != 0
+        rows, indices, data = rows[keep], indices[keep], data[keep]
+
+        # merge repeated transitions by adding their probabilities
+        keys, inverse = np.unique(
+            rows * len(labels) + indices, return_inverse=True
+        )
+        if len(keys) < len(data):
+            data = np.bincount(inverse, weights=data)
+            rows, indices = keys // len(labels), keys % len(labels)
+        indptr = np.zeros(len(labels) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(labels)), out=indptr[1:])
+
+        return cls(labels, indptr, indices, data, initial)
+
+    @classmethod
+    def from_arrays(cls, indptr, indices, data, labels=None, initial=None,
+                    atol=1e-12, validate=True):
+        """
+        Compiles a transition table given in CSR format, adopting the arrays
+        without copying them whenever they are already of an integer and a
+        float64 type respectively and hold no zero probabilities.
+
+        :param indptr: the row pointers of the transition table
+        :param indices: the target state of every transition
+        :param data: the probability of every transition
+        :param labels: a sequence of state labels, state indices by default
+        :param initial: the initial distribution, see initial_vector()
+        :param atol: the absolute tolerance of the validation
+        :param validate: set to False to skip validating the rows
+        :returns: the compiled chain
+        """
+        indptr, indices = np.asarray(indptr), np.asarray(indices)
+        data = np.asarray(data, dtype=np.float64)
+        size = len(indptr) - 1
+
+        if labels is None:
+            labels = list(range(size))
+        elif isinstance(labels, np.ndarray):
+            # plain python labels, rather than numpy scalars
+            labels = labels.tolist()
+        else:
+            labels = list(labels)
+        if len(labels) != size:
+            raise ValueError("Number of labels must match the states")
+        index = {key: i for i, key in enumerate(labels)}
+        if len(index) != size:
+            raise ValueError("State labels must be unique")
+
+        if validate:
+            if len(indices) and (indices.min() < 0 or indices.max() >= size):
+                raise ValueError("Transitions lead to unknown states")
+            rows = np.repeat(np.arange(size), np.diff(indptr))
+            validate_rows(labels, rows, data, atol)
+
+            # zero probabilities would show up as edges of the digraph
+            zeros = data == 0
+            if zeros.any():
+                indptr = np.concatenate(([0], np.cumsum(
+                    np.bincount(rows[~zeros], minlength=size)
+                )))
+                indices, data = indices[~zeros], data[~zeros]
+
+        initial = initial_vector(initial, labels, index, atol)
+        return cls(labels, indptr, indices, data, initial, index)
+
+    @property
+    def size(self):
+        """
+        The number of states of the chain.
+        """
+        return len(self.labels)
+
+    @property
+    def nnz(self):
+        """
+        The number of transitions with non-zero probability.
+        """
+        return len(self.data)
+
+    def row(self, i):
+        """
+        Returns the transitions of a state.
+
+        :param i: the index of the state
+        :returns: a tuple of two arrays, the indices of the target states
+         and the transition probabilities
+        """
+        start, end = self.indptr[i], self.indptr[i + 1]
+        return self.indices[start:end], self.data[start:end]
+
+    def cumulative(self):
+        """
+        Returns the running sums of the transition probabilities within
+        every row: the transition of state i at position k covers the
+        interval of [0, 1) that ends at cumulative()[k]. The sums are taken
+        within each row, by a segmented scan, so that their precision does
+        not depend on the number of states.
+
+        :returns: a read-only array with one entry per transition
+        """
+        try:
+            return self._cumulative
+        except AttributeError:
+            pass
+
+        lengths = np.diff(self.indptr)
+        positions = np.arange(self.nnz)
+        starts = np.repeat(self.indptr[:-1], lengths)
+
+        # Hillis-Steele scan, adding the partial sum shift positions back
+        # as long as it belongs to the same row
+        cumulative = np.array(self.data, dtype=np.float64)
+        shift = 1
+        while shift < (lengths.max() if len(lengths) else 0):
+            inside = np.flatnonzero(positions - shift >= starts)
+            cumulative[inside] = cumulative[inside] + cumulative[inside - shift]
+            shift *= 2
+
+        # the last entry of every row is pinned to 1 to absorb rounding
+        # errors
+        cumulative[self.indptr[1:][lengths > 0] - 1] = 1.0
+
+        self._cumulative = _frozen(cumulative, np.float64, 'f')
+        return self._cumulative
+
+    def initial_cumulative(self):
+        """
+        Returns the running sums of the initial probabilities, with the
+        last entry pinned to 1.
+
+        :returns: a read-only array with one entry per state
+        """
+        try:
+            return self._initial_cumulative
+        except AttributeError:
+            cumulative = np.cumsum(self.initial)
+            cumulative[-1] = 1.0
+            self._initial_cumulative = _frozen(cumulative, np.float64, 'f')
+            return self._initial_cumulative
+
+    def initial_state(self, toss):
+        """
+        Chooses an initial state given a coin toss in the range [0, 1).
+
+        :param toss: a number in the range [0, 1)
+        :returns: the index of the chosen state
+        """
+        i = int(np.searchsorted(self.initial_cumulative(), toss, side='right'))
+        return min(i, self.size - 1)
+
+    def step(self, i, toss):
+        """
+        Chooses the next state of state i in constant time, using the
+        row's alias table which is built the first time the row is visited.
+
+        :param i: the index of the current state
+        :param toss: a number in the range [0, 1)
+        :returns: the index of the next state
+        """
+        row = self._rows[i]
+        if row is None:
+            targets, probs = self.row(i)
+            prob, alias = alias_table(probs.tolist())
+            row = self._rows[i] = (targets.tolist(), prob, alias)
+
+        targets, prob, alias = row
+        toss *= len(prob)
+        column = int(toss)
+        if toss - column >= prob[column]:
+            column = alias[column]
+        return targets[column]
+
+    def step_batch(self, current, tosses):
+        """
+        Chooses the next state of many walkers at once.
+
+        :param current: an integer array with the walkers' current states
+        :param tosses: an array of numbers in the range [0, 1), one per walker
+        :returns: an integer array with the walkers' next states
+        """
+        cumulative = self.cumulative()
+        # binary search of every walker's toss within its own row, for the
+        # first transition whose running sum exceeds it
+        low = self.indptr[current]
+        high = self.indptr[current + 1] - 1
+        searching = np.flatnonzero(low < high)
+        while searching.size:
+            lo, hi = low[searching], high[searching]
+            middle = (lo + hi) // 2
+            right = cumulative[middle] <= tosses[searching]
+            low[searching] = np.where(right, middle + 1, lo)
+            high[searching] = np.where(right, hi, middle)
+            searching = searching[low[searching] < high[searching]]
+        return self.indices[low]
+
+    def components(self):
+        """
+        Finds the strongly connected components of the chain's digraph,
+        i.e. its communication classes. The result is cached.
+
+        :returns: a tuple of an integer array with the class of every state
+         and a boolean array that marks the closed classes
+        """
+        try:
+            return self._components
+        except AttributeError:
+            self._components = csr_strongly_connected_components(
+                self.indptr, self.indices
+            )
+            return self._components
+
+    def classes(self):
+        """
+        Groups the states of the chain by communication class.
+
+        :returns: a list of integer arrays, the states of every class in
+         the numbering of components()
+        """
+        components, closed = self.components()
+        order = np.argsort(components, kind='stable')
+        bounds = np.cumsum(np.bincount(components, minlength=len(closed)))
+        return np.split(order, bounds[:-1])
+
+    def class_graph(self):
+        """
+        Returns the condensation of the chain's digraph, see ClassGraph.
+        The result is cached.
+
+        :returns: the chain's ClassGraph
+        """
+        try:
+            return self._class_graph
+        except AttributeError:
+            self._class_graph = ClassGraph(self)
+            return self._class_graph
+
+    def predecessors(self):
+        """
+        Returns the reverse digraph of the chain in CSR format: the states
+        that lead to state i are found at positions indptr[i] up to
+        indptr[i + 1] of the returned indices.
+
+        :returns: a tuple of the reverse digraph's indptr and indices
+        """
+        try:
+            return self._predecessors
+        except AttributeError:
+            pass
+
+        rows = np.repeat(np.arange(self.size), np.diff(self.indptr))
+        order = np.argsort(self.indices, kind='stable')
+        indptr = np.zeros(self.size + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(self.indices, minlength=self.size), out=indptr[1:]
+        )
+        self._predecessors = (
+            _frozen(indptr, np.int64, 'iu'), _frozen(rows[order], np.int64, 'iu')
+        )
+        return self._predecessors
+
+    def reaching(self, targets, blocked=None):
+        """
+        Finds all states that can reach a set of target states, by a
+        breadth-first search on the reverse digraph. Paths may not pass
+        through blocked states.
+
+        :param targets: a boolean array marking the target states
+        :param blocked: a boolean array marking the blocked states
+        :returns: a boolean array marking the states that can reach the
+         targets, including the targets themselves
+        """
+        indptr, indices = self.predecessors()
+        seen = np.array(targets, dtype=bool)
+        if blocked is not None:
+            seen_or_blocked = seen | blocked
+        else:
+            seen_or_blocked = seen.copy()
+
+        frontier = np.flatnonzero(seen)
+        while frontier.size:
+            found = gather(indptr, indices, frontier)
+            found = np.unique(found[~seen_or_blocked[found]])
+            seen[found] = seen_or_blocked[found] = True
+            frontier = found
+        return seen
+
+    def matrix(self):
+        """
+        Returns the transition matrix of the chain. If scipy is available,
+        the matrix is a scipy.sparse.csr_matrix that shares the compiled
+        arrays, otherwise a dense numpy array.
+
+        :returns: the transition matrix
+        """
+        try:
+            return self._matrix
+        except AttributeError:
+            pass
+        return self._build_matrix()
+
+    @timed('matrix', lambda result, self: {
+        'states': self.size, 'transitions': self.nnz
+    })
+    def _build_matrix(self):
+        """
+        Builds the matrix returned by matrix().
+        """
+        # if scipy is available, use its sparse matrix
+        try:
+            from scipy.sparse import csr_matrix
+            self._matrix = csr_matrix(
+                (self.data, self.indices, self.indptr),
+                shape=(self.size, self.size)
+            )
+        # No scipy available, use simple numpy instead
+        except ImportError:
+            self._matrix = np.zeros(shape=(self.size, self.size))
+            rows = np.repeat(np.arange(self.size), np.diff(self.indptr))
+            self._matrix[rows, self.indices] = self.data
+
+        return self._matrix
+
+    def transposed(self):
+        """
+        Returns the transpose of the transition matrix, in CSR format if
+        scipy is available, so that products of row vectors with the
+        transition matrix can be computed as matrix - vector products.
+
+        :returns: the transposed transition matrix
+        """
+        try:
+            return self._transposed
+        except AttributeError:
+            matrix = self.matrix()
+            try:
+                self._transposed = matrix.T.tocsr()
+            except AttributeError:
+                self._transposed = np.ascontiguousarray(matrix.T)
+            return self._transposed
+
+    def _stored(self):
+        """
+        The number of entries stored by matrix(): the number of transitions
+        for sparse matrices, size * size for dense ones.
+        """
+        return self.size ** 2 if isinstance(self.matrix(), np.ndarray) \
+            else self.nnz
+
+    def _filled_bytes(self):
+        """
+        An upper bound of the memory taken by a power of the transition
+        matrix once it has filled in, in bytes.
+        """
+        matrix = self.matrix()
+        if isinstance(matrix, np.ndarray):
+            return matrix.nbytes
+        # scipy may widen the indices of the products to int64
+        return self.size ** 2 * (matrix.data.itemsize + 8) + \
+            (self.size + 1) * 8
+
+    def use_squaring(self, steps):
+        """
+        Decides how to compute a distribution after a number of steps. The
+        repeated product of the distribution with the transition matrix
+        costs about steps * nnz operations, while repeated squaring needs
+        log2(steps) matrix products which, after the powers fill in, cost
+        up to size^3 each.
+
+        :param steps: the number of steps
+        :returns: True if repeated squaring is expected to be cheaper
+        """
+        steps = operator.index(steps)
+        squarings = steps.bit_length()
+        return steps * self._stored() > squarings * self.size ** 3
+
+    def vecmat(self, vector):
+        """
+        Computes the product of a row vector with the transition matrix.
+
+        :param vector: an array with one entry per state
+        :returns: the product vector * P as an array
+        """
+        return self.transposed().dot(vector)
+
+    def row_blocks(self, block_size):
+        """
+        Splits the rows into consecutive blocks holding about block_size
+        transitions each; a row longer than block_size forms a block alone.
+
+        :param block_size: the number of transitions per block
+        :returns: an integer array of the first row of every block, followed
+         by the number of rows
+        """
+        starts = np.searchsorted(
+            self.indptr, np.arange(0, self.nnz, block_size), side='right'
+        ) - 1
+        return np.unique(np.append(starts, self.size))
+
+    def _read_block(self, first, last):
+        """
+        Copies the part of the transition table of rows first up to last,
+        which reads it from disk for memory-mapped chains.
+
+        :returns: a tuple of the rows' indptr, indices and data
+        """
+        indptr = np.array(self.indptr[first:last + 1])
+        return (
+            indptr,
+            np.array(self.indices[indptr[0]:indptr[-1]]),
+            np.array(self.data[indptr[0]:indptr[-1]])
+        )
+
+    def _block_product(self, vector, first, last, out, block=None):
+        """
+        Adds the contribution of rows first up to last to vector * P into
+        out, touching only the entries of the rows' targets.
+
+        :param out: the array accumulating the product
+        :param block: the rows' arrays as returned by _read_block(), read
+         now if not given
+        """
+        indptr, indices, data = block or self._read_block(first, last)
+        if not len(indices):
+            return
+        data *= np.repeat(vector[first:last], np.diff(indptr))
+
+        low, high = indices.min(), indices.max() + 1
+        if high - low <= 2 * len(indices):
+            # the targets are close together, as in banded chains, so sum
+            # them over their own slice of the result
+            out[low:high] += np.bincount(
+                indices - low, weights=data, minlength=high - low
+            )
+        else:
+            np.add.at(out, indices, data)
+
+    def _share_product(self, vector, blocks):
+        """
+        Computes the contribution of a worker's share of the blocks to
+        vector * P, in a vector of its own.
+
+        :param blocks: a list of (first, last) row ranges
+        :returns: the partial product as an array
+        """
+        out = np.zeros(self.size)
+        for first, last in blocks:
+            self._block_product(vector, first, last, out)
+        return out
+
+    def vecmat_blocked(self, vector, block_size=STREAM_BLOCK, workers=None):
+        """
+        Computes the product of a row vector with the transition matrix
+        block by block of rows, directly from the CSR arrays. Only a few
+        blocks of the transition table are in memory at a time, so the
+        arrays may be memory-mapped from a file larger than the memory, e.g.
+        by io.Binary_Reader. Blocks whose rows have zero probability are not
+        read at all, and every block only adds to the entries of its
+        targets.
+
+        Without workers, the next block is read in a background thread while
+        the current one is added to the result. With workers, every thread
+        takes a fixed share of the blocks, interleaved, and adds them to a
+        vector of its own; the vectors are summed in worker order, so the
+        result only depends on the number of workers. The memory used is
+        about one block and one vector per worker.
+
+        :param vector: an array with one entry per state
+        :param block_size: the number of transitions per block
+        :param workers: the number of threads multiplying blocks
+        :returns: the product vector * P as an array
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        vector = np.asarray(vector, dtype=np.float64)
+        bounds = self.row_blocks(block_size)
+        blocks = [
+            (first, last) for first, last in zip(bounds[:-1], bounds[1:])
+            if vector[first:last].any()
+        ]
+
+        result = np.zeros(self.size)
+        if not blocks:
+            return result
+
+        if workers is None or workers == 1:
+            with ThreadPoolExecutor(max_workers=1) as reader:
+                pending = reader.submit(self._read_block, *blocks[0])
+                for k, (first, last) in enumerate(blocks):
+                    block = pending.result()
+                    if k + 1 < len(blocks):
+                        pending = reader.submit(
+                            self._read_block, *blocks[k + 1]
+                        )
+                    self._block_product(vector, first, last, result, block)
+            return result
+
+        shares = [blocks[k::workers] for k in range(workers)]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for partial in pool.map(
+                    self._share_product, [vector] * workers, shares):
+                result += partial
+        return result
+
+    def propagate(self, vector, steps, block_size=None, workers=None):
+        """
+        Computes the distribution of the chain after a number of steps,
+        pi * P^steps, without ever converting the transition matrix to a
+        dense one. Depending on use_squaring(), it either multiplies the
+        distribution with the transition matrix once per step or combines
+        the binary powers P^(2^i) of the matrix.
+
+        If a power cache is enabled (see cache_powers()), the binary powers
+        are looked up in the cache before being computed, and squaring is
+        also chosen whenever all the powers needed are cached. If the
+        powers could not all fit in the cache's budget once filled in, the
+        cache is bypassed.
+
+        If block_size is given, the distribution is instead streamed through
+        the transition table once per step with vecmat_blocked(), which
+        bounds the memory used for chains too large to hold in memory.
+
+        :param vector: the initial distribution pi
+        :param steps: the number of steps
+        :param block_size: the number of transitions per streamed block
+        :param workers: the number of threads multiplying streamed blocks
+        :returns: the distribution after the given number of steps
+        """
+        # accept numpy integers, which lack bit_length()
+        steps = operator.index(steps)
+        if steps < 0:
+            raise ValueError("Number of steps must be non-negative")
+
+        vector = np.array(vector, dtype=np.float64)
+        if block_size is not None:
+            for _ in range(steps):
+                vector = self.vecmat_blocked(vector, block_size, workers)
+            return vector
+
+        squaring = self.use_squaring(steps)
+        cache = self.power_cache
+        if cache is not None:
+            levels = range(1, steps.bit_length())
+            if all(cache.cached(level) is not None for level in levels):
+                # only the products of the vector with the powers remain
+                squaring = steps * self._stored() > \
+                    steps.bit_length() * self.size ** 2
+            elif not cache.fits(levels, self._filled_bytes()):
+                # the powers would evict each other, so that every call
+                # squares the matrix again
+                cache = None
+        if not squaring:
+            for _ in range(steps):
+                vector = self.vecmat(vector)
+            return vector
+
+        # walk through the bits of steps, squaring the matrix as we go
+        power, level = self.matrix(), 0
+        while steps:
+            if steps & 1:
+                vector = power.T.dot(vector)
+            steps >>= 1
+            if steps:
+                level += 1
+                power = power.dot(power) if cache is None else \
+                    cache.get(level, power)
+        return vector
+
+    def cache_powers(self, max_bytes):
+        """
+        Enables a cache of the binary powers P^(2^i) of the transition
+        matrix, used by propagate(), so that distributions at many horizons
+        reuse the same squarings. Chains derived from this one by
+        replace_row() and friends take the cache over, emptied, so that the
+        returned object keeps following the latest version of the chain.
+
+        :param max_bytes: the memory budget of the cache, in bytes, or None
+         to disable it
+        :returns: the PowerCache, or None
+        """
+        self.power_cache = None if max_bytes is None else PowerCache(max_bytes)
+        return self.power_cache
+
+    def _derived(self, chain):
+        """
+        Passes the settings of this chain on to a chain derived from it.
+        The power cache is moved to the derived chain and emptied, as its
+        powers belong to this chain's matrix.
+
+        :param chain: the derived CompiledChain
+        :returns: the derived chain
+        """
+        if self.power_cache is not None:
+            chain.power_cache, self.power_cache = self.power_cache, None
+            chain.power_cache.clear()
+        return chain
+
+    def _carry(self, chain, names):
+        """
+        Copies the caches that are still valid to a chain derived from this
+        one.
+
+        :param chain: the derived CompiledChain
+        :param names: the attribute names of the caches to copy
+        """
+        for name in names:
+            try:
+                setattr(chain, name, getattr(self, name))
+            except AttributeError:
+                pass
+
+    def replace_row(self, i, targets, probs):
+        """
+        Derives a chain whose state i has different transitions. The arrays
+        of this chain are left intact; alias tables and the cumulative
+        array are patched, and the classes are kept if the row's targets
+        have not changed.
+
+        :param i: the index of the state
+        :param targets: an integer array of the new target states
+        :param probs: the probability of every target, already validated
+        :returns: the derived CompiledChain
+        """
+        targets = np.asarray(targets, dtype=np.int64)
+        probs = np.asarray(probs, dtype=np.float64)
+        order = np.argsort(targets, kind='stable')
+        targets, probs = targets[order], probs[order]
+
+        start, end = self.indptr[i], self.indptr[i + 1]
+        indptr = self.indptr.copy()
+        indptr[i + 1:] += len(targets) - (end - start)
+        chain = CompiledChain(
+            self.labels,
+            indptr,
+            np.concatenate((self.indices[:start], targets, self.indices[end:])),
+            np.concatenate((self.data[:start], probs, self.data[end:])),
+            self.initial, self.index
+        )
+
+        chain._rows = list(self._rows)
+        chain._rows[i] = None
+        try:
+            cumulative = self._cumulative
+        except AttributeError:
+            pass
+        else:
+            row = np.cumsum(probs)
+            row[-1:] = 1.0
+            chain._cumulative = _frozen(np.concatenate(
+                (cumulative[:start], row, cumulative[end:])
+            ), np.float64, 'f')
+
+        self._carry(chain, ['_initial_cumulative'])
+        # the classes only depend on which transitions are possible
+        if np.array_equal(np.sort(self.indices[start:end]), targets):
+            self._carry(chain, ['_components', '_class_graph', '_predecessors'])
+        return self._derived(chain)
+
+    def append_state(self, label, targets, probs):
+        """
+        Derives a chain with an extra state, with zero initial probability,
+        placed after all the existing ones. As no state leads to it yet, it
+        forms a class of its own.
+
+        :param label: the label of the new state
+        :param targets: an integer array of the target states, where the
+         new state is numbered size
+        :param probs: the probability of every target, already validated
+        :returns: the derived CompiledChain
+        """
+        size = self.size
+        targets = np.asarray(targets, dtype=np.int64)
+        probs = np.asarray(probs, dtype=np.float64)
+        order = np.argsort(targets, kind='stable')
+        targets, probs = targets[order], probs[order]
+
+        index = dict(self.index)
+        index[label] = size
+        chain = CompiledChain(
+            self.labels + [label],
+            np.append(self.indptr, self.indptr[-1] + len(targets)),
+            np.concatenate((self.indices, targets)),
+            np.concatenate((self.data, probs)),
+            np.append(self.initial, 0.0), index
+        )
+
+        chain._rows = self._rows + [None]
+        try:
+            cumulative = self._cumulative
+        except AttributeError:
+            pass
+        else:
+            row = np.cumsum(probs)
+            row[-1:] = 1.0
+            chain._cumulative = _frozen(
+                np.concatenate((cumulative, row)), np.float64, 'f'
+            )
+        try:
+            components, closed = self._components
+        except AttributeError:
+            pass
+        else:
+            chain._components = (
+                np.append(components, len(closed)),
+                np.append(closed, bool((targets == size).all()))
+            )
+        return self._derived(chain)
+
+    def remove_state(self, i):
+        """
+        Derives a chain without state i, which must have zero initial
+        probability and must not be reachable from any other state in one
+        step. States after it are renumbered.
+
+        :param i: the index of the state
+        :returns: the derived CompiledChain
+        """
+        rows = np.repeat(np.arange(self.size), np.diff(self.indptr))
+        sources = rows[(self.indices == i) & (rows != i)]
+        if len(sources):
+            raise ValueError("State " + str(self.labels[i]) +
+                    " is reachable from state " + str(self.labels[sources[0]]))
+        if self.initial[i] != 0:
+            raise ValueError("State " + str(self.labels[i]) +
+                    " has a non-zero initial probability")
+
+        start, end = self.indptr[i], self.indptr[i + 1]
+        indptr = np.delete(self.indptr, i + 1)
+        indptr[i + 1:] -= end - start
+        indices = np.concatenate((self.indices[:start], self.indices[end:]))
+        indices[indices > i] -= 1
+        chain = CompiledChain(
+            self.labels[:i] + self.labels[i + 1:],
+            indptr,
+            indices,
+            np.concatenate((self.data[:start], self.data[end:])),
+            np.delete(self.initial, i)
+        )
+
+        try:
+            cumulative = self._cumulative
+        except AttributeError:
+            pass
+        else:
+            chain._cumulative = _frozen(np.concatenate(
+                (cumulative[:start], cumulative[end:])
+            ), np.float64, 'f')
+        try:
+            components, closed = self._components
+        except AttributeError:
+            pass
+        else:
+            # the state is a class of its own, so the others keep theirs
+            c = components[i]
+            components = np.delete(components, i)
+            components[components > c] -= 1
+            chain._components = (components, np.delete(closed, c))
+        return self._derived(chain)
+
+class PowerCache(object):
+    """
+    A least recently used cache of the binary powers P^(2^i), i > 0, of a
+    transition matrix, bounded by a memory budget. Hits and misses are
+    counted, so that the cache can be sized from its statistics.
+    """
+
+    def __init__(self, max_bytes):
+        """
+        :param max_bytes: the memory budget of the cache, in bytes
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._powers = OrderedDict()
+
+    @staticmethod
+    def size_of(matrix):
+        """
+        Returns the memory taken by a sparse or dense matrix, in bytes.
+        """
+        try:
+            return matrix.data.nbytes + matrix.indices.nbytes + \
+                matrix.indptr.nbytes
+        except AttributeError:
+            return matrix.nbytes
+
+    def get(self, level, previous):
+        """
+        Returns P^(2^level), squaring P^(2^(level - 1)) on a miss.
+
+        :param level: the binary exponent, at least 1
+        :param previous: the power P^(2^(level - 1))
+        :returns: the power P^(2^level)
+        """
+        try:
+            power = self._powers[level]
+        except KeyError:
+            self.misses += 1
+            if metrics.enabled:
+                metrics.count('power_cache.misses')
+            power = previous.dot(previous)
+            self._store(level, power)
+        else:
+            self.hits += 1
+            if metrics.enabled:
+                metrics.count('power_cache.hits')
+            self._powers.move_to_end(level)
+        return power
+
+    def _store(self, level, power):
+        """
+        Stores a power, evicting the least recently used ones until the
+        cache fits its budget. Powers larger than the budget are not stored.
+        """
+        size = self.size_of(power)
+        if size > self.max_bytes:
+            return
+
+        self._powers[level] = power
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, evicted = self._powers.popitem(last=False)
+            self.nbytes -= self.size_of(evicted)
+
+    def cached(self, level):
+        """
+        Returns P^(2^level) if it is cached, without counting a hit or a
+        miss.
+
+        :param level: the binary exponent, at least 1
+        :returns: the power, or None
+        """
+        return self._powers.get(level)
+
+    def fits(self, levels, filled):
+        """
+        Checks if the powers of the given levels can be held at the same
+        time, counting the ones not cached yet at an estimated size.
+
+        :param levels: the binary exponents of the powers
+        :param filled: the estimated size of a power not cached yet
+        :returns: True if the powers fit in the budget
+        """
+        needed = 0
+        for level in levels:
+            power = self._powers.get(level)
+            needed += filled if power is None else self.size_of(power)
+        return needed <= self.max_bytes
+
+    def clear(self):
+        """
+        Drops all cached powers, keeping the statistics.
+        """
+        self._powers.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        """
+        :returns: a dict with the number of hits and misses, the number of
+         cached powers and the memory they take
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._powers),
+            'nbytes': self.nbytes
+        }
+
+class ClassGraph(object):
+    """
+    The condensation of a chain's digraph: a directed acyclic graph with
+    one node per communication class and an edge between two classes if
+    a transition leads from a state of the first to a state of the second.
+    Edges are kept in CSR format, like the transitions of CompiledChain.
+    """
+
+    def __init__(self, compiled):
+        """
+        Builds the condensation of a compiled chain in a single vectorized
+        pass over its transitions.
+
+        :param compiled: the CompiledChain to condense
+        """
+        components, closed = compiled.components()
+        count = len(closed)
+
+        self.components = components
+        self.closed = closed
+        self.classes = compiled.classes()
+
+        # map every transition to a pair of classes and keep the pairs
+        # that cross classes, once each
+        sources = components[
+            np.repeat(np.arange(compiled.size), np.diff(compiled.indptr))
+        ]
+        targets = components[compiled.indices]
+        crossing = sources != targets
+        pairs = np.unique(
+            sources[crossing].astype(np.int64) * count + targets[crossing]
+        )
+
+        self.indptr = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pairs // count, minlength=count),
+                  out=self.indptr[1:])
+        self.indices = pairs % count
+
+    @property
+    def size(self):
+        """
+        The number of communication classes.
+        """
+        return len(self.closed)
+
+    def successors(self, c):
+        """
+        Returns the classes that can be reached from a class in one step.
+
+        :param c: the index of the class
+        :returns: an integer array of class indices
+        """
+        return self.indices[self.indptr[c]:self.indptr[c + 1]]
+
+    def topological_order(self):
+        """
+        Orders the classes so that every class comes before the classes it
+        leads to, using Kahn's algorithm one level at a time. The result is
+        cached.
+
+        :returns: an integer array containing every class index once
+        """
+        try:
+            return self._order
+        except AttributeError:
+            pass
+
+        indegree = np.bincount(self.indices, minlength=self.size)
+        frontier = np.flatnonzero(indegree == 0)
+        order = []
+        while frontier.size:
+            order.append(frontier)
+            found = gather(self.indptr, self.indices, frontier)
+            np.subtract.at(indegree, found, 1)
+            found = np.unique(found)
+            frontier = found[indegree[found] == 0]
+
+        self._order = np.concatenate(order) if order else \
+            np.zeros(0, dtype=np.int64)
+        return self._order
+
+class TableBuilder(object):
+    """
+    Collects the rows of a transition table one at a time into growing
+    typed arrays, interning state labels as they are seen, and compiles
+    them into a CompiledChain. Used to build large chains without holding
+    the table as dicts or lists of tuples.
+
+    >>> builder = TableBuilder()
+    >>> builder.add_initial('A', 1.0)
+    >>> builder.add_row('A', [('A', 0.5), ('B', 0.5)])
+    >>> builder.add_row('B', [('B', 1.0)])
+    >>> builder.compile().labels
+    ['A', 'B']
+
+    """
+
+    def __init__(self):
+        self.labels = []
+        self.index = {}
+        # source state and end offset of every row, in insertion order
+        self.sources = array('q')
+        self.ends = array('q', [0])
+        self.targets = array('q')
+        self.probs = array('d')
+        self.initial_states = array('q')
+        self.initial_probs = array('d')
+
+    def intern(self, label):
+        """
+        Returns the index of a label, assigning a new one if the label has
+        not been seen before.
+
+        :param label: a state label
+        :returns: the label's index, in order of first appearance
+        """
+        try:
+            return self.index[label]
+        except KeyError:
+            self.index[label] = len(self.labels)
+            self.labels.append(label)
+            return len(self.labels) - 1
+
+    def add_row(self, label, transitions):
+        """
+        Appends the transitions from a state.
+
+        :param label: the label of the source state
+        :param transitions: an iterable of state - transition probability
+         pairs
+        """
+        self.sources.append(self.intern(label))
+        for target, prob in transitions:
+            self.targets.append(self.intern(target))
+            self.probs.append(float(prob))
+        self.ends.append(len(self.targets))
+
+    def add_initial(self, label, prob):
+        """
+        Sets the initial probability of a state. Zero probabilities are
+        skipped, so that they do not declare states without transitions.
+
+        :param label: the state label
+        :param prob: the initial probability
+        """
+        prob = float(prob)
+        if prob == 0:
+            return
+        self.initial_states.append(self.intern(label))
+        self.initial_probs.append(prob)
+
+    def compile(self, atol=1e-12):
+        """
+        Compiles the collected rows, with labels sorted as in
+        CompiledChain.from_table() and validated at once.
+
+        :param atol: the absolute tolerance of the validation
+        :returns: the compiled chain
+        """
+        size = len(self.labels)
+        sources = np.frombuffer(self.sources, dtype=np.int64)
+
+        position = np.full(size, -1, dtype=np.int64)
+        position[sources] = np.arange(len(sources))
+        # a repeated row leaves an earlier position overwritten
+        repeated = position[sources] != np.arange(len(sources))
+        if repeated.any():
+            raise ValueError("Transitions from state " +
+                    str(self.labels[sources[repeated][0]]) +
+                    " are given more than once")
+        if (position < 0).any():
+            missing = np.flatnonzero(position < 0)[0]
+            raise ValueError("State " + str(self.labels[missing]) +
+                    " has no outgoing transitions")
+
+        # rank of every interned label in sorted order
+        order = np.array(
+            sorted(range(size), key=self.labels.__getitem__), dtype=np.int64
+        )
+        rank = np.empty(size, dtype=np.int64)
+        rank[order] = np.arange(size)
+
+        # move the rows to sorted label order
+        ends = np.frombuffer(self.ends, dtype=np.int64)
+        rows = position[order]
+        indptr = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(ends[rows + 1] - ends[rows], out=indptr[1:])
+        indices = rank[gather(ends, np.frombuffer(self.targets, np.int64), rows)]
+        data = gather(ends, np.frombuffer(self.probs, np.float64), rows)
+
+        initial = np.zeros(size)
+        initial[rank[np.frombuffer(self.initial_states, np.int64)]] = \
+            np.frombuffer(self.initial_probs, np.float64)
+
+        return CompiledChain.from_arrays(
+            indptr, indices, data, [self.labels[i] for i in order],
+            initial, atol
+        )
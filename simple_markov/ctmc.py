@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+import math
+
+import numpy as np
+
+from simple_markov.compiled import CompiledChain, initial_vector
+
+class ContinuousTimeMarkovChain(object):
+    """
+    A continuous time Markov Chain, given by the rates of the transitions
+    between its states. The chain stays at state i for an exponentially
+    distributed time with rate q_i, the sum of the rates out of i, and then
+    jumps to state j with probability q_ij / q_i. States without outgoing
+    rates are absorbing.
+
+    Rates are kept in CSR arrays, like the transition table of a
+    CompiledChain, and the generator matrix Q is never made dense.
+    """
+
+    def __init__(self, initial_distrib, rate_table, atol=1e-12):
+        """
+        Creates a new continuous time Markov Chain from a map of initial
+        probabilities and a table of transition rates.
+
+        :param initial_distrib: a map of states to initial probabilities
+        :param rate_table: a map of states to iterables of state - rate
+         pairs, listing the rates of the transitions to other states; every
+         state must be a key, with an empty iterable if it is absorbing
+        :param atol: the absolute tolerance of the initial distribution
+
+        >>> chain = ContinuousTimeMarkovChain(
+                {'On': 1.0},
+                {'On': [('Off', 2.0)], 'Off': [('On', 1.0)]})
+        >>> chain.state_probabilities(10.0)
+        {'Off': 0.666..., 'On': 0.333...}
+
+        """
+        labels = sorted(key for key in rate_table)
+        index = {key: i for i, key in enumerate(labels)}
+
+        rows, indices, data = [], [], []
+        for i, key in enumerate(labels):
+            for target, rate in rate_table[key]:
+                if target == key:
+                    continue
+                try:
+                    indices.append(index[target])
+                except KeyError:
+                    raise ValueError("Unknown state " + str(target))
+                rows.append(i)
+                data.append(float(rate))
+
+        rows = np.array(rows, dtype=np.int64)
+        indices = np.array(indices, dtype=np.int64)
+        indptr = np.zeros(len(labels) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(labels)), out=indptr[1:])
+
+        self._setup(labels, index, indptr, indices, np.array(data),
+                    initial_vector(initial_distrib, labels, index, atol))
+
+    @classmethod
+    def from_generator(cls, matrix, labels=None, initial=None, atol=1e-9):
+        """
+        Creates a new continuous time Markov Chain from its generator
+        matrix Q, a dense array-like or a scipy.sparse matrix whose
+        off-diagonal entries are the transition rates and whose rows sum
+        to zero.
+
+        :param matrix: the square generator matrix
+        :param labels: a sequence of state labels, state indices by default
+        :param initial: the initial distribution, see
+         compiled.initial_vector(); uniform by default
+        :param atol: the tolerance of the row sums, relative to the largest
+         rate, and of the initial distribution
+        :returns: the new chain
+        """
+        if hasattr(matrix, 'tocoo'):
+            coo = matrix.tocoo()
+            size = coo.shape[0]
+            rows, cols, values = coo.row, coo.col, coo.data
+        else:
+            matrix = np.asarray(matrix, dtype=np.float64)
+            size = matrix.shape[0]
+            rows, cols = np.nonzero(matrix)
+            values = matrix[rows, cols]
+        if matrix.shape != (size, size):
+            raise ValueError("Generator matrix must be square")
+
+        labels = list(range(size)) if labels is None else list(labels)
+        if len(labels) != size:
+            raise ValueError("Number of labels must match the states")
+        index = {key: i for i, key in enumerate(labels)}
+
+        if not np.isfinite(values).all():
+            raise ValueError("Entries of the generator matrix must be finite")
+        off = rows != cols
+        if (values[off] < 0).any():
+            raise ValueError("Transition rates must be non-negative")
+        sums = np.bincount(rows, weights=values, minlength=size)
+        scale = max(np.abs(values).max() if len(values) else 0.0, 1.0)
+        if (np.abs(sums) > atol * scale).any():
+            raise ValueError("Rows of the generator matrix must sum to zero")
+
+        rows, cols, values = rows[off], cols[off], values[off]
+        order = np.lexsort((cols, rows))
+        indptr = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=size), out=indptr[1:])
+
+        chain = cls.__new__(cls)
+        chain._setup(labels, index, indptr, cols[order].astype(np.int64),
+                     values[order].astype(np.float64),
+                     initial_vector(initial, labels, index, atol))
+        return chain
+
+    def _setup(self, labels, index, indptr, indices, data, initial):
+        """
+        Stores the rates in CSR format and derives the exit rates.
+        """
+        # written so that NaN fails the check
+        bad = ~((data >= 0) & np.isfinite(data))
+        if bad.any():
+            rows = np.repeat(np.arange(len(labels)), np.diff(indptr))
+            raise ValueError("Transition rates from state " +
+                    str(labels[rows[bad][0]]) +
+                    " must be finite and non-negative")
+
+        # transitions with zero rate never happen
+        keep = data != 0
+        if not keep.all():
+            rows = np.repeat(np.arange(len(labels)), np.diff(indptr))
+            indptr = np.zeros(len(labels) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(rows[keep], minlength=len(labels)),
+                      out=indptr[1:])
+            indices, data = indices[keep], data[keep]
+
+        self.labels = labels
+        self.index = index
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.initial = initial
+
+        # total rate out of every state
+        rows = np.repeat(np.arange(len(labels)), np.diff(indptr))
+        self.exit_rates = np.bincount(
+            rows, weights=data, minlength=len(labels)
+        )
+
+    @property
+    def size(self):
+        """
+        The number of states.
+        """
+        return len(self.labels)
+
+    def rates(self):
+        """
+        Returns the matrix of transition rates, i.e. the generator without
+        its diagonal: a scipy.sparse.csr_matrix if scipy is available,
+        otherwise a dense numpy array. The result is cached.
+
+        :returns: the rate matrix
+        """
+        try:
+            return self._rates
+        except AttributeError:
+            pass
+
+        try:
+            from scipy.sparse import csr_matrix
+            self._rates = csr_matrix(
+                (self.data, self.indices, self.indptr),
+                shape=(self.size, self.size)
+            )
+        except ImportError:
+            self._rates = np.zeros((self.size, self.size))
+            rows = np.repeat(np.arange(self.size), np.diff(self.indptr))
+            self._rates[rows, self.indices] = self.data
+        return self._rates
+
+    def generator(self):
+        """
+        Returns the generator matrix Q, with the negated exit rates on its
+        diagonal, as a scipy.sparse.csr_matrix if scipy is available.
+
+        :returns: the generator matrix
+        """
+        rates = self.rates()
+        if isinstance(rates, np.ndarray):
+            return rates - np.diag(self.exit_rates)
+
+        from scipy.sparse import diags
+        return (rates - diags(self.exit_rates)).tocsr()
+
+    def vecgen(self, vector):
+        """
+        Computes the product of a row vector with the generator matrix,
+        without building the generator.
+
+        :param vector: an array with one entry per state
+        :returns: the product vector * Q
+        """
+        return self.rates().T.dot(vector) - self.exit_rates * vector
+
+    def jump_chain(self):
+        """
+        Returns the embedded jump chain, the discrete time chain of the
+        states visited, in which state i moves to state j with probability
+        q_ij / q_i and absorbing states loop to themselves. The result is
+        cached.
+
+        :returns: a MarkovChain in 'float64' mode
+        """
+        try:
+            return self._jump_chain
+        except AttributeError:
+            pass
+
+        from simple_markov.lib import MarkovChain
+
+        absorbing = self.exit_rates == 0
+        lengths = np.diff(self.indptr) + absorbing
+        rows = np.repeat(np.arange(self.size), np.diff(self.indptr))
+
+        indptr = np.zeros(self.size + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        # absorbing states have no rates, so their loop fills their row
+        indices = np.empty(indptr[-1], dtype=np.int64)
+        data = np.empty(indptr[-1])
+        positions = np.arange(len(self.data)) + \
+            (indptr[:-1] - self.indptr[:-1])[rows]
+        indices[positions] = self.indices
+        data[positions] = self.data / self.exit_rates[rows]
+        indices[indptr[:-1][absorbing]] = np.flatnonzero(absorbing)
+        data[indptr[:-1][absorbing]] = 1.0
+
+        self._jump_chain = MarkovChain.from_compiled(CompiledChain(
+            self.labels, indptr, indices, data, self.initial, self.index
+        ))
+        return self._jump_chain
+
+    def communication_classes(self):
+        """
+        Finds the communication classes of the chain, which are those of
+        its jump chain. See MarkovChain.communication_classes().
+
+        :returns: a list of dicts containing the states ('states') and the
+         type ('type', 'open' or 'closed') of every class
+        """
+        return self.jump_chain().communication_classes()
+
+    def stationary_distribution(self, method='auto', tol=1e-10,
+                                maxiter=None):
+        """
+        Calculates the stationary distribution of every closed communication
+        class, i.e. the solution of pi * Q = 0 on the class. It is found from
+        the stationary distribution nu of the jump chain, as pi_i
+        proportional to nu_i / q_i. See MarkovChain.stationary_distribution()
+        for the parameters.
+
+        :returns: a list of dicts, one per closed class, containing the
+         class's states ('states'), its stationary distribution ('distribution'),
+         the method used ('method'), the number of iterations ('iterations')
+         and the 1-norm of pi * Q ('residual')
+        """
+        result = []
+        for solution in self.jump_chain().stationary_distribution(
+                method, tol, maxiter):
+            idx = np.array(
+                [self.index[key] for key in solution['distribution']]
+            )
+            vector = np.array(list(solution['distribution'].values()))
+            rates = self.exit_rates[idx]
+            if (rates > 0).all():
+                vector = vector / rates
+            vector /= vector.sum()
+
+            full = np.zeros(self.size)
+            full[idx] = vector
+            result.append({
+                'states': solution['states'],
+                'distribution': {
+                    self.labels[i]: p for i, p in zip(idx, vector)
+                },
+                'method': solution['method'],
+                'iterations': solution['iterations'],
+                'residual': float(np.abs(self.vecgen(full)).sum())
+            })
+        return result
+
+    def uniformize(self, vector, time, tol=1e-12):
+        """
+        Computes vector * exp(Q * time) by uniformization: with a rate L at
+        least as large as every exit rate, exp(Q t) is the Poisson mixture
+        of the powers of the stochastic matrix P = I + Q / L with mean L t.
+        Long times are split into segments, so that the Poisson weights do
+        not underflow.
+
+        :param vector: the initial distribution
+        :param time: the time
+        :param tol: the Poisson probability mass that may be neglected
+        :returns: the distribution at the given time
+        """
+        vector = np.array(vector, dtype=np.float64)
+        rate = float(self.exit_rates.max()) if self.size else 0.0
+        if time == 0 or rate == 0:
+            return vector
+
+        # at most a mean of 500 jumps per segment
+        segments = int(math.ceil(rate * time / 500.0))
+        mean = rate * time / segments
+        for _ in range(segments):
+            term = vector
+            weight = math.exp(-mean)
+            result = weight * term
+            mass, k = weight, 0
+            while 1 - mass > tol and k < mean + 50 * math.sqrt(mean) + 50:
+                k += 1
+                term = term + self.vecgen(term) / rate
+                weight *= mean / k
+                result += weight * term
+                mass += weight
+            vector = result
+        return vector
+
+    def propagate(self, vector, time, method='auto', tol=1e-12):
+        """
+        Computes the distribution of the chain at a given time, vector *
+        exp(Q * time), without ever making a matrix exponential dense.
+        Available methods are 'uniformization' (see uniformize()) and
+        'expm', scipy.sparse.linalg.expm_multiply(). 'auto' uses 'expm' if
+        scipy is available.
+
+        :param vector: the initial distribution
+        :param time: the time, a non-negative number
+        :param method: the method to use
+        :param tol: the tolerance of uniformization
+        :returns: the distribution at the given time
+        """
+        if time < 0:
+            raise ValueError("Time must be non-negative")
+
+        if method == 'auto':
+            try:
+                import scipy.sparse.linalg
+                method = 'expm'
+            except ImportError:
+                method = 'uniformization'
+
+        if method == 'uniformization':
+            return self.uniformize(vector, time, tol)
+        if method == 'expm':
+            from scipy.sparse.linalg import expm_multiply
+            generator = self.generator()
+            if isinstance(generator, np.ndarray):
+                from scipy.sparse import csr_matrix
+                generator = csr_matrix(generator)
+            return expm_multiply(
+                generator.T.tocsr() * time,
+                np.array(vector, dtype=np.float64)
+            )
+
+        raise ValueError("Unknown method " + str(method))
+
+    def state_probabilities(self, time, method='auto'):
+        """
+        Calculates the probability of every state at a given time.
+
+        :param time: the time
+        :param method: see propagate()
+        :returns: a map of state - probability pairs
+        """
+        return dict(zip(
+            self.labels, self.propagate(self.initial, time, method).tolist()
+        ))
+
+    def simulate_batch(self, n_walkers, time, seed=None):
+        """
+        Simulates many independent walkers up to a given time, advancing
+        them in lockstep with NumPy (a batched Gillespie algorithm): all
+        walkers still running draw their holding times at once and those
+        that jump before the given time move by one step of the jump chain.
+
+        :param n_walkers: the number of walkers
+        :param time: the time to simulate up to
+        :param seed: a seed for numpy.random.default_rng
+        :returns: a tuple of an integer array with the state of every
+         walker at the given time, an integer array with the number of
+         jumps of every walker and the list of state labels
+        """
+        rng = np.random.default_rng(seed)
+        jump = self.jump_chain().compile()
+
+        current = np.searchsorted(
+            jump.initial_cumulative(), rng.random(n_walkers), side='right'
+        )
+        np.minimum(current, self.size - 1, out=current)
+        clock = np.zeros(n_walkers)
+        jumps = np.zeros(n_walkers, dtype=np.int64)
+
+        states = current.copy()
+        active = np.flatnonzero(self.exit_rates[current] > 0)
+        while active.size:
+            rates = self.exit_rates[states[active]]
+            clock[active] += rng.exponential(size=active.size) / rates
+
+            # walkers whose next jump comes after the time are done
+            active = active[clock[active] <= time]
+            states[active] = jump.step_batch(
+                states[active], rng.random(active.size)
+            )
+            jumps[active] += 1
+
+            # as are walkers that got absorbed
+            active = active[self.exit_rates[states[active]] > 0]
+
+        return states, jumps, list(self.labels)
+
+    def sample_path(self, time, seed=None):
+        """
+        Simulates a single path of the chain up to a given time.
+
+        :param time: the time to simulate up to
+        :param seed: a seed for numpy.random.default_rng
+        :returns: a list of (jump time, state) pairs, starting with the
+         initial state at time 0
+        """
+        rng = np.random.default_rng(seed)
+        jump = self.jump_chain().compile()
+
+        position = jump.initial_state(rng.random())
+        clock = 0.0
+        path = [(0.0, self.labels[position])]
+        while self.exit_rates[position] > 0:
+            clock += float(rng.exponential() / self.exit_rates[position])
+            if clock > time:
+                break
+            position = jump.step(position, rng.random())
+            path.append((clock, self.labels[position]))
+        return path
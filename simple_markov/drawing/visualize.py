@@ -1,12 +1,9 @@
 # -*- coding: utf-8 -*-
 
-import networkx as nx
-import matplotlib.pyplot as plt
-
 class Visualizer(object):
     """
     Visualizer creates markov chain visualizations using the matplotlib
-    and networkx libraries.
+    and networkx libraries, which are imported by the drawing methods.
     """
     def __init__(self):
         pass
@@ -20,6 +17,9 @@ class Visualizer(object):
         :param show: a flag indicating if the drawn graph should be shown
         :returns: the figure created and populated by the method
         """
+        import networkx as nx
+        import matplotlib.pyplot as plt
+
         connections = chain.get_class_connections()
         class_labels = {
             i: r'$\{{ {0} \}}$'.format(', '.join(i)) for i in connections
@@ -77,6 +77,9 @@ class Visualizer(object):
         :returns: the dictionary containing the figure handle as well as
         info about edges, nodes, labels, etc. to be used in redrawing
         """
+        import networkx as nx
+        import matplotlib.pyplot as plt
+
         # Retrieve all drawing info
         pos_state_map = info_dict['pos_state_map']
         edges = info_dict['edges']
@@ -146,6 +149,9 @@ class Visualizer(object):
         :returns: the dictionary containing the figure handle as well as
          info about edges, nodes, labels, etc. to be used in redrawing
         """
+        import networkx as nx
+        import matplotlib.pyplot as plt
+
         states = chain.states
         # an array of (state, position) tuples to make drawing easier
         pos_state_map = zip((i for i in states), range(len(states)))
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from simple_markov.compiled import CompiledChain
+
+# number of pending transitions collected before merging them into the counts
+FLUSH_SIZE = 1 << 22
+# transitions are keyed by (source << KEY_SHIFT) | target
+KEY_SHIFT = 32
+KEY_MASK = (1 << KEY_SHIFT) - 1
+
+class TransitionCounter(object):
+    """
+    Counts the transitions observed in sequences of states, in order to
+    estimate a markov chain from them. Counts are kept as a sorted array of
+    the distinct transitions observed along with their counts, and new
+    transitions are buffered and merged in batches, so memory grows with
+    the number of distinct transitions rather than the number of events.
+
+    Counters are picklable and can be merged, so that partial counts of
+    separate workers can be combined.
+
+    >>> counter = TransitionCounter()
+    >>> counter.update('AABAB')
+    >>> counter.update('AB')
+    >>> counter.to_chain().transition_table
+    {'A': [('A', 0.25), ('B', 0.75)], 'B': [('A', 1.0)]}
+
+    """
+
+    def __init__(self, labels=None):
+        """
+        :param labels: an optional iterable of the state labels known in
+         advance, which fixes the order in which they are numbered
+        """
+        self.labels = []
+        self.index = {}
+        # sorted distinct transition keys and their counts
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        # number of sequences starting at every state
+        self.starts = np.zeros(0, dtype=np.int64)
+
+        self._pending = []
+        self._pending_size = 0
+        self._pending_starts = []
+        self._last = None
+
+        if labels is not None:
+            for key in labels:
+                self._intern(key)
+
+    def _intern(self, label):
+        """
+        Returns the number of a state label, assigning a new one if needed.
+        """
+        try:
+            return self.index[label]
+        except KeyError:
+            self.index[label] = len(self.labels)
+            self.labels.append(label)
+            return len(self.labels) - 1
+
+    def _codes(self, sequence):
+        """
+        Converts a sequence of state labels to an array of state numbers.
+        Integer numpy arrays are converted with one lookup per distinct
+        value.
+        """
+        if isinstance(sequence, np.ndarray) and sequence.dtype.kind in 'iu':
+            values, inverse = np.unique(sequence, return_inverse=True)
+            lookup = np.array(
+                [self._intern(value) for value in values.tolist()],
+                dtype=np.int64
+            )
+            return lookup[inverse.ravel()]
+        return np.fromiter(
+            (self._intern(state) for state in sequence), dtype=np.int64
+        )
+
+    def update(self, sequence, continued=False):
+        """
+        Counts the transitions of a sequence of states.
+
+        :param sequence: an iterable of state labels, or an integer numpy
+         array of them
+        :param continued: set to True if the sequence continues the one
+         given in the previous call, e.g. when a long sequence is read in
+         chunks
+        """
+        codes = self._codes(sequence)
+        if not len(codes):
+            return
+
+        if continued and self._last is not None:
+            codes = np.concatenate(([self._last], codes))
+        else:
+            self._pending_starts.append(codes[0])
+        self._last = int(codes[-1])
+
+        keys = (codes[:-1] << KEY_SHIFT) | codes[1:]
+        self._pending.append(keys)
+        self._pending_size += len(keys)
+        if self._pending_size >= FLUSH_SIZE:
+            self._flush()
+
+    def _combine(self, keys, counts):
+        """
+        Adds the counts of some transitions to the counter's counts.
+
+        :param keys: an array of transition keys, possibly repeated
+        :param counts: the count of every key
+        """
+        keys, inverse = np.unique(
+            np.concatenate((self.keys, keys)), return_inverse=True
+        )
+        merged = np.zeros(len(keys), dtype=np.int64)
+        np.add.at(merged, inverse.ravel(), np.concatenate((self.counts, counts)))
+        self.keys, self.counts = keys, merged
+
+    def _add_starts(self, states, counts):
+        """
+        Adds to the number of sequences starting at some states.
+        """
+        starts = np.zeros(len(self.labels), dtype=np.int64)
+        starts[:len(self.starts)] = self.starts
+        np.add.at(starts, states, counts)
+        self.starts = starts
+
+    def _flush(self):
+        """
+        Merges the pending transitions into the counts.
+        """
+        if self._pending:
+            keys, counts = np.unique(
+                np.concatenate(self._pending), return_counts=True
+            )
+            self._combine(keys, counts)
+            self._pending, self._pending_size = [], 0
+
+        if self._pending_starts or len(self.starts) < len(self.labels):
+            self._add_starts(np.array(self._pending_starts, dtype=np.int64), 1)
+            self._pending_starts = []
+
+    def merge(self, other):
+        """
+        Adds the counts of another counter to this one.
+
+        :param other: a TransitionCounter
+        :returns: this counter
+        """
+        self._flush()
+        other._flush()
+
+        lookup = np.array(
+            [self._intern(key) for key in other.labels], dtype=np.int64
+        )
+        self._combine(
+            (lookup[other.keys >> KEY_SHIFT] << KEY_SHIFT) |
+            lookup[other.keys & KEY_MASK],
+            other.counts
+        )
+        self._add_starts(lookup[:len(other.starts)], other.starts)
+        return self
+
+    @property
+    def total(self):
+        """
+        The number of transitions counted.
+        """
+        return int(self.counts.sum()) + self._pending_size
+
+    def compile(self, smoothing=0.0, initial=None, atol=1e-12):
+        """
+        Normalizes the counts into a compiled chain. Labels are sorted as
+        in MarkovChain's 'float64' mode. States that were never left, i.e.
+        only seen at the end of sequences, become absorbing.
+
+        :param smoothing: a pseudo-count added to every transition between
+         two states, which makes the transition table dense
+        :param initial: the initial distribution, see
+         CompiledChain.from_arrays(); by default the frequency of every
+         state at the start of the sequences
+        :param atol: the absolute tolerance of the validation
+        :returns: the compiled chain
+        """
+        self._flush()
+        size = len(self.labels)
+        if not size:
+            raise ValueError("No states have been observed")
+
+        order = np.array(
+            sorted(range(size), key=self.labels.__getitem__), dtype=np.int64
+        )
+        rank = np.empty(size, dtype=np.int64)
+        rank[order] = np.arange(size)
+        labels = [self.labels[i] for i in order]
+
+        rows = rank[self.keys >> KEY_SHIFT]
+        indices = rank[self.keys & KEY_MASK]
+        counts = self.counts.astype(np.float64)
+
+        if smoothing:
+            dense = np.full((size, size), float(smoothing))
+            dense[rows, indices] += counts
+            rows, indices = np.nonzero(dense)
+            counts = dense[rows, indices]
+        else:
+            # make the states that were never left absorbing
+            totals = np.bincount(rows, minlength=size)
+            absorbing = np.flatnonzero(totals == 0)
+            rows = np.concatenate((rows, absorbing))
+            indices = np.concatenate((indices, absorbing))
+            counts = np.concatenate((counts, np.ones(len(absorbing))))
+
+            sort = np.lexsort((indices, rows))
+            rows, indices, counts = rows[sort], indices[sort], counts[sort]
+
+        totals = np.bincount(rows, weights=counts, minlength=size)
+        indptr = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=size), out=indptr[1:])
+
+        if initial is None:
+            initial = self.starts[order] / float(self.starts.sum())
+
+        return CompiledChain.from_arrays(
+            indptr, indices, counts / totals[rows], labels, initial, atol
+        )
+
+    def to_chain(self, smoothing=0.0, initial=None, atol=1e-12):
+        """
+        Normalizes the counts into a MarkovChain in 'float64' mode. See
+        compile() for the parameters.
+
+        :returns: the estimated MarkovChain
+        """
+        from simple_markov.lib import MarkovChain
+        return MarkovChain.from_compiled(
+            self.compile(smoothing, initial, atol), atol
+        )
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+import functools, time
+
+class Metrics(object):
+    """
+    An opt-in registry of counters and timings recorded on the hot paths
+    of the library: steps taken by iterating over chains, the duration and
+    size of analysis calls, readers and matrix builds, and cache hits and
+    misses. Instrumented code only checks the enabled flag while the
+    registry is disabled, which is the default.
+
+    Every timing is also passed to the registered callbacks as a dict with
+    its 'name', its duration in 'seconds' and call specific sizes, so that
+    it can be forwarded to a monitoring system. Counters are only exported.
+
+    >>> from simple_markov import metrics
+    >>> metrics.enable()
+    >>> chain.state_probabilities(10)
+    >>> metrics.export()['timings']['state_probabilities']['calls']
+    1
+
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.callbacks = []
+        self.reset()
+
+    def enable(self):
+        """
+        Starts recording.
+        """
+        self.enabled = True
+
+    def disable(self):
+        """
+        Stops recording, keeping what has been recorded so far.
+        """
+        self.enabled = False
+
+    def reset(self):
+        """
+        Drops all counters and timings.
+        """
+        self.counters = {}
+        self.timings = {}
+
+    def add_callback(self, callback):
+        """
+        Registers a function to be called with every recorded timing.
+
+        :param callback: a function accepting a dict
+        """
+        self.callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        """
+        Unregisters a function added by add_callback().
+        """
+        self.callbacks.remove(callback)
+
+    def count(self, name, n=1):
+        """
+        Increments a counter.
+
+        :param name: the name of the counter
+        :param n: the increment
+        """
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def record(self, name, seconds, **info):
+        """
+        Records the duration of a call and notifies the callbacks.
+
+        :param name: the name of the timing
+        :param seconds: the duration of the call
+        :param info: sizes describing the call, e.g. the number of states
+        """
+        try:
+            timing = self.timings[name]
+        except KeyError:
+            timing = self.timings[name] = {
+                'calls': 0, 'total': 0.0, 'max': 0.0, 'last': None
+            }
+        timing['calls'] += 1
+        timing['total'] += seconds
+        timing['max'] = max(timing['max'], seconds)
+        timing['last'] = dict(info, seconds=seconds)
+
+        if self.callbacks:
+            event = dict(info, name=name, seconds=seconds)
+            for callback in self.callbacks:
+                callback(event)
+
+    def export(self):
+        """
+        Returns a snapshot of the recorded metrics. Hit rates are derived
+        for every pair of counters named '<cache>.hits' and '<cache>.misses'.
+
+        :returns: a dict with the 'counters', 'timings' and 'hit_rates'
+        """
+        rates = {}
+        for name, hits in self.counters.items():
+            if name.endswith('.hits'):
+                cache = name[:-len('.hits')]
+                total = hits + self.counters.get(cache + '.misses', 0)
+                rates[cache] = hits / float(total) if total else None
+        for name in self.counters:
+            if name.endswith('.misses'):
+                rates.setdefault(name[:-len('.misses')], 0.0)
+
+        return {
+            'counters': dict(self.counters),
+            'timings': {k: dict(v) for k, v in self.timings.items()},
+            'hit_rates': rates
+        }
+
+# the registry used throughout the library
+metrics = Metrics()
+
+def timed(name, info=None):
+    """
+    A decorator that records the duration of every call of a function in
+    metrics, while it is enabled.
+
+    :param name: the name of the timing
+    :param info: an optional function, called with the result and the
+     arguments of the call, returning a dict of sizes describing the call
+    :returns: the decorator
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return function(*args, **kwargs)
+
+            start = time.perf_counter()
+            result = function(*args, **kwargs)
+            seconds = time.perf_counter() - start
+            metrics.record(
+                name, seconds,
+                **(info(result, *args, **kwargs) if info else {})
+            )
+            return result
+        return wrapper
+    return decorator
@@ -1,2 +1,7 @@
-# import standard readers to be visible via "from io import ..."
+# import standard readers to be visible via "from io import ..."; optional
+# dependencies such as yaml are imported by the readers that need them
 from .readers import YAML_Reader, JSON_Reader
+from .readers import YAML_StreamReader, JSON_StreamReader, Binary_Reader
+
+# import standard writers
+from .writers import Binary_Writer
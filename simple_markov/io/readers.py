@@ -1,5 +1,31 @@
 # -*- coding: utf-8 -*-
-import json, yaml
+import json, os, re, struct
+
+import numpy as np
+
+from simple_markov.compiled import CompiledChain, TableBuilder
+from simple_markov.instrumentation import timed
+
+# characters read from a file at a time by the streaming readers
+BLOCK_SIZE = 1 << 20
+
+def _read_sizes(result, reader, *args, **kwargs):
+    """
+    Describes a file read by an instrumented reader call.
+    """
+    filename = getattr(reader, 'filename', None) or \
+        (args[0] if args else kwargs['filename'])
+    sizes = {'bytes': os.path.getsize(filename)}
+    if isinstance(result, CompiledChain):
+        sizes.update(states=result.size, transitions=result.nnz)
+    return sizes
+
+# signature, current version and layout of binary chain files
+BINARY_MAGIC = b'SMCHAIN\0'
+BINARY_VERSION = 1
+BINARY_PREAMBLE = struct.Struct('<8sII')
+# alignment of the arrays in binary chain files, in bytes
+BINARY_ALIGNMENT = 64
 
 class JSON_Reader(object):
     """
@@ -32,6 +58,7 @@ class JSON_Reader(object):
     documentation in the MarkovChain class.
     """
 
+    @timed('JSON_Reader', _read_sizes)
     def __init__(self, filename):
         """
         Creates a new JSON_reader object to read data from a file.
@@ -39,7 +66,7 @@ class JSON_Reader(object):
         Args:
             filename (str): The name of the input file.
         """
-
+        self.filename = filename
         with open(filename, 'r') as f:
             self.data = json.load(f)
         
@@ -90,6 +117,7 @@ class YAML_Reader(object):
     check out the documentation in MarkovChain.
     """
 
+    @timed('YAML_Reader', _read_sizes)
     def __init__(self, filename):
         """
         Initializes a YAML_Reader object to read data from a specified
@@ -99,8 +127,12 @@ class YAML_Reader(object):
             filename (str): the name of the YAML file
         """
         
+        # yaml is an optional dependency, only needed by the YAML readers
+        import yaml
+
+        self.filename = filename
         with open(filename, 'r') as f:
-            self.data = yaml.load(f)
+            self.data = yaml.safe_load(f)
        
     def parse_data(self):
         """
@@ -120,3 +152,385 @@ class YAML_Reader(object):
         }
 
         return init_table, trans_table
+
+class _JSONStream(object):
+    """
+    A minimal incremental JSON scanner over a file, which walks through
+    objects key by key and decodes single values with json's raw_decode().
+    Only the current block of the file and the value being decoded are
+    held in memory.
+    """
+
+    whitespace = re.compile(r'[ \t\n\r]*')
+    delimiter = re.compile(r'[ \t\n\r,:}\]]')
+
+    def __init__(self, f, block_size):
+        self.f = f
+        self.block_size = block_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """
+        Drops the consumed part of the buffer and reads another block.
+
+        Returns:
+            False if the end of the file has been reached
+        """
+        block = self.f.read(self.block_size)
+        self.buffer = self.buffer[self.pos:] + block
+        self.pos = 0
+        self.eof = not block
+        return not self.eof
+
+    def peek(self):
+        """
+        Skips whitespace and returns the next character without consuming it.
+        """
+        while True:
+            self.pos = self.whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                raise ValueError("Unexpected end of JSON document")
+
+    def expect(self, char):
+        """
+        Consumes the next character, which must be the given one.
+        """
+        if self.peek() != char:
+            raise ValueError("Expected '" + char + "' in JSON document")
+        self.pos += 1
+
+    def value(self):
+        """
+        Decodes the next JSON value, reading more blocks until it is
+        complete.
+        """
+        # numbers and literals have no closing character, so a truncated
+        # number would still decode; read on until a delimiter follows
+        if self.peek() not in '{["':
+            while not self.delimiter.search(self.buffer, self.pos):
+                if not self.fill():
+                    break
+
+        while True:
+            try:
+                value, self.pos = self.decoder.raw_decode(
+                    self.buffer, self.pos
+                )
+                return value
+            except ValueError:
+                if not self.fill():
+                    raise
+
+    def keys(self):
+        """
+        Iterates over the keys of the next JSON object. The caller must
+        consume the value of every key before requesting the next one.
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+
+            char = self.peek()
+            self.pos += 1
+            if char == '}':
+                return
+            if char != ',':
+                raise ValueError("Expected ',' or '}' in JSON document")
+
+class JSON_StreamReader(object):
+    """
+    JSON_StreamReader reads Markov Chains from files in the format of
+    JSON_Reader, without loading the whole document. Rows of the [Table]
+    field are parsed one by one and appended to the arrays of a
+    compiled chain, so the extra memory needed is bounded by the largest
+    row rather than the size of the file.
+    """
+
+    def __init__(self, filename, block_size=BLOCK_SIZE):
+        """
+        Creates a new JSON_StreamReader object to read data from a file.
+
+        Args:
+            filename (str): The name of the input file.
+            block_size (int): The number of characters read at a time.
+        """
+        self.filename = filename
+        self.block_size = block_size
+
+    @timed('JSON_StreamReader', _read_sizes)
+    def compile(self, atol=1e-12):
+        """
+        Reads the file into a compiled chain.
+
+        Args:
+            atol (float): The absolute tolerance of the validation.
+
+        Returns:
+            a CompiledChain, with labels sorted as in MarkovChain's
+            'float64' mode
+        """
+        builder = TableBuilder()
+        with open(self.filename, 'r') as f:
+            stream = _JSONStream(f, self.block_size)
+            for field in stream.keys():
+                if field == 'Initial':
+                    for key in stream.keys():
+                        builder.add_initial(key, stream.value())
+                elif field == 'Table':
+                    for key in stream.keys():
+                        builder.add_row(key, stream.value().items())
+                else:
+                    stream.value()
+
+        return builder.compile(atol)
+
+    def read_chain(self, atol=1e-12):
+        """
+        Reads the file into a MarkovChain in 'float64' mode.
+
+        Args:
+            atol (float): The absolute tolerance of the validation.
+
+        Returns:
+            the MarkovChain described by the file
+        """
+        from simple_markov.lib import MarkovChain
+        return MarkovChain.from_compiled(self.compile(atol), atol)
+
+class YAML_StreamReader(object):
+    """
+    YAML_StreamReader reads Markov Chains from files in the format of
+    YAML_Reader, walking through the parser's events instead of building
+    the whole document, so that rows of the [Table] field are appended to
+    the arrays of a compiled chain as soon as they are parsed. Scalars are
+    resolved as by yaml.safe_load(); anchors and aliases are not supported.
+    """
+
+    def __init__(self, filename):
+        """
+        Initializes a YAML_StreamReader object to read data from a
+        specified file.
+
+        Args:
+            filename (str): the name of the YAML file
+        """
+        self.filename = filename
+
+    @staticmethod
+    def _scalar(loader, event):
+        """
+        Constructs the value of a scalar event, without the bookkeeping of
+        the loader's constructor, which keeps every object alive.
+        """
+        import yaml
+
+        if not isinstance(event, yaml.ScalarEvent):
+            raise ValueError("Unexpected YAML structure at " +
+                             str(event.start_mark).strip())
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(yaml.ScalarNode, event.value, event.implicit)
+        node = yaml.ScalarNode(tag, event.value, event.start_mark,
+                               event.end_mark, event.style)
+        return loader.yaml_constructors[tag](loader, node)
+
+    @classmethod
+    def _pairs(cls, loader):
+        """
+        Iterates over the key - value pairs of a mapping of scalars.
+        """
+        import yaml
+
+        if not isinstance(loader.get_event(), yaml.MappingStartEvent):
+            raise ValueError("Expected a YAML mapping")
+        while not loader.check_event(yaml.MappingEndEvent):
+            key = cls._scalar(loader, loader.get_event())
+            yield key, cls._scalar(loader, loader.get_event())
+        loader.get_event()
+
+    @classmethod
+    def _keys(cls, loader):
+        """
+        Iterates over the keys of a mapping whose values are consumed by
+        the caller.
+        """
+        import yaml
+
+        if not isinstance(loader.get_event(), yaml.MappingStartEvent):
+            raise ValueError("Expected a YAML mapping")
+        while not loader.check_event(yaml.MappingEndEvent):
+            yield cls._scalar(loader, loader.get_event())
+        loader.get_event()
+
+    @staticmethod
+    def _skip(loader):
+        """
+        Skips the next node, along with all of its children.
+        """
+        import yaml
+
+        depth = 0
+        while True:
+            event = loader.get_event()
+            if isinstance(event, yaml.CollectionStartEvent):
+                depth += 1
+            elif isinstance(event, yaml.CollectionEndEvent):
+                depth -= 1
+            if depth == 0:
+                return
+
+    @timed('YAML_StreamReader', _read_sizes)
+    def compile(self, atol=1e-12):
+        """
+        Reads the file into a compiled chain.
+
+        Args:
+            atol (float): the absolute tolerance of the validation
+
+        Returns:
+            a CompiledChain, with labels sorted as in MarkovChain's
+            'float64' mode
+        """
+        import yaml
+
+        Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+        builder = TableBuilder()
+        with open(self.filename, 'r') as f:
+            loader = Loader(f)
+            try:
+                loader.get_event()  # StreamStartEvent
+                loader.get_event()  # DocumentStartEvent
+                for field in self._keys(loader):
+                    if field == 'Initial':
+                        for key, value in self._pairs(loader):
+                            builder.add_initial(key, value)
+                    elif field == 'Table':
+                        for key in self._keys(loader):
+                            builder.add_row(key, self._pairs(loader))
+                    else:
+                        self._skip(loader)
+            finally:
+                loader.dispose()
+
+        return builder.compile(atol)
+
+    def read_chain(self, atol=1e-12):
+        """
+        Reads the file into a MarkovChain in 'float64' mode.
+
+        Args:
+            atol (float): the absolute tolerance of the validation
+
+        Returns:
+            the MarkovChain described by the file
+        """
+        from simple_markov.lib import MarkovChain
+        return MarkovChain.from_compiled(self.compile(atol), atol)
+
+class Binary_Reader(object):
+    """
+    Binary_Reader opens Markov Chains stored by Binary_Writer. The arrays of
+    the transition table are memory-mapped rather than read, so opening a
+    chain only costs reading its label table, and processes opening the
+    same file share its pages.
+
+    A binary chain file starts with a preamble of the signature
+    BINARY_MAGIC, the format version and the length of a JSON header,
+    both as little-endian 32 bit integers. The header holds the label
+    table ('labels') and the dtype, shape and offset of the 'indptr',
+    'indices', 'data' and 'initial' arrays ('arrays'). Every array starts
+    at a multiple of BINARY_ALIGNMENT bytes.
+    """
+
+    def __init__(self, filename):
+        """
+        Opens a binary chain file and reads its header.
+
+        Args:
+            filename (str): The name of the input file.
+        """
+        self.filename = filename
+
+        with open(filename, 'rb') as f:
+            preamble = f.read(BINARY_PREAMBLE.size)
+            if len(preamble) < BINARY_PREAMBLE.size:
+                raise ValueError("Not a binary chain file")
+            magic, version, length = BINARY_PREAMBLE.unpack(preamble)
+            if magic != BINARY_MAGIC:
+                raise ValueError("Not a binary chain file")
+            if version != BINARY_VERSION:
+                raise ValueError(
+                    "Unsupported binary chain format version " + str(version)
+                )
+            self.header = json.loads(f.read(length).decode('utf-8'))
+
+    def labels(self):
+        """
+        Returns the label table. JSON has no tuples, so labels stored as
+        lists are turned back into (hashable) tuples.
+        """
+        def label(key):
+            return tuple(label(k) for k in key) if isinstance(key, list) \
+                else key
+        return [label(key) for key in self.header['labels']]
+
+    def array(self, name):
+        """
+        Memory-maps one of the stored arrays, read-only.
+
+        Args:
+            name (str): 'indptr', 'indices', 'data' or 'initial'
+
+        Returns:
+            a numpy.memmap, or an empty array if nothing was stored
+        """
+        spec = self.header['arrays'][name]
+        dtype, shape = np.dtype(spec['dtype']), tuple(spec['shape'])
+        if not np.prod(shape):
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self.filename, dtype=dtype, mode='r',
+                         offset=spec['offset'], shape=shape)
+
+    @timed('Binary_Reader', _read_sizes)
+    def compile(self, validate=False, atol=1e-12):
+        """
+        Opens the stored chain as a compiled chain backed by the file.
+
+        Args:
+            validate (bool): Whether to validate the transition table,
+                which reads the whole file. Files written by Binary_Writer
+                hold validated chains.
+            atol (float): The absolute tolerance of the validation.
+
+        Returns:
+            the CompiledChain stored in the file
+        """
+        return CompiledChain.from_arrays(
+            self.array('indptr'), self.array('indices'), self.array('data'),
+            self.labels(), self.array('initial'), atol, validate
+        )
+
+    def read_chain(self, validate=False, atol=1e-12):
+        """
+        Opens the stored chain as a MarkovChain in 'float64' mode.
+
+        Args:
+            validate (bool): Whether to validate the transition table.
+            atol (float): The absolute tolerance of the validation.
+
+        Returns:
+            the MarkovChain stored in the file
+        """
+        from simple_markov.lib import MarkovChain
+        return MarkovChain.from_compiled(self.compile(validate, atol), atol)
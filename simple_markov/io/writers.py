@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import json
+
+import numpy as np
+
+from simple_markov.io.readers import BINARY_MAGIC, BINARY_VERSION, \
+    BINARY_PREAMBLE, BINARY_ALIGNMENT
+
+def _plain(value):
+    """
+    Converts numpy scalars among the labels to python ones for json.
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError("Label " + repr(value) + " is not JSON serializable")
+
+class Binary_Writer(object):
+    """
+    Binary_Writer stores Markov Chains in a compact binary format, which
+    Binary_Reader opens by memory-mapping the transition table instead of
+    parsing it. See Binary_Reader for a description of the format.
+
+    Labels are stored in JSON, so they must be strings, numbers or
+    (nested) tuples of them.
+    """
+
+    # dtype of every stored array, independent of the platform
+    dtypes = {
+        'indptr': '<i8',
+        'indices': '<i8',
+        'data': '<f8',
+        'initial': '<f8'
+    }
+
+    def __init__(self, filename):
+        """
+        Creates a new Binary_Writer object to write to a file.
+
+        Args:
+            filename (str): The name of the output file.
+        """
+        self.filename = filename
+
+    def write(self, chain):
+        """
+        Writes a chain to the file, replacing its contents.
+
+        Args:
+            chain: a MarkovChain or a CompiledChain
+        """
+        compiled = chain.compile() if hasattr(chain, 'compile') else chain
+        arrays = {
+            name: np.asarray(getattr(compiled, name), dtype=dtype)
+            for name, dtype in self.dtypes.items()
+        }
+
+        # the offsets depend on the header's length and vice versa, so they
+        # are filled in by _encode()
+        header = {'labels': compiled.labels, 'arrays': {}}
+        for name, array in arrays.items():
+            header['arrays'][name] = {
+                'dtype': self.dtypes[name],
+                'shape': list(array.shape),
+                'offset': 0
+            }
+        encoded = self._encode(header, arrays)
+
+        with open(self.filename, 'wb') as f:
+            f.write(BINARY_PREAMBLE.pack(
+                BINARY_MAGIC, BINARY_VERSION, len(encoded)
+            ))
+            f.write(encoded)
+            for name in self.dtypes:
+                f.write(b'\0' * (header['arrays'][name]['offset'] - f.tell()))
+                arrays[name].tofile(f)
+
+    @staticmethod
+    def _align(offset):
+        """
+        Rounds an offset up to a multiple of BINARY_ALIGNMENT.
+        """
+        return -(-offset // BINARY_ALIGNMENT) * BINARY_ALIGNMENT
+
+    def _encode(self, header, arrays):
+        """
+        Lays out the arrays after the header and encodes it, repeating
+        until the offsets no longer change the header's length.
+        """
+        length = -1
+        while True:
+            encoded = json.dumps(header, default=_plain).encode('utf-8')
+            if len(encoded) == length:
+                return encoded
+
+            length = len(encoded)
+            offset = self._align(BINARY_PREAMBLE.size + length)
+            for name in self.dtypes:
+                header['arrays'][name]['offset'] = offset
+                offset = self._align(offset + arrays[name].nbytes)
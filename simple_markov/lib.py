@@ -7,51 +7,101 @@ try:
 except ImportError:
     from simple_markov.utils import accumulate
 
-# import strongly_connected_components function for
-# MarkovChain.communication_classes()
-from simple_markov.utils import strongly_connected_components
+from simple_markov.utils import alias_table
+from simple_markov.compiled import CompiledChain
+from simple_markov import fitting, linalg, montecarlo
+from simple_markov.instrumentation import metrics, timed
+from simple_markov.walker import Walker
+from simple_markov.rng import UniformBuffer, as_rng
 
 import numpy as np
 from fractions import Fraction
-# import graphviz for graph drawing
-import graphviz as gv
 
 import bisect
 
+def _sizes(chain):
+    """
+    Describes the size of a chain for the timings of instrumented calls.
+    """
+    compiled = chain.compile()
+    return {'states': compiled.size, 'transitions': compiled.nnz}
+
 class State(object):
     """
     Represents a state in a markov chain.
     """
 
-    def __init__(self, distribution, label):
+    def __init__(self, distribution, label, atol=None):
         """
         Creates a new state that contains a distribution of transitions
         to other states with a specified label.
 
         :param distribution: an iterable of state - transition probability pairs
         :param label: the label of the state
+        :param atol: if given, probabilities are stored as floats and must
+         sum to 1 up to this absolute tolerance, instead of exactly as
+         Fractions
         """
+        number = Fraction if atol is None else float
         self.prob = {
-            d[0]: Fraction(d[1]) for d in distribution \
-            if 0 < Fraction(d[1]) <= 1
+            d[0]: number(d[1]) for d in distribution \
+            if 0 < number(d[1]) <= 1
         }
         self.cum_prob = list(accumulate(v for v in self.prob.values()))
-        if self.cum_prob[-1] != 1:
+        if abs(self.cum_prob[-1] - 1) > (atol or 0):
             raise ValueError("Transitions from state " + str(label) +
                     " do not form a probability distribution")
         self.label = label
 
-    def next_state(self):
+        # labels of the target states, in the order of cum_prob
+        self.targets = list(self.prob)
+
+    def alias(self):
+        """
+        Returns the alias table used by next_state(), building it from
+        the float equivalents of the transition probabilities the first
+        time it is requested.
+
+        :returns: a tuple containing the acceptance probabilities and the
+         aliased columns of the table
+        """
+        try:
+            return self._alias
+        except AttributeError:
+            self._alias = alias_table([float(v) for v in self.prob.values()])
+            return self._alias
+
+    def next_state(self, rng=rnd):
+        """
+        Chooses the next state at random in constant time, using Walker's
+        alias method: a coin toss in the range [0, 1) picks one of the
+        table's columns along with a position inside it, which decides
+        between the column's own state and its alias.
+
+        :param rng: the source of the coin toss, an object with a random()
+         method such as a rng.UniformBuffer; the random module by default
+        :returns: the next state, chosen at random
+        """
+        prob, alias = self.alias()
+        coin_toss = rng.random() * len(prob)
+        column = int(coin_toss)
+        if coin_toss - column >= prob[column]:
+            column = alias[column]
+        return self.targets[column]
+
+    def next_state_exact(self, rng=rnd):
         """
         Chooses the next state at random by simulating a coin toss with result
         in the range [0, 1], finding in which cumulative probability interval
         the result falls into, and returning the state associated with the
-        interval.
+        interval. Unlike next_state(), the intervals are compared using the
+        exact Fraction probabilities.
 
+        :param rng: the source of the coin toss, see next_state()
         :returns: the next state, chosen at random
         """
-        coin_toss = rnd.uniform(0, 1)
-        return list(self.prob)[bisect.bisect_left(self.cum_prob, coin_toss)]
+        coin_toss = rng.uniform(0, 1)
+        return self.targets[bisect.bisect_left(self.cum_prob, coin_toss)]
 
     def accessible_states(self):
         """
@@ -80,15 +130,42 @@ class MarkovChain(object):
     An iterable that represents a discrete time Markov Chain.
     """
 
-    def __init__(self, initial_distrib, transition_table):
+    # source of the coin tosses of iteration, run_for() and the
+    # sequential monte_carlo_estimation(); see seed()
+    rng = rnd
+
+    def __init__(self, initial_distrib, transition_table, dtype='fraction',
+                 atol=1e-12):
         """
         Creates a new Markov Chain with a specified initial distribution vector
         and a given transition table.
 
         :param initial_distrib: a map of states to initial probabilities
         :param transition_table: a 2D table containing transition probabilites
+        :param dtype: 'fraction' (default) to store probabilities exactly as
+         Fractions, or 'float64' to compile the table straight into float
+         arrays, validating all rows at once up to atol
+        :param atol: the absolute tolerance used by the 'float64' mode
         """
+        # store the transition table for future reference
+        self._transition_table = transition_table
+
+        # initialize current_state to None
+        self.current_state = None
 
+        if dtype == 'float64':
+            self._compiled = CompiledChain.from_table(
+                initial_distrib, transition_table, atol
+            )
+            self.initial_probs = {
+                k: float(v) for k, v in initial_distrib.items()
+            }
+            self.atol = atol
+            return
+        elif dtype != 'fraction':
+            raise ValueError("Unknown dtype " + str(dtype))
+
+        self.atol = None
         self.initial_probs = {
             k : Fraction(v) for k,v in initial_distrib.items()
         }
@@ -99,31 +176,312 @@ class MarkovChain(object):
             )
 
         # map of label-to-state pairs
-        self.states = {
+        self._states = {
             k: State(transition_table[k], k) for k in transition_table
         }
 
-        # store the transition table for future reference
-        self.transition_table = transition_table
+    @classmethod
+    def from_compiled(cls, compiled, atol=1e-12):
+        """
+        Creates a new Markov Chain in 'float64' mode around an existing
+        CompiledChain. The transition table and the State objects are
+        only created if requested.
 
-        # initialize current_state to None
-        self.current_state = None
+        :param compiled: the CompiledChain
+        :param atol: the absolute tolerance of the chain's State objects
+        :returns: the new MarkovChain
+        """
+        chain = cls.__new__(cls)
+        chain._compiled = compiled
+        chain.atol = atol
+        chain.current_state = None
+
+        labels = compiled.labels
+        chain.initial_probs = {
+            labels[i]: p for i, p in
+            zip(np.flatnonzero(compiled.initial),
+                compiled.initial[compiled.initial != 0].tolist())
+        }
+        return chain
+
+    @classmethod
+    def from_sparse(cls, matrix, labels=None, initial=None, atol=1e-12):
+        """
+        Creates a new Markov Chain in 'float64' mode from a scipy.sparse
+        transition matrix. The arrays of a float64 CSR matrix without
+        explicit zeros are adopted without copying.
+
+        :param matrix: a square scipy.sparse matrix, whose rows must form
+         probability distributions up to atol
+        :param labels: a sequence of state labels, state indices by default
+        :param initial: a map of states to initial probabilities or an
+         array-like with one probability per state, uniform by default
+        :param atol: the absolute tolerance of the validation
+        :returns: the new MarkovChain
+
+        >>> from scipy.sparse import csr_matrix
+        >>> chain = MarkovChain.from_sparse(
+                csr_matrix([[0.5, 0.5], [0.0, 1.0]]), labels=['A', 'B'],
+                initial={'A': 1.0})
+        >>> chain.state_probabilities(2)
+        {'A': 0.25, 'B': 0.75}
+
+        """
+        matrix = matrix.tocsr()
+        if matrix.shape[0] != matrix.shape[1]:
+            raise ValueError("Transition matrix must be square")
+        if not matrix.has_canonical_format:
+            matrix = matrix.copy()
+            matrix.sum_duplicates()
+
+        return cls.from_compiled(CompiledChain.from_arrays(
+            matrix.indptr, matrix.indices, matrix.data, labels, initial, atol
+        ), atol)
+
+    @classmethod
+    def from_matrix(cls, matrix, labels=None, initial=None, atol=1e-12):
+        """
+        Creates a new Markov Chain in 'float64' mode from a transition
+        matrix, either a dense array-like or a scipy.sparse matrix (see
+        from_sparse()). Only the non-zero entries of a dense matrix are kept.
+
+        :param matrix: a square transition matrix, whose rows must form
+         probability distributions up to atol
+        :param labels: a sequence of state labels, state indices by default
+        :param initial: a map of states to initial probabilities or an
+         array-like with one probability per state, uniform by default
+        :param atol: the absolute tolerance of the validation
+        :returns: the new MarkovChain
+        """
+        if hasattr(matrix, 'tocsr'):
+            return cls.from_sparse(matrix, labels, initial, atol)
+
+        matrix = np.asarray(matrix, dtype=np.float64)
+        if matrix.ndim != 2 or matrix.shape[0] != matrix.shape[1]:
+            raise ValueError("Transition matrix must be square")
+
+        # row-major order of the non-zero entries is already CSR order
+        rows, indices = np.nonzero(matrix)
+        indptr = np.zeros(matrix.shape[0] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=matrix.shape[0]),
+                  out=indptr[1:])
+
+        return cls.from_compiled(CompiledChain.from_arrays(
+            indptr, indices, matrix[rows, indices], labels, initial, atol
+        ), atol)
+
+    @classmethod
+    def fit(cls, sequences, labels=None, smoothing=0.0, initial=None,
+            atol=1e-12):
+        """
+        Estimates a Markov Chain in 'float64' mode from observed sequences
+        of states, by counting their transitions with a
+        fitting.TransitionCounter. For long sequences given in chunks, or
+        counts collected by several workers, use the counter directly.
+
+        :param sequences: an iterable of sequences of state labels, each
+         an iterable or an integer numpy array
+        :param labels: an optional iterable of the state labels
+        :param smoothing: a pseudo-count added to every transition
+        :param initial: the initial distribution, by default the frequency
+         of every state at the start of the sequences
+        :param atol: the absolute tolerance of the validation
+        :returns: the estimated MarkovChain
+
+        >>> chain = MarkovChain.fit(['AABAB', 'AB'])
+        >>> chain.transition_table
+        {'A': [('A', 0.25), ('B', 0.75)], 'B': [('A', 1.0)]}
+
+        """
+        counter = fitting.TransitionCounter(labels)
+        for sequence in sequences:
+            counter.update(sequence)
+        return counter.to_chain(smoothing, initial, atol)
+
+    @property
+    def transition_table(self):
+        """
+        The transition table of the chain, as given to the constructor. For
+        chains created from matrices, it is built from the compiled chain
+        the first time it is requested.
+        """
+        try:
+            return self._transition_table
+        except AttributeError:
+            self._transition_table = {
+                key: list(state.prob.items())
+                for key, state in self.states.items()
+            }
+            return self._transition_table
+
+    @property
+    def states(self):
+        """
+        A map of label-to-state pairs. In 'float64' mode, the State objects
+        are only created the first time they are requested.
+        """
+        try:
+            return self._states
+        except AttributeError:
+            compiled = self._compiled
+            labels = compiled.labels
+            self._states = {}
+            for i, key in enumerate(labels):
+                targets, probs = compiled.row(i)
+                self._states[key] = State(
+                    zip((labels[j] for j in targets), probs.tolist()),
+                    key, self.atol
+                )
+            return self._states
+
+    def compile(self):
+        """
+        Compiles the chain into a frozen, integer-indexed representation,
+        which is used for simulation and analysis. The compiled chain is
+        built on the first call and cached afterwards.
+
+        :returns: the chain's CompiledChain
+        """
+        try:
+            return self._compiled
+        except AttributeError:
+            self._compiled = CompiledChain.from_states(
+                self.states, self.initial_probs
+            )
+            return self._compiled
+
+    def _new_state(self, label, distribution, index):
+        """
+        Validates the transitions of a state, given as to the constructor
+        or as a map of states to probabilities, and maps their targets to
+        indices.
+
+        :param label: the label of the state
+        :param distribution: the transitions from the state
+        :param index: a map of labels to state indices
+        :returns: a tuple of the transitions as a list of pairs, the State
+         object, the target indices and the float probabilities
+        """
+        if isinstance(distribution, dict):
+            distribution = list(distribution.items())
+        else:
+            distribution = list(distribution)
+        state = State(distribution, label, self.atol)
+
+        try:
+            targets = [index[key] for key in state.prob]
+        except KeyError as e:
+            raise ValueError(
+                "State " + str(e.args[0]) + " has no outgoing transitions"
+            )
+        probs = [float(v) for v in state.prob.values()]
+        return distribution, state, targets, probs
+
+    def _store_state(self, label, distribution, state):
+        """
+        Stores the transitions of a state in the State map and the
+        transition table, if they have been created, or removes the state
+        if they are None. The table given to the constructor is copied
+        rather than modified.
+        """
+        try:
+            if state is None:
+                del self._states[label]
+            else:
+                self._states[label] = state
+        except AttributeError:
+            pass
+
+        try:
+            table = self._transition_table
+        except AttributeError:
+            return
+        if not getattr(self, '_owns_table', False):
+            table = self._transition_table = dict(table)
+            self._owns_table = True
+        if distribution is None:
+            table.pop(label, None)
+        else:
+            table[label] = distribution
+
+    def update_row(self, label, distribution):
+        """
+        Replaces the transitions from a state. The compiled chain is
+        patched rather than rebuilt, and derived data, such as the alias
+        tables and the communication classes, are kept whenever the
+        change does not affect them.
+
+        :param label: the label of the state
+        :param distribution: an iterable of state - transition probability
+         pairs, or a map of states to transition probabilities
+        """
+        compiled = self.compile()
+        try:
+            i = compiled.index[label]
+        except KeyError:
+            raise ValueError("Unknown state " + str(label))
+
+        distribution, state, targets, probs = self._new_state(
+            label, distribution, compiled.index
+        )
+        self._compiled = compiled.replace_row(i, targets, probs)
+        self._store_state(label, distribution, state)
+
+    def add_state(self, label, distribution):
+        """
+        Adds a state with zero initial probability. Its transitions may
+        lead to itself; transitions from other states to it can be added
+        with update_row() afterwards.
+
+        :param label: the label of the new state
+        :param distribution: an iterable of state - transition probability
+         pairs, or a map of states to transition probabilities
+        """
+        compiled = self.compile()
+        if label in compiled.index:
+            raise ValueError("State " + str(label) + " already exists")
+
+        index = {label: compiled.size}
+        index.update(compiled.index)
+        distribution, state, targets, probs = self._new_state(
+            label, distribution, index
+        )
+        self._compiled = compiled.append_state(label, targets, probs)
+        self._store_state(label, distribution, state)
+
+    def remove_state(self, label):
+        """
+        Removes a state, which must have zero initial probability and must
+        not be reachable from any other state in one step.
+
+        :param label: the label of the state
+        """
+        compiled = self.compile()
+        try:
+            i = compiled.index[label]
+        except KeyError:
+            raise ValueError("Unknown state " + str(label))
+        if label == self.current_state:
+            raise ValueError("Cannot remove the current state " + str(label))
+
+        self._compiled = compiled.remove_state(i)
+        self.initial_probs.pop(label, None)
+        self._store_state(label, None, None)
+
+        # states after the removed one have been renumbered
+        if self.current_state is not None:
+            self._position = self._compiled.index[self.current_state]
 
     def __iter__(self):
         """
         Makes this object iterable - chooses an initial state.
         """
         self.steps = 0
-        # coin toss to choose first state
-        toss, run_sum = rnd.uniform(0, 1), 0
+        compiled = self.compile()
 
-        # calculate running sum and return the state
-        # when coin toss is reached
-        for (key, val) in self.initial_probs.items():
-            run_sum += val
-            if (toss <= run_sum):
-                self.current_state = key
-                break
+        # coin toss to choose first state
+        self._position = compiled.initial_state(self.rng.random())
+        self.current_state = compiled.labels[self._position]
 
         # return the modified object
         return self
@@ -137,7 +495,11 @@ class MarkovChain(object):
             raise StopIteration
 
         self.steps += 1
-        self.current_state = self.states[self.current_state].next_state()
+        if metrics.enabled:
+            metrics.count('steps')
+        compiled = self._compiled
+        self._position = compiled.step(self._position, self.rng.random())
+        self.current_state = compiled.labels[self._position]
         return self.current_state
 
     def next(self):
@@ -145,7 +507,8 @@ class MarkovChain(object):
 
     def run_for(self, steps):
         """
-        Simulate the markov chain for a specified number of steps.
+        Simulate the markov chain for a specified number of steps, with a
+        Walker of its own that leaves the chain's iteration state untouched.
         :param steps: the number of steps to simulate
         :returns: a sequence of states as a generator expression
 
@@ -165,26 +528,113 @@ class MarkovChain(object):
         if (steps <= 0):
             return
 
-        # initialize iterable
-        it = iter(self)
-        simulation_step = 0
+        # every run gets its own walker, so that runs don't interfere with
+        # each other or with iteration over the chain
+        walker = Walker(self.compile(), self.rng)
+        for next_state in walker.run_for(steps):
+            yield next_state
 
-        while simulation_step < steps:
-            try:
-                next_state = next(it)
-            except StopIteration:
-                return
+    def walker(self, seed=None, state=None):
+        """
+        Creates an independent walker over the compiled chain. Walkers only
+        hold their own state, step count and random generator, so many of
+        them can share one chain, even across threads.
+
+        :param seed: a seed or numpy.random.Generator for the walker's
+         rng.UniformBuffer, or any object with a random() method
+        :param state: the label of the starting state, chosen from the
+         initial distribution by default
+        :returns: a new Walker
+        """
+        return Walker(self.compile(), seed, state)
 
-            # update simulation step
-            simulation_step += 1
-            yield next_state
+    def walkers(self, n, seed=None):
+        """
+        Creates walkers with independent random streams, spawned from a
+        single seed, so that a set of walkers is reproducible as a whole.
+
+        :param n: the number of walkers
+        :param seed: a seed or numpy.random.Generator
+        :returns: a list of new Walkers
+        """
+        compiled = self.compile()
+        return [
+            Walker(compiled, rng) for rng in UniformBuffer(seed).spawn(n)
+        ]
 
-    def state_probabilities(self, steps=1):
+    def seed(self, seed=None):
+        """
+        Gives the chain a random stream of its own, used when iterating
+        over it, by run_for() and by the sequential monte_carlo_estimation(),
+        instead of the random module's global one.
+
+        :param seed: a seed or numpy.random.Generator for a new
+         rng.UniformBuffer, or any object with a random() method
+        """
+        self.rng = as_rng(seed)
+
+    def simulate_batch(self, n_walkers, n_steps, seed=None):
+        """
+        Simulates many independent trajectories of the markov chain at once.
+        All walkers choose their initial state from the initial distribution
+        and then advance in lockstep, drawing the next state of every walker
+        with a single search over the cumulative transition probabilities.
+
+        :param n_walkers: the number of independent trajectories
+        :param n_steps: the number of steps to simulate for each trajectory
+        :param seed: a seed for numpy's random generator (optional)
+        :returns: a tuple containing an integer array of shape
+         (n_walkers, n_steps) with the visited states, excluding the initial
+         ones as in run_for(), and the list of labels that the integers
+         refer to
+
+        >>> chain = MarkovChain(
+                {'A': "0.5",'B': "0.5"},
+                {'A': [('A', "0.4"), ('B', "0.6")],
+                 'B': [('A', "0.8"), ('B', "0.2")]
+                })
+
+        >>> paths, labels = chain.simulate_batch(3, 4, seed=1)
+        >>> [[labels[i] for i in path] for path in paths]
+        [['B', 'B', 'A', 'A'], ['A', 'B', 'A', 'B'], ['B', 'A', 'B', 'A']]
+
+        """
+        compiled = self.compile()
+        rng = np.random.default_rng(seed)
+
+        current = np.searchsorted(
+            compiled.initial_cumulative(), rng.random(n_walkers), side='right'
+        )
+        np.minimum(current, compiled.size - 1, out=current)
+
+        # fill the result step by step, one row per step
+        paths = np.empty((max(n_steps, 0), n_walkers), dtype=np.int64)
+        for step in range(n_steps):
+            current = compiled.step_batch(current, rng.random(n_walkers))
+            paths[step] = current
+
+        return paths.T, compiled.labels
+
+    @timed('state_probabilities',
+           lambda result, self, steps=1, *args, **kwargs: dict(
+               _sizes(self), steps=steps))
+    def state_probabilities(self, steps=1, block_size=None, workers=None):
         """
         Calculates the probability of the markov chain's states in the future
-        after a specified number of steps (default 1).
+        after a specified number of steps (default 1). The transition matrix
+        is kept sparse and the distribution is obtained either by repeated
+        vector - matrix products or by repeated squaring, whichever is
+        expected to be cheaper for the number of steps and the size of the
+        chain.
+
+        For chains larger than the memory, e.g. opened from a file by
+        io.Binary_Reader, give a block_size: the transition table is then
+        streamed in blocks of that many transitions at every step (see
+        CompiledChain.vecmat_blocked()), optionally by several threads.
 
         :param steps: the number of steps
+        :param block_size: the number of transitions per streamed block
+        :param workers: the number of threads multiplying streamed blocks
         :returns: a map of state - transition probability pairs
 
         >>> m_chain = MarkovChain(
@@ -197,81 +647,94 @@ class MarkovChain(object):
         {'A': 0.6, 'B', 0.4}
 
         """
-        try:
-            # if matrix is already available, skip extra work
-            prob_mat = self.prob_matrix
-        except AttributeError:
-            # otherwise, we'll have to initialize
-            # if scipy is available, use its sparse matrix
-            try:
-                from scipy.sparse import coo_matrix
-                has_scipy = True
-            except ImportError:
-                has_scipy = False
-
-            # sort labels for stable representation
-            labels = sorted(key for key in self.states)
-            size = len(labels)
-
-            if has_scipy:
-                sparse_frame = []
-                for i, key in enumerate(labels):
-                    for j in range(size):
-                        try:
-                            # convert all fractions to pure floats
-                            curr_elem = float(Fraction(
-                                self.transition_table[key][j][1]
-                            ))
-                            sparse_frame.append((curr_elem, i, j))
-                        except (KeyError, IndexError):
-                            # continue with next element
-                            continue
-                # get data and row - column vectors for sparse representation
-                data, row, col = zip(*sparse_frame)
-                self.prob_matrix = sparse.coo_matrix(
-                    (data, (row, col)),
-                    shape=(size, size)
-                )
-            # No scipy available, use simple numpy instead
-            else:
-                self.prob_matrix = np.zeros(shape = (size, size))
-                for i, key in enumerate(labels):
-                    for j in range(size):
-                        try:
-                            curr_elem = float(Fraction(
-                                self.transition_table[key][j][i]
-                            ))
-                        except (KeyError, IndexError):
-                            # fill with 0 and continue
-                            curr_elem = 0
-
-                        self.prob_matrix[i][j] = curr_elem
-
-            # creation has been finished - assign matrix
-            prob_mat = self.prob_matrix
-
-        # If matrix is already of the numpy type, catch the AttributeError
-        try:
-            tran_matrix = prob_mat.toarray()
-        except AttributeError:
-            tran_matrix = prob_mat
-
-        # adjust transition matrix according to number of steps
-        if steps > 1:
-            tran_matrix = np.linalg.matrix_power(tran_matrix, steps)
+        compiled = self.compile()
 
-        # vector of by-label sorted initial probabilities
-        init_probs_vec = np.array([
-            self.initial_probs[key] for key in labels
-        ])
-
-        # pi_i * P(i, j)
-        future_probs_vec = np.dot(init_probs_vec, tran_matrix)
+        # pi * P^steps, keeping the matrix sparse
+        future_probs_vec = compiled.propagate(
+            compiled.initial, steps, block_size, workers
+        )
         return {
-            v[0]: v[1] for v in zip(labels, future_probs_vec)
+            v[0]: v[1] for v in zip(compiled.labels, future_probs_vec)
         }
 
-    def monte_carlo_estimation(self, experiments, term_condition, hit_condition):
+    def cache_powers(self, max_bytes=256 << 20):
+        """
+        Enables an LRU cache of the binary powers P^(2^i) of the transition
+        matrix, so that state_probabilities() at many horizons reuses the
+        same matrix squarings. Its hit and miss counters are available
+        through the returned object's stats(). Modifying the chain, e.g.
+        with update_row(), empties the cache.
+
+        :param max_bytes: the memory budget of the cache, in bytes, or None
+         to disable it
+        :returns: the compiled.PowerCache, or None
+
+        >>> cache = m_chain.cache_powers(64 << 20)
+        >>> m_chain.state_probabilities(512)
+        >>> m_chain.state_probabilities(1024)
+        >>> cache.stats()['hits']
+        9
+
+        """
+        return self.compile().cache_powers(max_bytes)
+
+    def distribution_trajectory(self, n_steps, every=1, tol=None,
+                                block_size=None, workers=None):
+        """
+        Calculates the probability of the markov chain's states at every
+        step from 1 up to a specified number of steps, with a single
+        sparse vector - matrix product per step. Distributions are given
+        as arrays ordered like the labels of the compiled chain.
+
+        :param n_steps: the maximum number of steps
+        :param every: only yield the distribution every that many steps
+        :param tol: if given, stop as soon as the total variation distance
+         between two consecutive distributions falls below it; the
+         distribution of the last step is always yielded in that case
+        :param block_size: if given, stream the transition table in blocks
+         of that many transitions, see state_probabilities()
+        :param workers: the number of threads multiplying streamed blocks
+        :returns: a generator of (step, distribution) pairs
+
+        >>> m_chain = MarkovChain(
+                {'A': "0.5", 'B': "0.5"},
+                {'A': [('A', "1.0")],
+                'B': [('A', "0.2"), ('B', "0.8")]
+                })
+
+        >>> [(t, list(v)) for t, v in m_chain.distribution_trajectory(4, 2)]
+        [(2, [0.68, 0.32]), (4, [0.7952, 0.2048])]
+
+        """
+        if every < 1:
+            raise ValueError("Stride must be a positive integer")
+
+        compiled = self.compile()
+        vector = compiled.initial
+
+        if block_size is None:
+            product = compiled.vecmat
+        else:
+            def product(vector):
+                return compiled.vecmat_blocked(vector, block_size, workers)
+
+        for step in range(1, n_steps + 1):
+            previous, vector = vector, product(vector)
+
+            # total variation distance between consecutive steps
+            converged = tol is not None and \
+                0.5 * np.abs(vector - previous).sum() < tol
+
+            if converged or step % every == 0:
+                yield step, vector
+            if converged:
+                return
+
+    @timed('monte_carlo_estimation',
+           lambda result, self, experiments, *args, **kwargs: dict(
+               _sizes(self), experiments=experiments, steps=result[1]))
+    def monte_carlo_estimation(self, experiments, term_condition, hit_condition,
+                               workers=None, seed=None):
         """
         Calculates the probability that hit_condition holds before
         term_condition happens.
@@ -280,25 +743,144 @@ class MarkovChain(object):
 
         :param term_condition: a function accepting a state as an argument.
          If it returns true the current experiment running is terminated.
+         Alternatively, a set of state labels (e.g. the absorbing states)
+         or a boolean array over the states of the compiled chain.
 
         :param hit_condition: a function accepting a state as an argument.
-         It returns true when a state should be counted as a hit.
+         It returns true when a state should be counted as a hit. Also
+         accepts a set of labels or a boolean array, like term_condition.
+         If both conditions are given in that form, the experiments run
+         as a batch of walkers with NumPy.
+
+        :param workers: the number of processes to split the experiments
+         across. The conditions must then be picklable, e.g. module-level
+         functions.
+
+        :param seed: a seed for the independent numpy random streams of the
+         experiments. If either workers or seed is given, the results are
+         reproducible for the same seed regardless of the number of workers
+         and the chain's iteration state is left untouched.
 
          :returns: a tuple containing the number of hits and the number of steps
           that occured in the experiments.
         """
+        compiled = self.compile()
+        declarative = not callable(term_condition) and \
+            not callable(hit_condition)
+
+        if workers is not None or seed is not None or declarative:
+            return montecarlo.estimate(
+                compiled, experiments, term_condition, hit_condition,
+                workers, seed
+            )
+
+        term_condition = montecarlo.as_condition(compiled, term_condition)
+        hit_condition = montecarlo.as_condition(compiled, hit_condition)
+
         counter = 0
         steps = 0
         for i in range(experiments):
-            chain = iter(self)
-            for _ in chain:
+            for state in Walker(compiled, self.rng):
                 steps += 1
-                if hit_condition(chain.current_state):
+                if hit_condition(state):
                     counter += 1
-                if term_condition(chain.current_state):
+                if term_condition(state):
                     break
         return (counter, steps)
 
+    def _state_mask(self, states):
+        """
+        Converts a collection of state labels or a boolean array over the
+        compiled chain's states to a boolean mask.
+        """
+        mask = montecarlo.as_mask(self.compile(), states)
+        if mask is None:
+            raise TypeError("States must be a collection of labels or a mask")
+        return mask
+
+    def absorption_probabilities(self, targets, avoid=None, method='auto'):
+        """
+        Calculates, for every state, the probability that the chain starting
+        from it ever reaches the target states, or reaches them before the
+        states to avoid if these are given. States that cannot reach the
+        targets are found by a graph search and the remaining ones are
+        solved for exactly, from the sparse linear system
+        h_i = sum_j P(i, j) h_j, with h = 1 on the targets.
+
+        :param targets: a set of state labels or a boolean mask
+        :param avoid: a set of state labels or a boolean mask (optional)
+        :param method: 'auto', 'direct' (sparse LU) or 'gmres', see
+         simple_markov.linalg.solve
+        :returns: a map of state - probability pairs
+
+        >>> m_chain = MarkovChain(
+            {'S': "1"},
+            {
+                'S': [('S', "0.2"), ('A', "0.5"), ('B', "0.3")],
+                'A': [('A', "1")],
+                'B': [('B', "1")]
+            })
+
+        >>> m_chain.absorption_probabilities({'A'})
+        {'A': 1.0, 'B': 0.0, 'S': 0.625}
+
+        """
+        compiled = self.compile()
+        target_mask = self._state_mask(targets)
+        avoid_mask = None if avoid is None else \
+            self._state_mask(avoid) & ~target_mask
+
+        probs = target_mask.astype(np.float64)
+        unknown = np.flatnonzero(
+            compiled.reaching(target_mask, avoid_mask) & ~target_mask
+        )
+
+        if unknown.size:
+            matrix = compiled.matrix()
+            probs[unknown] = linalg.solve(
+                linalg.transient_system(matrix, unknown),
+                matrix[unknown].dot(target_mask.astype(np.float64)),
+                method
+            )
+
+        return dict(zip(compiled.labels, probs.tolist()))
+
+    def expected_hitting_times(self, targets, method='auto'):
+        """
+        Calculates, for every state, the expected number of steps until the
+        chain starting from it reaches the target states. States that may
+        never reach the targets get an infinite hitting time. For the
+        remaining ones, the sparse linear system
+        k_i = 1 + sum_j P(i, j) k_j, with k = 0 on the targets, is solved.
+
+        :param targets: a set of state labels or a boolean mask
+        :param method: 'auto', 'direct' (sparse LU) or 'gmres', see
+         simple_markov.linalg.solve
+        :returns: a map of state - expected number of steps pairs
+
+        >>> m_chain.expected_hitting_times({'A', 'B'})
+        {'A': 0.0, 'B': 0.0, 'S': 1.25}
+
+        """
+        compiled = self.compile()
+        target_mask = self._state_mask(targets)
+
+        # states that can get stuck away from the targets, or lead to one
+        stuck = ~compiled.reaching(target_mask)
+        infinite = compiled.reaching(stuck, target_mask)
+
+        times = np.where(infinite, np.inf, 0.0)
+        unknown = np.flatnonzero(~infinite & ~target_mask)
+
+        if unknown.size:
+            times[unknown] = linalg.solve(
+                linalg.transient_system(compiled.matrix(), unknown),
+                np.ones(unknown.size),
+                method
+            )
+
+        return dict(zip(compiled.labels, times.tolist()))
+
     def to_graph(self):
         """
         Converts the markov chain into a graph representation, where the
@@ -318,14 +900,27 @@ class MarkovChain(object):
         }
 
         """
-        return { s: self.states[s].prob for s in self.states }
+        compiled = self.compile()
+        labels = compiled.labels
+        indptr = compiled.indptr.tolist()
+        indices, data = compiled.indices.tolist(), compiled.data.tolist()
+
+        return {
+            labels[i]: {
+                labels[j]: p for j, p in
+                zip(indices[indptr[i]:indptr[i + 1]],
+                    data[indptr[i]:indptr[i + 1]])
+            } for i in range(compiled.size)
+        }
 
+    @timed('communication_classes',
+           lambda result, self: dict(_sizes(self), classes=len(result)))
     def communication_classes(self):
         """
-        Finds the communication classes of this markov chain by applying
-        Tarjan's strongly connected components algorithm to the chain's
-        digraph. For each class, also returns info about whether it is
-        open or closed.
+        Finds the communication classes of this markov chain by finding the
+        strongly connected components of the compiled chain's digraph (see
+        simple_markov.utils.csr_strongly_connected_components). For each
+        class, also returns info about whether it is open or closed.
 
         >>> m_chain = MarkovChain(
             {'A': 0.3, 'B': 0.5, 'C': 0.2},
@@ -342,16 +937,92 @@ class MarkovChain(object):
         :returns: a set containing the chain's communication classes
         """
 
-        return strongly_connected_components(self.to_graph())
+        compiled = self.compile()
+        labels = compiled.labels
+        closed = compiled.components()[1]
+
+        return [
+            {
+                'states': set(labels[i] for i in c_states),
+                'type': 'closed' if c_closed else 'open'
+            } for c_states, c_closed in zip(compiled.classes(), closed)
+        ]
+
+    @timed('stationary_distribution',
+           lambda result, self, *args, **kwargs: _sizes(self))
+    def stationary_distribution(self, method='auto', tol=1e-10, maxiter=None):
+        """
+        Calculates the stationary distribution of every closed communication
+        class of the markov chain, by solving the balance equations of the
+        class's sparse transition matrix. Every stationary distribution of
+        the chain is a mixture of these. See simple_markov.linalg.stationary
+        for the available methods.
+
+        :param method: one of 'auto', 'direct', 'power', 'gmres' or 'eigs'
+        :param tol: the tolerance of the iterative methods
+        :param maxiter: the maximum number of iterations of iterative methods
+        :returns: a list of dicts, one per closed class, containing the
+         class's states ('states'), its stationary distribution as a map of
+         state - probability pairs ('distribution'), the method used
+         ('method'), the number of iterations ('iterations') and the 1-norm
+         of the residual pi * P - pi ('residual')
+
+        >>> m_chain = MarkovChain(
+            {'A': "0.3", 'B': "0.5", 'C': "0.2"},
+            {
+                'A': [('B', "1.0")],
+                'B': [('A', "0.5"), ('C', "0.5")],
+                'C': [('B', "1.0")]
+            })
+
+        >>> m_chain.stationary_distribution()[0]['distribution']
+        {'A': 0.25, 'B': 0.5, 'C': 0.25}
+
+        """
+        compiled = self.compile()
+        matrix = compiled.matrix()
+        labels = compiled.labels
+
+        result = []
+        closed = compiled.components()[1]
+        for idx, c_closed in zip(compiled.classes(), closed):
+            if not c_closed:
+                continue
+
+            solution = linalg.stationary(
+                linalg.submatrix(matrix, idx), method, tol, maxiter
+            )
+
+            result.append({
+                'states': set(labels[i] for i in idx),
+                'distribution': {
+                    labels[i]: p for i, p in zip(idx, solution['vector'])
+                },
+                'method': solution['method'],
+                'iterations': solution['iterations'],
+                'residual': solution['residual']
+            })
+
+        return result
+
+    def class_graph(self):
+        """
+        Builds the condensation of the chain's digraph, whose nodes are the
+        communication classes (see simple_markov.compiled.ClassGraph). The
+        graph is built once per compiled chain and cached.
+
+        :returns: the chain's ClassGraph
+        """
+        return self.compile().class_graph()
 
     def get_class_connections(self):
         """
         Finds the communication classes of this chain and subsequently finds
-        all connections between them.
+        all connections between them, as given by class_graph().
 
         :returns: a dictionary containing all inter-class connections, where
          keys / values are tuples / lists of tuples containing the class
-         states.
+         states, in the order of the compiled chain's labels.
 
         >>> ch = MarkovChain(
                 {'A' : 0.2, 'B': 0.2, 'C': 0.3, 'D': 0.3},
@@ -366,36 +1037,16 @@ class MarkovChain(object):
         {('A', 'B'): [('C', 'D')], ('C', 'D'): []}
 
         """
-        # get the classes first
-        c_classes = self.communication_classes()
-
-        # anonymous fun that checks if a state belongs to another class (x)
-        # in a list of classes provided this class does not have the same states
-        # as (y).
-        filt = lambda s, x, y: s in x['states'] if x['states'] != y else False
-
-        # find all open classes
-        open_classes = filter(lambda x: x['type'] == 'open', c_classes)
-
-        # dict containing class -> class accessibility mappings
-        class_conns = {tuple(i['states']): [] for i in c_classes}
-
-        # for each open communication class, find out which other
-        # classes it communicates with
-        for s_set in (i['states'] for i in open_classes):
-            # states accessible from this class
-            can_access = set.union(
-                *(self.states[s].accessible_states() for s in s_set)
-            )
+        graph = self.class_graph()
+        labels = self.compile().labels
 
-            for acc in can_access:
-                # find all classes accessible from this one by keeping only
-                # classes whose states contain any state from the accessible
-                # set.
-                found = filter(lambda x: filt(acc, x, s_set), c_classes)
-                class_conns[tuple(s_set)].extend(tuple(i['states']) for i in found)
+        # states of every class, in the order of the compiled labels
+        keys = [tuple(labels[i] for i in c) for c in graph.classes]
 
-        return class_conns
+        return {
+            keys[c]: [keys[d] for d in graph.successors(c)]
+            for c in range(graph.size)
+        }
 
     def draw_class_connections(self, return_graph = False):
         """
@@ -423,16 +1074,24 @@ class MarkovChain(object):
         }
 
         """
-        connections = self.get_class_connections()
+        # graphviz is only needed for drawing, so it is imported on demand
+        import graphviz as gv
+
+        classes = self.class_graph()
+        labels = self.compile().labels
         graph = gv.Digraph(format = 'svg')
-        # anonymous function to extract class labels in pretty format
-        label = lambda x: '{' + ', '.join(x) + '}'
 
-        for key in connections:
-            # add node with class label
-            graph.node(label(key))
-            for val in connections[key]:
-                graph.edge(label(key), label(val))
+        # class labels in pretty format
+        names = [
+            '{' + ', '.join(str(labels[i]) for i in c) + '}'
+            for c in classes.classes
+        ]
+
+        # add classes in topological order, each with its out-going edges
+        for c in classes.topological_order():
+            graph.node(names[c])
+            for d in classes.successors(c):
+                graph.edge(names[c], names[d])
 
         return graph if return_graph else graph.source
 
@@ -448,6 +1107,8 @@ class MarkovChain(object):
          object should be returned instead of the string representation
         :returns: a representation of the chain in DOT format
         """
+        import graphviz as gv
+
         graph = gv.Digraph(format='svg')
         for st in self.states.values():
             st.populate_graph(graph)
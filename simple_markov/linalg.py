@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+# largest class solved with a sparse LU factorization when method='auto'
+DIRECT_LIMIT = 50000
+# largest class solved with a dense factorization when scipy is missing
+DENSE_LIMIT = 2000
+# default iteration limit of the power method
+POWER_MAXITER = 100000
+# default limit of GMRES restart cycles
+GMRES_MAXITER = 1000
+
+def is_sparse(matrix):
+    """
+    Checks if a matrix is a scipy sparse matrix rather than a numpy array.
+
+    :param matrix: the matrix to check
+    :returns: True if the matrix is sparse
+    """
+    return not isinstance(matrix, np.ndarray)
+
+def submatrix(matrix, idx):
+    """
+    Extracts the square submatrix with the given rows and columns.
+
+    :param matrix: a scipy.sparse matrix or a numpy array
+    :param idx: an integer array of row / column indices
+    :returns: the submatrix, of the same kind as the matrix
+    """
+    if is_sparse(matrix):
+        return matrix.tocsr()[idx][:, idx].tocsr()
+    return matrix[np.ix_(idx, idx)]
+
+def _counting_operator(matrix, counter):
+    """
+    Wraps a sparse matrix in a scipy LinearOperator that counts its
+    matrix - vector products.
+
+    :param matrix: the matrix to wrap
+    :param counter: a one-element list incremented on every product
+    :returns: the LinearOperator
+    """
+    from scipy.sparse.linalg import LinearOperator
+
+    def matvec(x):
+        counter[0] += 1
+        return matrix.dot(x)
+
+    return LinearOperator(matrix.shape, matvec=matvec, dtype=np.float64)
+
+def _balance_system(matrix):
+    """
+    Builds the linear system (P^T - I) x = 0, with its last equation
+    replaced by x[-1] = 1, which makes it non-singular for an irreducible
+    chain. Every state of such a chain has a positive probability, so the
+    solution only needs to be normalized. A unit row, unlike a row of
+    ones, keeps the system as sparse as the chain.
+
+    :param matrix: the transition matrix of an irreducible chain
+    :returns: a tuple of the system's matrix and right hand side
+    """
+    size = matrix.shape[0]
+    rhs = np.zeros(size)
+    rhs[-1] = 1.0
+
+    if is_sparse(matrix):
+        from scipy.sparse import identity, vstack, csr_matrix
+        system = (matrix.T - identity(size, format='csr')).tocsr()
+        unit = csr_matrix(([1.0], ([0], [size - 1])), shape=(1, size))
+        system = vstack([system[:-1], unit])
+        return system.tocsc(), rhs
+
+    system = matrix.T - np.eye(size)
+    system[-1] = 0.0
+    system[-1, -1] = 1.0
+    return system, rhs
+
+def _preconditioned_gmres(system, rhs, tol, maxiter, counter=None):
+    """
+    Solves a sparse linear system with restarted GMRES, preconditioned
+    with an incomplete LU factorization of the system.
+
+    :param system: the system's matrix, a scipy.sparse matrix
+    :param rhs: the right hand side
+    :param tol: the relative tolerance
+    :param maxiter: the maximum number of restart cycles, GMRES_MAXITER
+     if None
+    :param counter: if given, a one-element list incremented on every
+     matrix - vector product
+    :returns: the solution
+    """
+    from scipy.sparse.linalg import LinearOperator, gmres, spilu
+
+    system = system.tocsc()
+    try:
+        ilu = spilu(system)
+        preconditioner = LinearOperator(
+            system.shape, matvec=ilu.solve, dtype=np.float64
+        )
+    except RuntimeError:
+        # the incomplete factors are singular
+        preconditioner = None
+
+    operator = system if counter is None else \
+        _counting_operator(system, counter)
+    solution, info = gmres(
+        operator, rhs, rtol=tol, maxiter=maxiter or GMRES_MAXITER,
+        M=preconditioner
+    )
+    if info < 0:
+        raise ValueError("GMRES failed with illegal input")
+    if info > 0:
+        raise ValueError("GMRES did not converge")
+    return solution
+
+def _direct(matrix, tol, maxiter):
+    """
+    Solves the balance equations with a sparse LU factorization, or
+    a dense solve if the matrix is dense.
+    """
+    system, rhs = _balance_system(matrix)
+    if is_sparse(matrix):
+        from scipy.sparse.linalg import spsolve
+        return spsolve(system, rhs), 0
+    return np.linalg.solve(system, rhs), 0
+
+def _power(matrix, tol, maxiter):
+    """
+    Runs the power method on the lazy chain (I + P) / 2.
+    """
+    # iterate on the lazy chain (I + P) / 2, which has the same stationary
+    # distribution but is aperiodic, so that the iteration converges
+    transposed = matrix.T
+    vector = np.full(matrix.shape[0], 1.0 / matrix.shape[0])
+    iterations = 0
+    for iterations in range(1, (maxiter or POWER_MAXITER) + 1):
+        previous, vector = vector, 0.5 * (vector + transposed.dot(vector))
+        if np.abs(vector - previous).sum() < tol:
+            break
+    return vector, iterations
+
+def _gmres(matrix, tol, maxiter):
+    """
+    Solves the balance equations with preconditioned, restarted GMRES.
+    """
+    system, rhs = _balance_system(matrix)
+    counter = [0]
+    vector = _preconditioned_gmres(system, rhs, tol, maxiter, counter)
+    return vector, counter[0]
+
+def _eigs(matrix, tol, maxiter):
+    """
+    Finds the leading eigenvector of the lazy chain with ARPACK.
+    """
+    from scipy.sparse import identity
+    from scipy.sparse.linalg import eigs
+
+    # the lazy chain makes 1 the unique eigenvalue of largest modulus
+    lazy = 0.5 * (matrix.T + identity(matrix.shape[0], format='csr'))
+    counter = [0]
+    _, vectors = eigs(
+        _counting_operator(lazy.tocsr(), counter), k=1, which='LM',
+        tol=tol, maxiter=maxiter
+    )
+    return np.real(vectors[:, 0]), counter[0]
+
+METHODS = {
+    'direct': _direct,
+    'power': _power,
+    'gmres': _gmres,
+    'eigs': _eigs
+}
+
+def solve(system, rhs, method='auto', tol=1e-10, maxiter=None):
+    """
+    Solves a non-singular linear system, either with a sparse LU
+    factorization ('direct', a dense solve for numpy arrays) or with GMRES
+    preconditioned by an incomplete LU factorization ('gmres'). 'auto'
+    uses 'direct', falling back to 'gmres' if the factors of a sparse
+    system do not fit in memory.
+
+    :param system: the system's matrix, a scipy.sparse matrix or a numpy
+     array
+    :param rhs: the right hand side
+    :param method: the solver to use
+    :param tol: the relative tolerance of GMRES
+    :param maxiter: the maximum number of GMRES restart cycles,
+     GMRES_MAXITER if None
+    :returns: the solution
+    """
+    if method == 'auto':
+        if not is_sparse(system):
+            return np.linalg.solve(system, rhs)
+        from scipy.sparse.linalg import splu
+        try:
+            return splu(system.tocsc()).solve(rhs)
+        except MemoryError:
+            method = 'gmres'
+
+    if method == 'direct':
+        if is_sparse(system):
+            from scipy.sparse.linalg import splu
+            return splu(system.tocsc()).solve(rhs)
+        return np.linalg.solve(system, rhs)
+
+    if method == 'gmres':
+        return _preconditioned_gmres(system, rhs, tol, maxiter)
+
+    raise ValueError("Unknown method " + str(method))
+
+def transient_system(matrix, transient):
+    """
+    Builds the matrix I - Q of a linear system on the transient states,
+    where Q is the transition matrix restricted to them.
+
+    :param matrix: the transition matrix
+    :param transient: an integer array of the transient states
+    :returns: the matrix I - Q
+    """
+    size = len(transient)
+    if is_sparse(matrix):
+        from scipy.sparse import identity
+        return (identity(size, format='csr') -
+                submatrix(matrix, transient)).tocsc()
+    return np.eye(size) - submatrix(matrix, transient)
+
+def stationary(matrix, method='auto', tol=1e-10, maxiter=None):
+    """
+    Computes the stationary distribution of an irreducible markov chain,
+    i.e. the solution of pi * P = pi with sum(pi) = 1.
+
+    Available methods are 'direct' (sparse LU factorization, or a dense
+    solve without scipy), 'power' (power iteration on the lazy chain
+    (I + P) / 2, which also converges for periodic chains), 'gmres' and
+    'eigs' (ARPACK), the last two requiring scipy. 'auto' uses 'direct'
+    for small chains and 'gmres' or 'power' for large ones.
+
+    :param matrix: the transition matrix, a scipy.sparse matrix or a
+     numpy array
+    :param method: the solver to use
+    :param tol: the tolerance of the iterative solvers
+    :param maxiter: the maximum number of iterations of iterative solvers
+    :returns: a dict containing the stationary distribution ('vector'), the
+     method used ('method'), the number of iterations, counted in
+     matrix - vector products ('iterations'), and the 1-norm of
+     pi * P - pi ('residual')
+    """
+    size = matrix.shape[0]
+    if method == 'auto':
+        if is_sparse(matrix):
+            method = 'direct' if size <= DIRECT_LIMIT else 'gmres'
+        else:
+            method = 'direct' if size <= DENSE_LIMIT else 'power'
+    # ARPACK needs at least three states
+    if method == 'eigs' and size < 3:
+        method = 'direct'
+
+    try:
+        solver = METHODS[method]
+    except KeyError:
+        raise ValueError("Unknown method " + str(method))
+
+    vector, iterations = solver(matrix, tol, maxiter)
+
+    # remove the sign / scale ambiguity of the solvers
+    vector = np.abs(vector)
+    vector /= vector.sum()
+
+    return {
+        'vector': vector,
+        'method': method,
+        'iterations': iterations,
+        'residual': float(np.abs(matrix.T.dot(vector) - vector).sum())
+    }
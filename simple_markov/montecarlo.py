@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from simple_markov.rng import UniformBuffer
+
+# number of experiments per independent random stream; fixing it makes
+# results independent of the number of worker processes
+CHUNK_SIZE = 10000
+# number of uniform variates drawn from the generator at a time
+TOSS_BLOCK = 4096
+
+# per-process state of the pool workers, set by _init_worker()
+_worker = {}
+
+class MaskCondition(object):
+    """
+    A picklable callable that checks a state label against a boolean mask
+    over the states of a compiled chain.
+    """
+
+    def __init__(self, compiled, mask):
+        """
+        :param compiled: the CompiledChain the mask refers to
+        :param mask: a boolean array with one entry per state
+        """
+        self.index = compiled.index
+        self.mask = mask
+
+    def __call__(self, state):
+        """
+        :param state: a state label
+        :returns: the mask's entry for the state
+        """
+        return bool(self.mask[self.index[state]])
+
+def as_mask(compiled, condition):
+    """
+    Converts a declarative condition, i.e. a collection of state labels or
+    a boolean array over the compiled chain's states, to a boolean mask.
+
+    :param compiled: the CompiledChain the condition refers to
+    :param condition: a set, frozenset, list or tuple of labels, a boolean
+     numpy array with one entry per state, or a callable
+    :returns: a boolean numpy array, or None if the condition is callable
+    """
+    if callable(condition):
+        return None
+
+    if isinstance(condition, np.ndarray) and condition.dtype == bool:
+        if condition.shape != (compiled.size,):
+            raise ValueError("Condition mask must have one entry per state")
+        return condition
+
+    if isinstance(condition, (set, frozenset, list, tuple)):
+        mask = np.zeros(compiled.size, dtype=bool)
+        mask[[
+            compiled.index[key] for key in condition if key in compiled.index
+        ]] = True
+        return mask
+
+    raise TypeError(
+        "Condition must be callable, a collection of labels or a boolean mask"
+    )
+
+def as_condition(compiled, condition):
+    """
+    Converts a declarative condition to a callable accepting a state label.
+
+    :param compiled: the CompiledChain the condition refers to
+    :param condition: a condition, as accepted by as_mask()
+    :returns: a callable condition
+    """
+    mask = as_mask(compiled, condition)
+    return condition if mask is None else MaskCondition(compiled, mask)
+
+def run_chunk_vectorized(compiled, experiments, seed_seq, term_mask,
+                         hit_mask):
+    """
+    Runs a number of experiments on a compiled chain as a batch of walkers
+    advanced in lockstep, applying the conditions as boolean masks. Walkers
+    are dropped from the batch as soon as they reach a terminal state.
+
+    :param compiled: the CompiledChain to simulate
+    :param experiments: the number of experiments to run
+    :param seed_seq: the numpy.random.SeedSequence of the stream
+    :param term_mask: a boolean array marking the terminal states
+    :param hit_mask: a boolean array marking the states counted as hits
+    :returns: a tuple containing the number of hits and steps
+    """
+    rng = np.random.default_rng(seed_seq)
+    current = np.searchsorted(
+        compiled.initial_cumulative(), rng.random(experiments), side='right'
+    )
+    np.minimum(current, compiled.size - 1, out=current)
+
+    hits, steps = 0, 0
+    while current.size:
+        current = compiled.step_batch(current, rng.random(current.size))
+        steps += current.size
+        hits += int(np.count_nonzero(hit_mask[current]))
+        current = current[~term_mask[current]]
+
+    return hits, steps
+
+def run_chunk(compiled, experiments, seed_seq, term_condition, hit_condition):
+    """
+    Runs a number of experiments on a compiled chain using its own random
+    stream. Experiments run as in MarkovChain.monte_carlo_estimation().
+
+    :param compiled: the CompiledChain to simulate
+    :param experiments: the number of experiments to run
+    :param seed_seq: the numpy.random.SeedSequence of the stream
+    :param term_condition: a function accepting a state label, which
+     terminates the experiment when it returns true
+    :param hit_condition: a function accepting a state label, which counts
+     a hit when it returns true
+    :returns: a tuple containing the number of hits and steps
+    """
+    toss = UniformBuffer(seed_seq, TOSS_BLOCK).random
+    labels = compiled.labels
+
+    hits, steps = 0, 0
+    for _ in range(experiments):
+        pos = compiled.initial_state(toss())
+
+        while True:
+            pos = compiled.step(pos, toss())
+
+            steps += 1
+            state = labels[pos]
+            if hit_condition(state):
+                hits += 1
+            if term_condition(state):
+                break
+
+    return hits, steps
+
+def _init_worker(runner, compiled, term_condition, hit_condition):
+    """
+    Stores the chunk runner, the chain and the conditions once per worker
+    process, so that they are not sent along with every chunk.
+    """
+    _worker['args'] = (runner, compiled, term_condition, hit_condition)
+
+def _run_worker_chunk(task):
+    """
+    Runs a chunk of experiments in a worker process.
+
+    :param task: a tuple of the number of experiments and the seed sequence
+    """
+    runner, compiled, term_condition, hit_condition = _worker['args']
+    return runner(compiled, task[0], task[1], term_condition, hit_condition)
+
+def estimate(compiled, experiments, term_condition, hit_condition,
+             workers=None, seed=None):
+    """
+    Runs Monte Carlo experiments on a compiled chain, split into chunks of
+    CHUNK_SIZE experiments. Every chunk gets an independent stream spawned
+    from numpy.random.SeedSequence(seed), so the merged result only depends
+    on the seed and not on the number of workers.
+
+    If both conditions are declarative (see as_mask()), every chunk is run
+    by run_chunk_vectorized(), otherwise experiments are simulated one by
+    one and declarative conditions are turned into callables.
+
+    :param compiled: the CompiledChain to simulate
+    :param experiments: the number of experiments to run
+    :param term_condition: the termination condition
+    :param hit_condition: the hit condition
+    :param workers: the number of worker processes; chunks run in the
+     calling process if it is None or 1
+    :param seed: the seed of the root SeedSequence
+    :returns: a tuple containing the number of hits and steps
+    """
+    sizes = [CHUNK_SIZE] * (experiments // CHUNK_SIZE)
+    if experiments % CHUNK_SIZE:
+        sizes.append(experiments % CHUNK_SIZE)
+    tasks = list(zip(sizes, np.random.SeedSequence(seed).spawn(len(sizes))))
+
+    term_mask = as_mask(compiled, term_condition)
+    hit_mask = as_mask(compiled, hit_condition)
+    if term_mask is not None and hit_mask is not None:
+        runner, term_condition, hit_condition = \
+            run_chunk_vectorized, term_mask, hit_mask
+    else:
+        runner = run_chunk
+        term_condition = as_condition(compiled, term_condition)
+        hit_condition = as_condition(compiled, hit_condition)
+
+    if workers is None or workers == 1:
+        results = [
+            runner(compiled, size, seq, term_condition, hit_condition)
+            for size, seq in tasks
+        ]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        initargs = (runner, compiled, term_condition, hit_condition)
+        with ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker,
+                initargs=initargs) as pool:
+            results = list(pool.map(_run_worker_chunk, tasks))
+
+    # integer sums, so the merge order does not matter
+    hits = sum(r[0] for r in results)
+    steps = sum(r[1] for r in results)
+    return hits, steps
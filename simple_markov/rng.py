@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+# number of uniform variates drawn from the generator at a time by
+# random(); small, as every walker owns a buffer
+BLOCK_SIZE = 256
+# largest number of variates drawn at a time by take(), for bulk consumers
+# such as Walker.advance()
+TAKE_SIZE = 1 << 16
+
+class UniformBuffer(object):
+    """
+    A source of uniform variates in [0, 1) that draws them from a
+    numpy.random.Generator in blocks and hands them out one at a time,
+    with the interface of the random module's random(). Variates are
+    handed out in the order the generator produces them, so the sequence
+    only depends on the seed, whatever the mix of random() and take()
+    calls. Blocks are small for random() and sized to the request, up to
+    TAKE_SIZE, for take().
+
+    >>> rng = UniformBuffer(42)
+    >>> walkers = [chain.walker(child) for child in rng.spawn(100)]
+
+    """
+
+    def __init__(self, seed=None, block_size=BLOCK_SIZE):
+        """
+        :param seed: a numpy.random.Generator, or a seed for
+         numpy.random.default_rng(): None, an int or a SeedSequence
+        :param block_size: the number of variates drawn at a time by
+         random(), and at least by take()
+        """
+        if isinstance(seed, np.random.Generator):
+            self.generator = seed
+        else:
+            self.generator = np.random.default_rng(seed)
+        self.block_size = block_size
+        self._block = []
+        self._next = 0
+
+    def _refill(self, size):
+        """
+        Replaces the exhausted block with a new one.
+
+        :param size: the number of variates of the new block
+        """
+        self._block = self.generator.random(size).tolist()
+        self._next = 0
+
+    def random(self):
+        """
+        :returns: the next variate
+        """
+        i = self._next
+        if i == len(self._block):
+            self._refill(self.block_size)
+            i = 0
+        self._next = i + 1
+        return self._block[i]
+
+    def uniform(self, a, b):
+        """
+        :returns: the next variate, scaled to [a, b)
+        """
+        return a + (b - a) * self.random()
+
+    def take(self, n):
+        """
+        Returns the next variates, at most as many as are left in the
+        current block, so that callers can consume them in a loop without
+        a method call per variate.
+
+        :param n: the number of variates requested
+        :returns: a non-empty list of at most n variates
+        """
+        if self._next == len(self._block):
+            self._refill(max(self.block_size, min(n, TAKE_SIZE)))
+        start = self._next
+        self._next = min(start + n, len(self._block))
+        return self._block[start:self._next]
+
+    def spawn(self, n):
+        """
+        Creates independent streams, e.g. one per walker or worker, derived
+        from this stream's seed.
+
+        :param n: the number of streams
+        :returns: a list of new UniformBuffers
+        """
+        try:
+            generators = self.generator.spawn(n)
+        except AttributeError:
+            # numpy < 1.25
+            sequences = self.generator.bit_generator._seed_seq.spawn(n)
+            generators = [np.random.default_rng(s) for s in sequences]
+        return [UniformBuffer(g, self.block_size) for g in generators]
+
+    def jumped(self, jumps=1):
+        """
+        Creates a stream that starts far ahead of this one's generator
+        state, as if 2^127 variates had been drawn per jump (for the
+        default PCG64 bit generator).
+
+        :param jumps: the number of jumps
+        :returns: a new UniformBuffer
+        """
+        return UniformBuffer(
+            np.random.Generator(self.generator.bit_generator.jumped(jumps)),
+            self.block_size
+        )
+
+def as_rng(rng):
+    """
+    Converts the random source given to a chain or walker to an object
+    with a random() method.
+
+    :param rng: an object with a random() method, such as the random
+     module or a UniformBuffer, or a seed or numpy.random.Generator for a
+     new UniformBuffer
+    :returns: the random source
+    """
+    if hasattr(rng, 'random') and not isinstance(rng, np.random.Generator):
+        return rng
+    return UniformBuffer(rng)
@@ -1,4 +1,5 @@
 import operator
+import numpy as np
 
 def accumulate(iterable, func=operator.add):
     """
@@ -26,7 +27,8 @@ def accumulate(iterable, func=operator.add):
 def strongly_connected_components(graph):
     """
     Find the stronly connected components of a graph by applying Tarjan's
-    algorithm on a graph.
+    algorithm on a graph. The graph is converted to CSR format and handed
+    to csr_strongly_connected_components().
 
     :param graph: a graph in dict notation.
     :returns: a list containing all strongly connected components of the graph
@@ -36,65 +38,172 @@ def strongly_connected_components(graph):
         'B': {'C': 0.2, 'B': 0.8},
         'C': {'B': 0.5, 'C': 0.5}
         })
-    [{'B', 'C'}, {'A'}]
+    [{'states': {'B', 'C'}, 'type': 'closed'},
+     {'states': {'A'}, 'type': 'open'}]
 
     """
-    index, lowlinks = {}, {}
-    stack, result = [], []
-    index_counter = [0]
-
-    def connect(node):
-        # set this node's index to the smallest unused index
-        index[node] = index_counter[0]
-        lowlinks[node] = index_counter[0]
-        index_counter[0] += 1
-        stack.append(node)
-
-        try:
-            successors = graph[node]
-        except KeyError:
-            successors = []
-
-        for succ in successors:
-            if succ not in lowlinks:
-                # successor is unvisited
-                connect(succ)
-                lowlinks[node] = min(lowlinks[node], lowlinks[succ])
-            elif succ in stack:
-                # the successor is in the stack and therefore in the
-                # currently examined component
-                lowlinks[node] = min(lowlinks[node], index[succ])
-
-        # if node is a root node, generate a stronly connected component
-        if lowlinks[node] == index[node]:
-            connected_component = set()
-
-            # keep a list of reachable neighbours in order to determine
-            # if the component is closed or open
-            neighbours = set()
-            while True:
-                succ = stack.pop()
-                connected_component.add(succ)
-
-                # add all neighbours to set
-                for nb in graph[succ]:
-                    neighbours.add(nb)
-                if succ == node:
-                    break
+    # number the nodes, including successors that are not keys
+    nodes = list(graph)
+    index = {node: i for i, node in enumerate(nodes)}
+    indptr, indices = [0], []
+    for node in nodes:
+        for succ in graph[node]:
+            if succ not in index:
+                index[succ] = len(nodes)
+                nodes.append(succ)
+            indices.append(index[succ])
+        indptr.append(len(indices))
+    indptr.extend([len(indices)] * (len(nodes) + 1 - len(indptr)))
+
+    components, closed = csr_strongly_connected_components(indptr, indices)
+
+    result = [{"states": set(), "type": "closed" if c else "open"}
+              for c in closed]
+    for node, comp in zip(nodes, components):
+        result[comp]["states"].add(node)
+    return result
 
-            # check if neighbours are a subset of the connected component
-            cp_type = "closed" if neighbours <= connected_component else "open"
+def csr_strongly_connected_components(indptr, indices):
+    """
+    Finds the strongly connected components of a digraph given in CSR
+    format, where the successors of node i are indices[indptr[i]:indptr[i+1]].
+    Uses scipy.sparse.csgraph if available, or an iterative version of
+    Tarjan's algorithm otherwise, so that long paths do not hit Python's
+    recursion limit. A component is closed if no edge leaves it.
 
-            # return a dict containing component info
-            result.append({
-                "states": connected_component,
-                "type": cp_type
-            })
+    :param indptr: the row pointers of the digraph
+    :param indices: the successors of every node
+    :returns: a tuple of an integer array with the component of every node
+     and a boolean array that marks the closed components
 
-    # apply the connect() method on all nodes
-    for node in graph:
-        if node not in lowlinks:
-            connect(node)
+    >>> csr_strongly_connected_components([0, 2, 4, 6], [1, 2, 1, 2, 1, 2])
+    (array([1, 0, 0]), array([ True, False]))
 
-    return result
+    """
+    indptr = np.asarray(indptr, dtype=np.int64)
+    indices = np.asarray(indices, dtype=np.int64)
+    size = len(indptr) - 1
+
+    try:
+        from scipy.sparse import csr_matrix
+        from scipy.sparse.csgraph import connected_components
+        graph = csr_matrix(
+            (np.ones(len(indices), dtype=np.int8), indices, indptr),
+            shape=(size, size)
+        )
+        count, components = connected_components(graph, connection='strong')
+    except ImportError:
+        count, components = tarjan(indptr.tolist(), indices.tolist())
+        components = np.array(components, dtype=np.int64)
+
+    # a component is open if any of its edges leads to another component
+    sources = components[np.repeat(np.arange(size), np.diff(indptr))]
+    leaving = sources != components[indices]
+    closed = np.ones(count, dtype=bool)
+    closed[sources[leaving]] = False
+
+    return components, closed
+
+def tarjan(indptr, indices):
+    """
+    An iterative implementation of Tarjan's strongly connected components
+    algorithm on a digraph in CSR format, using an explicit call stack and
+    a flag per node for constant time on-stack checks. Components are
+    numbered in the order they are found, i.e. in reverse topological order.
+
+    :param indptr: the row pointers of the digraph, as a list
+    :param indices: the successors of every node, as a list
+    :returns: a tuple of the number of components and a list with the
+     component of every node
+    """
+    size = len(indptr) - 1
+    index, lowlink = [-1] * size, [0] * size
+    on_stack, components = [False] * size, [-1] * size
+    stack, counter, count = [], 0, 0
+
+    for root in range(size):
+        if index[root] != -1:
+            continue
+
+        index[root] = lowlink[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+
+        # call stack of (node, position of the next edge to visit)
+        calls = [(root, indptr[root])]
+        while calls:
+            node, pos = calls[-1]
+            end = indptr[node + 1]
+
+            while pos < end:
+                succ = indices[pos]
+                pos += 1
+                if index[succ] == -1:
+                    # successor is unvisited, descend into it
+                    calls[-1] = (node, pos)
+                    index[succ] = lowlink[succ] = counter
+                    counter += 1
+                    stack.append(succ)
+                    on_stack[succ] = True
+                    calls.append((succ, indptr[succ]))
+                    break
+                elif on_stack[succ] and index[succ] < lowlink[node]:
+                    # the successor is in the currently examined component
+                    lowlink[node] = index[succ]
+            else:
+                # all edges visited, return from node
+                calls.pop()
+                if lowlink[node] == index[node]:
+                    # node is a root node, pop its component
+                    while True:
+                        succ = stack.pop()
+                        on_stack[succ] = False
+                        components[succ] = count
+                        if succ == node:
+                            break
+                    count += 1
+                if calls:
+                    parent = calls[-1][0]
+                    if lowlink[node] < lowlink[parent]:
+                        lowlink[parent] = lowlink[node]
+
+    return count, components
+
+def alias_table(weights):
+    """
+    Builds the tables of Walker's alias method for a discrete distribution,
+    using Vose's linear time construction. A sample is then drawn in
+    constant time by choosing a column uniformly and either keeping it or
+    jumping to its alias.
 
+    :param weights: a sequence of non-negative weights (need not sum to 1)
+    :returns: a tuple of two lists, the acceptance probabilities of each
+     column and the column that each column aliases to
+
+    >>> alias_table([0.5, 0.25, 0.25])
+    ([1.0, 0.75, 0.75], [0, 0, 0])
+
+    """
+    size = len(weights)
+    total = float(sum(weights))
+    scaled = [float(w) * size / total for w in weights]
+    prob, alias = [1.0] * size, list(range(size))
+
+    small = [i for i, s in enumerate(scaled) if s < 1.0]
+    large = [i for i, s in enumerate(scaled) if s >= 1.0]
+
+    # pair every underfull column with an overfull one, which donates
+    # the missing mass and becomes its alias
+    while small and large:
+        less, more = small.pop(), large.pop()
+        prob[less], alias[less] = scaled[less], more
+        scaled[more] = (scaled[more] + scaled[less]) - 1.0
+        if scaled[more] < 1.0:
+            small.append(more)
+        else:
+            large.append(more)
+
+    # [NOTE: whatever is left over is full up to rounding errors, so the
+    #  acceptance probabilities keep their default value of 1.0]
+    return prob, alias
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+from simple_markov.instrumentation import metrics
+from simple_markov.rng import as_rng
+
+class Walker(object):
+    """
+    A cursor over a compiled chain, holding only its current state, the
+    number of steps it has taken and its random number generator. Walkers
+    share the compiled chain, which is never modified, so any number of
+    them can run over one chain, e.g. one per session or per thread. A
+    single walker must not be stepped by two threads at once.
+
+    >>> walker = chain.walker(seed=42)
+    >>> walker.state
+    'A'
+    >>> walker.advance(1000)
+    'B'
+    >>> walker.steps
+    1000
+
+    """
+
+    __slots__ = ('compiled', 'position', 'steps', 'rng')
+
+    def __init__(self, compiled, rng=None, state=None):
+        """
+        Creates a walker, at a given state or at one chosen from the
+        chain's initial distribution.
+
+        :param compiled: the CompiledChain to walk on
+        :param rng: an object with a random() method returning numbers in
+         [0, 1), such as a UniformBuffer or the random module, or a seed or
+         numpy.random.Generator for a new UniformBuffer (see rng.as_rng());
+         a new unseeded UniformBuffer by default
+        :param state: the label of the starting state
+        """
+        rng = as_rng(rng)
+        self.compiled = compiled
+        self.rng = rng
+        self.steps = 0
+
+        if state is None:
+            self.position = compiled.initial_state(rng.random())
+        else:
+            try:
+                self.position = compiled.index[state]
+            except KeyError:
+                raise ValueError("Unknown state " + str(state))
+
+    @property
+    def state(self):
+        """
+        The label of the walker's current state.
+        """
+        return self.compiled.labels[self.position]
+
+    def step(self):
+        """
+        Moves the walker by one step.
+
+        :returns: the label of the new state
+        """
+        self.position = self.compiled.step(self.position, self.rng.random())
+        self.steps += 1
+        if metrics.enabled:
+            metrics.count('steps')
+        return self.compiled.labels[self.position]
+
+    def advance(self, steps):
+        """
+        Moves the walker by a number of steps, without creating the labels
+        of the states in between.
+
+        :param steps: the number of steps
+        :returns: the label of the final state
+        """
+        step, position = self.compiled.step, self.position
+        take = getattr(self.rng, 'take', None)
+        if take is None:
+            toss = self.rng.random
+            for _ in range(steps):
+                position = step(position, toss())
+        else:
+            # consume the buffered variates a block at a time
+            left = steps
+            while left > 0:
+                tosses = take(left)
+                for toss in tosses:
+                    position = step(position, toss)
+                left -= len(tosses)
+
+        self.position = position
+        if steps > 0:
+            self.steps += steps
+            if metrics.enabled:
+                metrics.count('steps', steps)
+        return self.compiled.labels[position]
+
+    def run_for(self, steps):
+        """
+        Moves the walker by a number of steps, yielding every state.
+
+        :param steps: the number of steps
+        :returns: a generator of state labels
+        """
+        for _ in range(steps):
+            yield self.step()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.step()
+
+    next = __next__
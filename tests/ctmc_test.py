@@ -0,0 +1,99 @@
+import unittest
+import numpy as np
+from simple_markov import ContinuousTimeMarkovChain
+
+class TestContinuousTime(unittest.TestCase):
+    def setUp(self):
+        # a -> b -> c, with c absorbing
+        self.chain = ContinuousTimeMarkovChain(
+            {'a': 1.0},
+            {'a': [('b', 2.0), ('c', 1.0)], 'b': [('c', 1.0)], 'c': []}
+        )
+
+    def test_transient(self):
+        """
+        Tests if uniformization and expm_multiply match the closed form
+        solution of the chain.
+        """
+        t = 2.0
+        expected = [
+            np.exp(-3 * t),
+            np.exp(-t) - np.exp(-3 * t),
+            1 - np.exp(-t)
+        ]
+        for method in ['uniformization', 'expm']:
+            vector = self.chain.propagate(self.chain.initial, t, method)
+            self.assertTrue(np.allclose(vector, expected))
+
+        probs = self.chain.state_probabilities(0)
+        self.assertEqual(probs, {'a': 1.0, 'b': 0.0, 'c': 0.0})
+
+    def test_generator(self):
+        """
+        Tests if a chain built from its generator matrix matches the one
+        built from the rate table, and if bad generators are rejected.
+        """
+        matrix = [[-3, 2, 1], [0, -1, 1], [0, 0, 0]]
+        chain = ContinuousTimeMarkovChain.from_generator(
+            matrix, labels=['a', 'b', 'c'], initial={'a': 1.0}
+        )
+        self.assertTrue(np.allclose(
+            chain.generator().toarray(), self.chain.generator().toarray()
+        ))
+        self.assertTrue(np.allclose(chain.generator().toarray(), matrix))
+
+        with self.assertRaises(ValueError):
+            ContinuousTimeMarkovChain.from_generator([[-1, 2], [1, -1]])
+
+        # NaN rates are rejected up front, even on the diagonal
+        nan = float('nan')
+        for matrix in [[[-1, 1], [nan, -1]], [[nan, 1], [1, -1]]]:
+            with self.assertRaises(ValueError) as cm:
+                ContinuousTimeMarkovChain.from_generator(matrix)
+            self.assertIn('finite', cm.exception.args[0])
+        with self.assertRaises(ValueError) as cm:
+            ContinuousTimeMarkovChain({'a': 1.0}, {'a': [('b', nan)], 'b': []})
+        self.assertIn('finite', cm.exception.args[0])
+
+    def test_classes(self):
+        """
+        Tests if the classes and the stationary distribution are found
+        through the jump chain.
+        """
+        self.assertEqual(
+            self.chain.jump_chain().transition_table['a'],
+            [('b', 2 / 3.0), ('c', 1 / 3.0)]
+        )
+        classes = self.chain.communication_classes()
+        self.assertEqual(
+            [c for c in classes if c['type'] == 'closed'],
+            [{'states': {'c'}, 'type': 'closed'}]
+        )
+
+        # the stationary distribution weighs the jump chain's by the
+        # expected holding times
+        chain = ContinuousTimeMarkovChain(
+            {'On': 1.0}, {'On': [('Off', 2.0)], 'Off': [('On', 1.0)]}
+        )
+        solution = chain.stationary_distribution()[0]
+        self.assertAlmostEqual(solution['distribution']['Off'], 2 / 3.0)
+        self.assertTrue(solution['residual'] < 1e-12)
+
+    def test_simulation(self):
+        """
+        Tests if the batched Gillespie simulation is reproducible and
+        matches the transient distribution.
+        """
+        states, jumps, labels = self.chain.simulate_batch(20000, 0.5, seed=3)
+        again, _, _ = self.chain.simulate_batch(20000, 0.5, seed=3)
+        self.assertTrue((states == again).all())
+        self.assertEqual(labels, ['a', 'b', 'c'])
+        self.assertTrue((jumps <= 2).all())
+
+        frequencies = np.bincount(states, minlength=3) / 20000.0
+        expected = self.chain.propagate(self.chain.initial, 0.5)
+        self.assertTrue(np.allclose(frequencies, expected, atol=0.02))
+
+        path = self.chain.sample_path(100.0, seed=1)
+        self.assertEqual(path[0], (0.0, 'a'))
+        self.assertEqual(path[-1][1], 'c')
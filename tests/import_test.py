@@ -0,0 +1,18 @@
+import unittest, os, subprocess, sys
+
+class TestImports(unittest.TestCase):
+    def test_optional_dependencies(self):
+        """
+        Tests that importing the package does not import the optional
+        dependencies, which are only needed by some features.
+        """
+        optional = ('graphviz', 'scipy', 'matplotlib', 'networkx', 'yaml')
+        output = subprocess.check_output(
+            [sys.executable, '-c',
+             'import sys, simple_markov, simple_markov.io, '
+             'simple_markov.drawing; '
+             'print(" ".join(m for m in %r if m in sys.modules))' % (optional,)],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            universal_newlines=True
+        )
+        self.assertEqual(output.split(), [])
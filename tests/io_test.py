@@ -1,5 +1,10 @@
-import unittest, os
+import unittest, os, tempfile
+import numpy as np
 from simple_markov.io import JSON_Reader, YAML_Reader
+from simple_markov.io import JSON_StreamReader, YAML_StreamReader
+from simple_markov.io import Binary_Reader, Binary_Writer
+from simple_markov import MarkovChain
+from simple_markov.compiled import CompiledChain
 
 class TestReaders(unittest.TestCase):
     def test_yaml(self):
@@ -44,3 +49,161 @@ class TestReaders(unittest.TestCase):
             all(abs(sum([i[1] for i in table[key]]) - 1) < 0.0001 \
                 for key in table)
         )
+
+    def test_metrics(self):
+        """
+        Tests that instrumented readers record the size of the file read,
+        whether the filename is given by position or by keyword.
+        """
+        from simple_markov import metrics
+
+        directory = os.path.join(os.path.dirname(__file__), 'files')
+        json_file = os.path.join(directory, 'test.json')
+        yaml_file = os.path.join(directory, 'test.yaml')
+
+        metrics.enable()
+        try:
+            JSON_Reader(filename=json_file)
+            YAML_Reader(filename=yaml_file)
+            JSON_Reader(json_file)
+            timings = metrics.export()['timings']
+        finally:
+            metrics.disable()
+            metrics.reset()
+
+        self.assertEqual(timings['JSON_Reader']['calls'], 2)
+        self.assertEqual(timings['YAML_Reader']['last']['bytes'],
+                         os.path.getsize(yaml_file))
+
+    def test_streaming(self):
+        """
+        Tests that the streaming readers build the same compiled chain
+        as the standard readers, whatever the block size.
+        """
+        directory = os.path.join(os.path.dirname(__file__), 'files')
+        json_file = os.path.join(directory, 'test.json')
+        yaml_file = os.path.join(directory, 'test.yaml')
+
+        cases = [
+            (JSON_Reader(json_file), JSON_StreamReader(json_file, 1)),
+            (JSON_Reader(json_file), JSON_StreamReader(json_file)),
+            (YAML_Reader(yaml_file), YAML_StreamReader(yaml_file))
+        ]
+        for reader, stream_reader in cases:
+            expected = MarkovChain(
+                *reader.parse_data(), dtype='float64'
+            ).compile()
+            compiled = stream_reader.compile()
+
+            for name in ['labels', 'indptr', 'indices', 'data', 'initial']:
+                self.assertEqual(
+                    list(getattr(expected, name)),
+                    list(getattr(compiled, name))
+                )
+
+        # states with zero initial probability need not have transitions
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'zero.json')
+            with open(filename, 'w') as f:
+                f.write('{"Initial": {"A": 1, "X": 0}, '
+                        '"Table": {"A": {"A": 1}}}')
+            self.assertEqual(JSON_StreamReader(filename).compile().labels,
+                             ['A'])
+
+    def test_binary(self):
+        """
+        Tests that a chain written by Binary_Writer is read back with its
+        arrays memory-mapped from the file.
+        """
+        filename = os.path.join(os.path.dirname(__file__), 'files/test.json')
+        chain = JSON_StreamReader(filename).read_chain()
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'test.smc')
+            Binary_Writer(filename).write(chain)
+            compiled = Binary_Reader(filename).compile()
+
+            for name in ['labels', 'indptr', 'indices', 'data', 'initial']:
+                self.assertEqual(
+                    list(getattr(chain.compile(), name)),
+                    list(getattr(compiled, name))
+                )
+
+            # the data array is a view of the file's memory map
+            base = compiled.data
+            while base is not None and not isinstance(base, np.memmap):
+                base = base.base
+            self.assertIsInstance(base, np.memmap)
+            del compiled, base
+
+            # labels given as numpy arrays or scalars come back as ints
+            chains = [
+                MarkovChain.from_matrix([[0, 1], [1, 0]], np.array([10, 20])),
+                CompiledChain([np.int64(10), np.int64(20)], [0, 1, 2],
+                              [1, 0], [1.0, 1.0], [0.5, 0.5])
+            ]
+            for chain in chains:
+                Binary_Writer(filename).write(chain)
+                compiled = Binary_Reader(filename).compile()
+                self.assertEqual(compiled.labels, [10, 20])
+                self.assertEqual(list(compiled.indices), [1, 0])
+                del compiled
+
+            with open(filename, 'r+b') as f:
+                f.write(b'JUNK')
+            with self.assertRaises(ValueError):
+                Binary_Reader(filename)
+
+    def test_out_of_core(self):
+        """
+        Tests that streaming a memory-mapped chain block by block gives the
+        same distributions as the in-memory products.
+        """
+        filename = os.path.join(os.path.dirname(__file__), 'files/test.json')
+        chain = JSON_StreamReader(filename).read_chain()
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'test.smc')
+            Binary_Writer(filename).write(chain)
+            mapped = Binary_Reader(filename).read_chain()
+
+            expected = chain.state_probabilities(5)
+            for workers in [None, 2]:
+                actual = mapped.state_probabilities(
+                    5, block_size=2, workers=workers
+                )
+                self.assertEqual(set(expected), set(actual))
+                for label in expected:
+                    self.assertAlmostEqual(expected[label], actual[label])
+
+            expected = list(chain.distribution_trajectory(5))
+            actual = list(mapped.distribution_trajectory(5, block_size=2))
+            self.assertEqual([s for s, _ in expected], [s for s, _ in actual])
+            for (_, e), (_, a) in zip(expected, actual):
+                self.assertTrue(np.allclose(e, a))
+
+            # every block fits in its rows, and rows out of reach are skipped
+            compiled = mapped.compile()
+            bounds = compiled.row_blocks(2)
+            self.assertEqual((bounds[0], bounds[-1]), (0, compiled.size))
+            self.assertTrue(np.all(np.diff(bounds) > 0))
+            self.assertEqual(
+                list(compiled.vecmat_blocked(np.zeros(compiled.size), 2)),
+                [0.0] * compiled.size
+            )
+            del compiled, mapped
+
+        # blocks whose targets are scattered over the states
+        size = 50
+        states = np.arange(size)
+        compiled = CompiledChain.from_arrays(
+            np.arange(0, 2 * size + 1, 2),
+            np.stack([states * 7 % size, (states + 25) % size], 1).ravel(),
+            np.full(2 * size, 0.5)
+        )
+        vector = np.random.default_rng(1).random(size)
+        for workers in [None, 3]:
+            self.assertTrue(np.allclose(
+                compiled.vecmat_blocked(vector, 4, workers),
+                compiled.vecmat(vector)
+            ))
@@ -1,5 +1,17 @@
-import unittest
-from simple_markov import MarkovChain
+import unittest, random
+from fractions import Fraction
+import numpy as np
+from simple_markov import MarkovChain, State
+from simple_markov.compiled import CompiledChain, PowerCache
+from simple_markov.utils import alias_table, tarjan, \
+    csr_strongly_connected_components
+
+# module-level conditions, so that worker processes can unpickle them
+def reached_end(state):
+    return state in ('A', 'B')
+
+def reached_a(state):
+    return state == 'A'
 
 class TestSimulation(unittest.TestCase):
     def test_simulation_run(self):
@@ -32,6 +44,218 @@ class TestSimulation(unittest.TestCase):
         gen_exp = chain.run_for(-10)
         self.assertTrue(len(list(gen_exp)) == 0)
 
+    def test_simulate_batch(self):
+        """
+        Tests if the chain's simulate_batch() method produces valid and
+        reproducible trajectories.
+        """
+        init_probs = {'A': "0.5", 'B': "0.5", 'C': "0"}
+
+        p_table = {
+            'A': [('B', "1")],
+            'B': [('A', "0.5"), ('C', "0.5")],
+            'C': [('C', "1")]
+        }
+
+        chain = MarkovChain(init_probs, p_table)
+        paths, labels = chain.simulate_batch(500, 20, seed=7)
+        self.assertEqual(paths.shape, (500, 20))
+        self.assertEqual(labels, ['A', 'B', 'C'])
+
+        # every step must follow a transition with non-zero probability
+        allowed = {(0, 1), (1, 0), (1, 2), (2, 2)}
+        for path in paths:
+            self.assertTrue(
+                all((int(a), int(b)) in allowed for a, b in zip(path, path[1:]))
+            )
+
+        again, _ = chain.simulate_batch(500, 20, seed=7)
+        self.assertTrue((paths == again).all())
+
+    def test_walkers(self):
+        """
+        Tests if walkers over one chain are independent and reproducible,
+        also when run from several threads.
+        """
+        import threading
+
+        chain = MarkovChain.from_matrix(
+            [[0.5, 0.5, 0.0], [0.2, 0.6, 0.2], [0.0, 0.3, 0.7]],
+            labels=['A', 'B', 'C'], initial={'A': 1.0}
+        )
+        walker = chain.walker(seed=1)
+        self.assertFalse(hasattr(walker, '__dict__'))
+        self.assertEqual(walker.state, 'A')
+        expected = [walker.step() for _ in range(100)]
+
+        # interleaved walkers don't affect each other
+        first, second = chain.walker(seed=1), chain.walker(seed=2)
+        path = []
+        for _ in range(100):
+            path.append(first.step())
+            second.step()
+        self.assertEqual(path, expected)
+
+        walker = chain.walker(seed=1)
+        self.assertEqual(walker.advance(100), expected[-1])
+        self.assertEqual(walker.steps, 100)
+
+        results = {}
+        def run(seed):
+            results[seed] = list(chain.walker(seed=seed).run_for(1000))
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for seed in range(4):
+            self.assertEqual(
+                results[seed], list(chain.walker(seed=seed).run_for(1000))
+            )
+
+    def test_seeded_streams(self):
+        """
+        Tests if seeded chains, walkers and states are reproducible, and if
+        buffered variates come out in the generator's order.
+        """
+        from simple_markov.rng import UniformBuffer
+
+        values = np.random.default_rng(5).random(100).tolist()
+        rng = UniformBuffer(np.random.default_rng(5), block_size=16)
+        drawn = rng.take(10) + [rng.random() for _ in range(20)]
+        while len(drawn) < 100:
+            drawn += rng.take(100 - len(drawn))
+        self.assertEqual(drawn, values)
+
+        # single variates come from small blocks, bulk ones from large ones
+        rng = UniformBuffer(5)
+        rng.random()
+        self.assertEqual(len(rng._block), rng.block_size)
+        self.assertEqual(len(rng.take(10000)), 255)
+        self.assertEqual(len(rng.take(10000)), 10000)
+
+        chain = MarkovChain.from_matrix(
+            [[0.5, 0.5, 0.0], [0.2, 0.6, 0.2], [0.0, 0.3, 0.7]],
+            labels=['A', 'B', 'C']
+        )
+        chain.seed(11)
+        first = list(chain.run_for(200))
+        chain.seed(np.random.default_rng(11))
+        self.assertEqual(list(chain.run_for(200)), first)
+
+        paths = [list(w.run_for(50)) for w in chain.walkers(3, seed=4)]
+        again = [list(w.run_for(50)) for w in chain.walkers(3, seed=4)]
+        self.assertEqual(paths, again)
+        self.assertNotEqual(paths[0], paths[1])
+
+        state = chain.states['B']
+        self.assertEqual(
+            [state.next_state(UniformBuffer(2)) for _ in range(5)],
+            [state.next_state(UniformBuffer(2)) for _ in range(5)]
+        )
+
+    def test_fit(self):
+        """
+        Tests if a chain fitted to simulated paths recovers the transition
+        probabilities, and if chunked and merged counts match.
+        """
+        from simple_markov import fitting
+
+        chain = MarkovChain.from_matrix(
+            [[0.5, 0.5, 0.0], [0.2, 0.6, 0.2], [0.0, 0.3, 0.7]],
+            labels=['A', 'B', 'C']
+        )
+        paths, labels = chain.simulate_batch(200, 100, seed=3)
+
+        fitted = MarkovChain.fit(paths, labels=range(3))
+        self.assertTrue(np.allclose(
+            fitted.compile().matrix().toarray(),
+            chain.compile().matrix().toarray(), atol=0.03
+        ))
+
+        # split every path in two chunks, counted by two counters
+        first = fitting.TransitionCounter(range(3))
+        second = fitting.TransitionCounter()
+        for i, path in enumerate(paths):
+            counter = first if i % 2 else second
+            counter.update(path[:40])
+            counter.update(path[40:], continued=True)
+        merged = first.merge(second).to_chain()
+
+        self.assertEqual(first.total, 200 * 99)
+        self.assertTrue(np.allclose(
+            merged.compile().data, fitted.compile().data
+        ))
+        self.assertEqual(merged.initial_probs, fitted.initial_probs)
+
+        # states that are never left become absorbing
+        self.assertEqual(
+            MarkovChain.fit(['AB']).transition_table['B'], [('B', 1.0)]
+        )
+
+class TestSampling(unittest.TestCase):
+    def test_alias_table(self):
+        """
+        Tests that an alias table preserves the mass of every column.
+        """
+        weights = [0.1, 0.05, 0.5, 0.2, 0.15]
+        prob, alias = alias_table(weights)
+
+        # each column keeps prob[i] and gives the rest to its alias
+        mass = [0.0] * len(weights)
+        for i, (p, a) in enumerate(zip(prob, alias)):
+            mass[i] += p / len(weights)
+            mass[a] += (1 - p) / len(weights)
+
+        self.assertTrue(
+            all(abs(m - w) < 1e-12 for m, w in zip(mass, weights))
+        )
+
+    def test_next_state(self):
+        """
+        Tests that State.next_state() follows the transition distribution.
+        """
+        random.seed(42)
+        N = 20000
+
+        state = State([('A', "0.2"), ('B', "0.5"), ('C', "0.3")], 'A')
+        samples = [state.next_state() for _ in range(N)]
+
+        self.assertTrue(abs(samples.count('A') / N - 0.2) < 0.02)
+        self.assertTrue(abs(samples.count('B') / N - 0.5) < 0.02)
+        self.assertTrue(abs(samples.count('C') / N - 0.3) < 0.02)
+        self.assertTrue(state.next_state_exact() in {'A', 'B', 'C'})
+
+    def test_step_batch(self):
+        """
+        Tests that batched steps pick the right transition within every
+        row, even for tiny probabilities of states with a large index.
+        """
+        size = 1 << 21
+        states = np.arange(size)
+        compiled = CompiledChain.from_arrays(
+            np.arange(0, 2 * size + 1, 2),
+            np.stack([states, (states + 1) % size], axis=1).ravel(),
+            np.tile([1e-9, 1 - 1e-9], size)
+        )
+        self.assertTrue(np.all(compiled.cumulative()[::2] == 1e-9))
+
+        current = np.array([0, size - 1, size - 1, size - 1])
+        tosses = np.array([5e-10, 5e-10, 2e-9, 0.999999])
+        self.assertEqual(
+            list(compiled.step_batch(current, tosses)), [0, size - 1, 0, 0]
+        )
+
+        # rows of different lengths
+        compiled = CompiledChain.from_arrays(
+            [0, 1, 4, 6], [0, 0, 1, 2, 1, 2], [1, 0.2, 0.3, 0.5, 0.5, 0.5]
+        )
+        current = np.array([0, 1, 1, 1, 2, 2])
+        tosses = np.array([0.9, 0.1, 0.3, 0.6, 0.2, 0.7])
+        self.assertEqual(
+            list(compiled.step_batch(current, tosses)), [0, 0, 1, 2, 1, 2]
+        )
+
 class TestComponents(unittest.TestCase):
     def test_arbitrary_labels(self):
         """
@@ -136,6 +360,38 @@ class TestComponents(unittest.TestCase):
         self.assertTrue({'C', 'D'} in states)
         self.assertTrue({'A', 'B'} in states)
 
+    def test_class_connections(self):
+        """
+        Tests if the connections between communication classes are found
+        properly and the class graph is topologically ordered.
+        """
+        init_probs = {'A': "0.25", 'B': "0.25", 'C': "0.25", 'D': "0.25",
+                      'E': "0"}
+
+        p_table = {
+            'A': [('A', "0.5"), ('B', "0.5")],
+            'B': [('A', "0.8"), ('C', "0.1"), ('E', "0.1")],
+            'C': [('C', "0.9"), ('D', "0.1")],
+            'D': [('C', "0.5"), ('E', "0.5")],
+            'E': [('E', "1.0")]
+        }
+
+        chain = MarkovChain(init_probs, p_table)
+        connections = chain.get_class_connections()
+        self.assertEqual(len(connections), 3)
+        self.assertEqual(
+            sorted(connections[('A', 'B')]), [('C', 'D'), ('E',)]
+        )
+        self.assertEqual(connections[('C', 'D')], [('E',)])
+        self.assertEqual(connections[('E',)], [])
+
+        graph = chain.class_graph()
+        position = {c: i for i, c in enumerate(graph.topological_order())}
+        self.assertEqual(len(position), graph.size)
+        for c in range(graph.size):
+            for d in graph.successors(c):
+                self.assertTrue(position[c] < position[d])
+
     def test_bad_initial_probs(self):
         """
         Tests if a bad initial distribution is caught and an exception
@@ -197,6 +453,124 @@ class TestComponents(unittest.TestCase):
         except ValueError as e:
             self.assertEqual(e.args[0], err_string)
             flag = True
+    def test_float_mode(self):
+        """
+        Tests if a chain built in float64 mode matches the exact one, and
+        if all bad rows are reported at once.
+        """
+        init_probs = {'A': "0.25", 'B': "0.25", 'C': "0.25", 'D': "0.25"}
+
+        p_table = {
+            'A': [('A', "0.5"), ('B', "0.5"), ('C', "0")],
+            'B': [('A', "0.2"), ('B', "0.6"), ('C', "0.2")],
+            'C': [('D', "0.5"), ('C', "0.5")],
+            'D': [('C', "0.9"), ('D', "0.1")]
+        }
+
+        exact = MarkovChain(init_probs, p_table)
+        fast = MarkovChain(init_probs, p_table, dtype='float64')
+
+        for name in ['labels', 'indptr', 'indices', 'data', 'initial']:
+            self.assertEqual(
+                list(getattr(exact.compile(), name)),
+                list(getattr(fast.compile(), name))
+            )
+        self.assertEqual(fast.states['C'].prob, {'D': 0.5, 'C': 0.5})
+
+        p_table['A'] = [('A', 0.5), ('B', 0.6)]
+        p_table['D'] = [('C', 1.9), ('D', -0.9)]
+        err_string = ("Transitions from states A, D do not form "
+                      "probability distributions")
+        with self.assertRaises(ValueError) as cm:
+            MarkovChain(init_probs, p_table, dtype='float64')
+        self.assertEqual(cm.exception.args[0], err_string)
+
+        # NaN is neither a probability nor part of one
+        nan = float('nan')
+        with self.assertRaises(ValueError):
+            MarkovChain.from_matrix([[nan, 0.5], [0.5, 0.5]])
+        with self.assertRaises(ValueError):
+            MarkovChain.from_matrix([[0.5, 0.5], [0.5, 0.5]],
+                                    initial=[nan, 1])
+        p_table['A'] = [('A', nan), ('B', 1.0)]
+        p_table['D'] = [('C', 0.9), ('D', 0.1)]
+        with self.assertRaises(ValueError):
+            MarkovChain(init_probs, p_table, dtype='float64')
+
+    def test_from_matrix(self):
+        """
+        Tests if chains built from dense and sparse matrices match, and if
+        the arrays of a CSR matrix are adopted without copying.
+        """
+        from scipy.sparse import csr_matrix
+
+        dense = np.array([[0.5, 0.5, 0.0], [0.2, 0.6, 0.2], [0.0, 0.0, 1.0]])
+        sparse = csr_matrix(dense)
+        labels = ['A', 'B', 'C']
+
+        first = MarkovChain.from_matrix(dense, labels, initial={'A': 1.0})
+        second = MarkovChain.from_sparse(sparse, labels, initial=[1, 0, 0])
+        self.assertTrue(np.shares_memory(second.compile().data, sparse.data))
+        self.assertEqual(first.initial_probs, {'A': 1.0})
+
+        for steps in [1, 5]:
+            probs = first.state_probabilities(steps)
+            for key, value in second.state_probabilities(steps).items():
+                self.assertAlmostEqual(probs[key], value)
+        self.assertEqual(first.transition_table['C'], [('C', 1.0)])
+
+        dense[2, 0] = 0.5
+        with self.assertRaises(ValueError) as cm:
+            MarkovChain.from_matrix(dense, labels)
+        self.assertEqual(cm.exception.args[0],
+                         "Transitions from state C do not form a "
+                         "probability distribution")
+
+    def test_mutation(self):
+        """
+        Tests if rows can be replaced and states added or removed, keeping
+        the compiled chain consistent with a freshly built one.
+        """
+        init_probs = {'A': "1", 'B': "0", 'C': "0"}
+        p_table = {
+            'A': [('A', "0.5"), ('B', "0.5")],
+            'B': [('A', "0.5"), ('B', "0.5")],
+            'C': [('C', "1")]
+        }
+        chain = MarkovChain(init_probs, p_table)
+        compiled = chain.compile()
+        compiled.cumulative()
+        components = compiled.components()
+
+        # same targets, so the classes are kept
+        chain.update_row('B', {'A': "0.25", 'B': "0.75"})
+        self.assertIs(chain.compile().components(), components)
+        self.assertEqual(chain.states['B'].prob['B'], Fraction(3, 4))
+        self.assertEqual(p_table['B'], [('A', "0.5"), ('B', "0.5")])
+
+        chain.add_state('D', [('C', "0.5"), ('D', "0.5")])
+        chain.update_row('B', [('A', "0.5"), ('D', "0.5")])
+        self.assertEqual(len(chain.communication_classes()), 3)
+
+        with self.assertRaises(ValueError):
+            chain.remove_state('D')
+        with self.assertRaises(ValueError):
+            chain.update_row('A', [('E', "1")])
+
+        fresh = MarkovChain(init_probs, chain.transition_table).compile()
+        compiled = chain.compile()
+        for name in ['labels', 'indptr', 'indices', 'data', 'initial']:
+            self.assertEqual(
+                list(getattr(fresh, name)), list(getattr(compiled, name))
+            )
+        self.assertTrue(np.allclose(fresh.cumulative(), compiled.cumulative()))
+
+        chain.update_row('B', [('A', "0.5"), ('B', "0.5")])
+        chain.remove_state('D')
+        self.assertEqual(chain.compile().labels, ['A', 'B', 'C'])
+        self.assertEqual(chain.compile().components()[0].tolist(),
+                         components[0].tolist())
+
     def test_monte_carlo(self):
         """
         Tests if monte carlo method functions properly
@@ -240,3 +614,336 @@ class TestComponents(unittest.TestCase):
         hits, steps = m.monte_carlo_estimation(N, game_ended, a_won)
         self.assertTrue(hits > 7250 and hits < 7480)
         self.assertTrue(steps > 64000 and steps < 65500)
+
+    def test_monte_carlo_parallel(self):
+        """
+        Tests if parallel monte carlo estimation is reproducible regardless
+        of the number of workers.
+        """
+        init_probs = {'S': "1"}
+
+        markov_table = {
+            'S': [('S', "0.2"), ('A', "0.5"), ('B', "0.3")],
+            'A': [('A', "1")],
+            'B': [('B', "1")]
+        }
+
+        m = MarkovChain(init_probs, markov_table)
+        serial = m.monte_carlo_estimation(
+            25000, reached_end, reached_a, seed=1234
+        )
+        parallel = m.monte_carlo_estimation(
+            25000, reached_end, reached_a, workers=3, seed=1234
+        )
+        self.assertEqual(serial, parallel)
+
+        # hits before absorption: 0.5 / 0.8, expected steps: 1 / 0.8
+        hits, steps = serial
+        self.assertTrue(abs(hits / 25000 - 0.625) < 0.02)
+        self.assertTrue(abs(steps / 25000 - 1.25) < 0.02)
+
+    def test_monte_carlo_declarative(self):
+        """
+        Tests if monte carlo estimation accepts label sets and boolean masks
+        as conditions.
+        """
+        m = MarkovChain(
+            {'S': "1"},
+            {
+                'S': [('S', "0.2"), ('A', "0.5"), ('B', "0.3")],
+                'A': [('A', "1")],
+                'B': [('B', "1")]
+            }
+        )
+        labels = m.compile().labels
+        hit_mask = np.array([label == 'A' for label in labels])
+
+        by_set = m.monte_carlo_estimation(25000, {'A', 'B'}, {'A'}, seed=5)
+        by_mask = m.monte_carlo_estimation(25000, {'A', 'B'}, hit_mask, seed=5)
+        self.assertEqual(by_set, by_mask)
+
+        hits, steps = by_set
+        self.assertTrue(abs(hits / 25000 - 0.625) < 0.02)
+        self.assertTrue(abs(steps / 25000 - 1.25) < 0.02)
+
+        # the exact answers of the same questions
+        self.assertAlmostEqual(m.absorption_probabilities({'A'})['S'], 0.625)
+        self.assertAlmostEqual(
+            m.expected_hitting_times({'A', 'B'})['S'], 1.25
+        )
+
+        # mixing a callable and a set falls back to the per-step loop
+        hits, steps = m.monte_carlo_estimation(5000, reached_end, {'A'})
+        self.assertTrue(abs(hits / 5000 - 0.625) < 0.04)
+
+class TestAnalysis(unittest.TestCase):
+    def setUp(self):
+        # unfair coin from the README
+        self.chain = MarkovChain(
+            {'Heads': "0.5", 'Tails': "0.5"},
+            {
+                'Heads': [('Heads', "1.0")],
+                'Tails': [('Heads', "0.2"), ('Tails', "0.8")]
+            }
+        )
+
+    def test_compile(self):
+        """
+        Tests if the compiled chain matches the transition table.
+        """
+        compiled = self.chain.compile()
+        self.assertEqual(compiled.labels, ['Heads', 'Tails'])
+        self.assertEqual(compiled.indptr.tolist(), [0, 1, 3])
+        self.assertEqual(compiled.indices.tolist(), [0, 0, 1])
+        self.assertEqual(compiled.data.tolist(), [1.0, 0.2, 0.8])
+        self.assertFalse(compiled.data.flags.writeable)
+        self.assertTrue(self.chain.compile() is compiled)
+
+    def test_state_probabilities(self):
+        """
+        Tests if the state probabilities after N steps are computed
+        properly.
+        """
+        probs = self.chain.state_probabilities(3)
+        self.assertAlmostEqual(probs['Heads'], 0.744)
+        self.assertAlmostEqual(probs['Tails'], 0.256)
+
+        # numpy integers are accepted as well
+        probs = self.chain.state_probabilities(np.int64(3))
+        self.assertAlmostEqual(probs['Heads'], 0.744)
+
+        probs = self.chain.state_probabilities()
+        self.assertAlmostEqual(probs['Heads'], 0.6)
+        self.assertAlmostEqual(probs['Tails'], 0.4)
+
+    def test_propagation_strategies(self):
+        """
+        Tests if repeated products and repeated squaring agree on the
+        distribution after many steps.
+        """
+        compiled = self.chain.compile()
+        steps = 5000
+
+        # the 2-state chain is small enough for squaring to be chosen
+        self.assertTrue(compiled.use_squaring(steps))
+        squared = compiled.propagate(compiled.initial, steps)
+
+        vector = compiled.initial
+        for _ in range(steps):
+            vector = compiled.vecmat(vector)
+        self.assertTrue(abs(squared - vector).max() < 1e-12)
+
+        self.assertEqual(
+            self.chain.state_probabilities(0), {'Heads': 0.5, 'Tails': 0.5}
+        )
+
+    def test_metrics(self):
+        """
+        Tests if instrumented calls are recorded only while the metrics
+        are enabled, and passed on to callbacks.
+        """
+        from simple_markov import metrics
+
+        events = []
+        self.chain.state_probabilities(3)
+        self.assertEqual(metrics.export()['timings'], {})
+
+        metrics.enable()
+        metrics.add_callback(events.append)
+        try:
+            self.chain.state_probabilities(3)
+            list(self.chain.run_for(20))
+            exported = metrics.export()
+        finally:
+            metrics.disable()
+            metrics.remove_callback(events.append)
+            metrics.reset()
+
+        self.assertEqual(exported['counters']['steps'], 20)
+        timing = exported['timings']['state_probabilities']
+        self.assertEqual(timing['calls'], 1)
+        self.assertEqual(timing['last']['states'], 2)
+        self.assertEqual(
+            [e['name'] for e in events], ['state_probabilities']
+        )
+
+    def test_power_cache(self):
+        """
+        Tests if cached matrix powers give the same distributions, are
+        reused across horizons and respect the memory budget.
+        """
+        expected = self.chain.state_probabilities(1000)
+        cache = self.chain.cache_powers()
+
+        self.chain.state_probabilities(512)
+        self.assertEqual(cache.stats()['misses'], 9)
+        probs = self.chain.state_probabilities(1000)
+        self.assertEqual(cache.stats()['hits'], 9)
+        for key, value in expected.items():
+            self.assertAlmostEqual(probs[key], value)
+
+        # the cache follows the chain through modifications
+        self.chain.update_row('Heads', {'Heads': "1"})
+        self.assertEqual(cache.stats()['entries'], 0)
+        self.chain.state_probabilities(1000)
+        self.assertEqual(cache.stats()['hits'], 9)
+        self.assertEqual(cache.stats()['misses'], 18)
+
+        # powers that cannot all fit bypass the cache
+        compiled = self.chain.compile()
+        power = compiled.matrix()
+        cache = self.chain.cache_powers(2 * compiled._filled_bytes())
+        probs = self.chain.state_probabilities(1000)
+        self.assertEqual(cache.stats()['misses'], 0)
+        for key, value in expected.items():
+            self.assertAlmostEqual(probs[key], value)
+
+        # the least recently used powers are evicted
+        cache = PowerCache(2 * cache.size_of(power))
+        for level in range(1, 4):
+            power = cache.get(level, power)
+        self.assertEqual(cache.stats()['entries'], 2)
+        self.assertTrue(cache.nbytes <= cache.max_bytes)
+        self.assertIsNone(cache.cached(1))
+
+        # horizons cheaper with vector - matrix products do not square
+        size = 200
+        ring = MarkovChain.from_compiled(CompiledChain.from_arrays(
+            np.arange(size + 1), (np.arange(size) + 1) % size,
+            np.ones(size), initial=np.full(size, 1.0 / size)
+        ))
+        cache = ring.cache_powers()
+        ring.state_probabilities(64)
+        self.assertEqual(cache.stats()['misses'], 0)
+
+    def test_distribution_trajectory(self):
+        """
+        Tests if the distribution trajectory agrees with state_probabilities
+        and stops early once it has converged.
+        """
+        trajectory = list(self.chain.distribution_trajectory(6, every=3))
+        self.assertEqual([t for t, _ in trajectory], [3, 6])
+
+        labels = self.chain.compile().labels
+        for step, vector in trajectory:
+            probs = self.chain.state_probabilities(step)
+            for label, p in zip(labels, vector):
+                self.assertAlmostEqual(probs[label], p)
+
+        trajectory = list(
+            self.chain.distribution_trajectory(1000, every=100, tol=1e-6)
+        )
+        self.assertTrue(trajectory[-1][0] < 100)
+
+    def test_stationary_distribution(self):
+        """
+        Tests if every solver finds the stationary distribution of each
+        closed class, including a periodic one.
+        """
+        chain = MarkovChain(
+            {'A': "0.25", 'B': "0.25", 'C': "0.25", 'D': "0.25", 'E': "0"},
+            {
+                'A': [('B', "1.0")],
+                'B': [('A', "0.5"), ('C', "0.5")],
+                'C': [('B', "1.0")],
+                'D': [('D', "0.5"), ('E', "0.5")],
+                'E': [('E', "1.0")]
+            }
+        )
+        expected = [{'E': 1.0}, {'A': 0.25, 'B': 0.5, 'C': 0.25}]
+
+        for method in ['auto', 'direct', 'power', 'gmres', 'eigs']:
+            result = chain.stationary_distribution(method)
+            result.sort(key=lambda x: len(x['states']))
+            self.assertEqual(len(result), 2)
+
+            for res, exp in zip(result, expected):
+                self.assertEqual(res['states'], set(exp))
+                self.assertTrue(res['residual'] < 1e-8)
+                for label, p in exp.items():
+                    self.assertAlmostEqual(res['distribution'][label], p)
+
+    def test_stationary_large(self):
+        """
+        Tests if the balance system of a long birth-death chain stays as
+        sparse as the chain, so that it is solved directly in no time.
+        """
+        from simple_markov import linalg
+        from scipy.sparse import diags
+
+        size = 20000
+        matrix = diags(
+            [np.full(size - 1, 0.25), np.full(size, 0.5),
+             np.full(size - 1, 0.25)], [-1, 0, 1], format='lil'
+        )
+        matrix[0, 0] = matrix[size - 1, size - 1] = 0.75
+        matrix = matrix.tocsr()
+
+        system, _ = linalg._balance_system(matrix)
+        self.assertTrue(system.nnz <= matrix.nnz + 1)
+        for method in ['direct', 'gmres']:
+            result = linalg.stationary(matrix, method)
+            self.assertTrue(np.allclose(result['vector'], 1.0 / size))
+
+    def test_absorption(self):
+        """
+        Tests absorption probabilities and expected hitting times on a
+        gambler's ruin chain, which has closed form solutions.
+        """
+        # fair gambler's ruin on 0..4
+        p_table = {0: [(0, "1")], 4: [(4, "1")]}
+        for i in range(1, 4):
+            p_table[i] = [(i - 1, "0.5"), (i + 1, "0.5")]
+        chain = MarkovChain({2: "1"}, p_table)
+
+        for method in ['direct', 'gmres']:
+            probs = chain.absorption_probabilities({4}, method=method)
+            times = chain.expected_hitting_times({0, 4}, method=method)
+            for i in range(5):
+                self.assertAlmostEqual(probs[i], i / 4)
+                self.assertAlmostEqual(times[i], i * (4 - i))
+
+        # 'auto' falls back to GMRES if the LU factors do not fit
+        from unittest import mock
+        with mock.patch('scipy.sparse.linalg.splu', side_effect=MemoryError):
+            probs = chain.absorption_probabilities({4})
+        self.assertAlmostEqual(probs[2], 0.5)
+
+        # ruin before reaching 3, and hitting 4 may never happen
+        probs = chain.absorption_probabilities({0}, avoid={3})
+        self.assertAlmostEqual(probs[2], 1 / 3)
+        self.assertEqual(probs[4], 0.0)
+        times = chain.expected_hitting_times({4})
+        self.assertEqual(times[2], float('inf'))
+        self.assertEqual(times[4], 0.0)
+
+    def test_long_path(self):
+        """
+        Tests if communication classes are found on a chain with a path
+        much longer than Python's recursion limit.
+        """
+        N = 20000
+        p_table = {i: [(i + 1, "1")] for i in range(N)}
+        p_table[N] = [(N, "1")]
+
+        classes = MarkovChain({0: "1"}, p_table).communication_classes()
+        self.assertEqual(len(classes), N + 1)
+        self.assertTrue({'states': {N}, 'type': 'closed'} in classes)
+
+    def test_tarjan(self):
+        """
+        Tests if the iterative Tarjan implementation agrees with the
+        components found through scipy.
+        """
+        rng = np.random.default_rng(3)
+        size, degree = 300, 2
+        indices = rng.integers(0, size, size * degree)
+        indptr = np.arange(0, size * degree + 1, degree)
+
+        count, components = tarjan(indptr.tolist(), indices.tolist())
+        expected, _ = csr_strongly_connected_components(indptr, indices)
+        self.assertEqual(count, len(set(expected.tolist())))
+
+        # same partition, up to the numbering of the components
+        pairs = set(zip(components, expected.tolist()))
+        self.assertEqual(len(pairs), count)